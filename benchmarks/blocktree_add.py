@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Measure how long `BlockTree.add` takes to load a linear chain of blocks.
+
+Usage (from the repository's root folder):
+    python3 benchmarks/blocktree_add.py [BLOCK_COUNT [STEP]]
+
+The time taken by every STEP blocks is printed, so that a cost growing with
+the chain's height shows up.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from kmacoin.globaldef.hash import HASH_OF_NULL  # noqa: E402
+from kmacoin.atnode.structures.blocktree import BlockTree  # noqa: E402
+
+
+def main(block_count: int, step: int) -> None:
+    # random IDs, generated beforehand so that only `add` is measured
+    block_ids = [os.urandom(32) for _ in range(block_count)]
+
+    block_tree = BlockTree()
+    prev_id = HASH_OF_NULL
+    start_time = step_time = time.perf_counter()
+    for i, block_id in enumerate(block_ids, 1):
+        block_tree.add(block_id, prev_id)
+        prev_id = block_id
+
+        if i % step == 0:
+            now = time.perf_counter()
+            print("{} blocks: {:.2f}s (last {}: {:.2f}s)".format(
+                i, now - start_time, step, now - step_time))
+            step_time = now
+
+    print("total: {} blocks in {:.2f}s".format(
+        block_count, time.perf_counter() - start_time))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 10000)
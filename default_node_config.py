@@ -5,18 +5,35 @@ DEFAULT_NODE_CONFIG = {
     "LISTENING_ADDRESS": None,
     "PUBLIC_ADDRESS": None,
 
-    "TRANSACTION_ID_POOL_SIZE": 20,
-    "BLOCK_ID_POOL_SIZE": 5,
+    "TRANSACTION_ID_POOL_SIZE": 1000000,
+    "BLOCK_ID_POOL_SIZE": 100000,
+    "ID_POOL_FALSE_POSITIVE_RATE": 0.000001,
     "ADDRESS_POOL_SIZE": 10,
     "TOKEN_POOL_SIZE": 10,
 
+    "MEMPOOL_SIZE": 1000000,  # bytes
+    "ORPHAN_TRANSACTION_POOL_SIZE": 100,
+    "ORPHAN_TRANSACTIONS_PER_PEER": 25,
+    "ORPHAN_TRANSACTION_EXPIRY": 600,  # seconds
+    "ORPHAN_BLOCK_POOL_SIZE": 100,
+    "ORPHAN_BLOCK_EXPIRY": 600,  # seconds
+
+    "PRUNE_DEPTH": None,  # blocks, None to keep every side branch
+    "PRUNE_BLOCK_FILES": False,  # also delete the pruned blocks' files
+
     "MINER_MODULE": "lazyminer",  # the module to import `LazyMiner` from
     "HASH_RATE": 10,  # hashes per second
 
     "PEERS_RANGE": (2, 10),
+    "SYNC_PEERS": 4,  # nodes to download blocks from at once when syncing
+    "PEER_QUEUE_SIZE": 10000,  # commands, announcements are dropped above
+    "PEER_MAX_LAG": 60,  # seconds a command may wait before disconnecting
+    "MAX_CONCURRENT_DIALS": 8,  # connection attempts in progress at once
+    "DIAL_FAILURE_EXPIRY": 300,  # seconds a failed address is skipped
 
     "CONNECTION_TIMEOUT": 10,  # seconds
     "PEER_TIMEOUT": 300,  # seconds
+    "FRAME_CHECKSUM": False,  # ask peers to checksum every message
 
     "VERBOSE": True,
     "HEX_STRING_LENGTH": 15  # characters
@@ -1,17 +1,25 @@
 from kmacoin.globaldef.hash import HASH_OF_NULL
 from kmacoin.objects.block import Block
-from kmacoin.objects.xstate import ExtendedState
+from kmacoin.objects.xstate import ExtendedState, BlockError
 from kmacoin.atnode.structures.pool import Pool
+from kmacoin.atnode.structures.rollingfilter import RollingBloomFilter
 from kmacoin.atnode.structures.statecache import StateCache
 from kmacoin.atnode.structures.blocktree import BlockTree
+from kmacoin.atnode.structures.blockindexfile import BlockIndexFile
+from kmacoin.atnode.structures.statefile import StateFile
+from kmacoin.atnode.structures.mempool import Mempool
+from kmacoin.atnode.structures.orphanpool import OrphanPool
+from kmacoin.atnode.structures.orphanblockpool import OrphanBlockPool
 
-from typing import Dict, Any, Tuple
+from typing import Dict, List, Any, Tuple, Optional
 from queue import Queue
 from threading import Lock, Condition, Semaphore
 
+import asyncio
 import copy
 import random
 import os
+import time
 
 
 class Node(object):
@@ -24,6 +32,9 @@ class Node(object):
         block_tree: the block tree represented by a list of list of block IDs
             of a same height.
         block_tree_lock: a lock must be acquired before update the block tree.
+        prune_depth: side branches forked more than `prune_depth` blocks below
+            the top block are pruned, None to keep every side branch.
+        prune_block_files: True if the pruned blocks' files are deleted.
         vis_block_q: a block queue which is used to send blocks to the block
             tree visualizer
 
@@ -34,6 +45,12 @@ class Node(object):
             of the two lists. Furthermore, when `len(unconnected_addrs)`
             changes from 0 to 1, `notify` on this variable needs to be called
             to wake up threads sleep when `unconnected_addrs` is empty.
+        unvalidated_addrs: address -> the wrapped address (XObject), of the
+            unconnected addresses which have not been validated yet, to be
+            broadcast once a connection to them succeeds.
+        failed_addrs: address -> expiration time, of the addresses which
+            could not be connected to recently. They are not added to the
+            unconnected address list until they expire.
 
         name: the node's name
         virt_loc: the node's virtual location
@@ -42,18 +59,31 @@ class Node(object):
         public_addr: the node's listening address as seen from the outside.
 
         data_dir: where the node stores its data.
+        block_index_file: the file where the block tree is persisted.
+        top_state_file: the file where the top block's state is persisted.
 
-        tx_id_pool: a set of recently received transaction IDs.
-        block_id_pool: a set of recently received block IDs.
+        tx_id_pool: a filter of recently received transaction IDs.
+        block_id_pool: a filter of recently received block IDs.
         addr_pool: a set of recently received addresses.
         token_pool: a set of recently given tokens.
 
-        tx_queue: the transaction queue.
+        mempool: the pool of valid unconfirmed transactions, built on the
+            top block of the block tree.
+        orphan_tx_pool: the pool of transactions waiting for their parents.
+        orphan_block_pool: the pool of blocks waiting for their previous
+            blocks.
+
+        change_cv: a condition variable, notified when the top block of the
+            block tree or the mempool changes.
+        change_count: incremented every time `change_cv` is notified.
+
+        tx_queue: the queue of received transactions waiting to be validated.
         block_queue: the block queue.
         addr_queue: the address queue.
         valid_obj_queue: the valid object queue.
         orphan_queue: the queue of orphaned blocks
 
+        loop: the event loop where the node's peer connections are served.
         client_cmd_queues: a list of client command queues.
         client_cmd_queues_cv: a condition variable, synchronizing accesses to
             `client_cmd_queues`. `notify` on this variable needs to be called
@@ -67,9 +97,23 @@ class Node(object):
         min_peers: the minimum number of peers required.
         max_peers: the maximum number of peers required.
         peers_smp: a semaphore, used to limit the number of peers.
+        max_dials: the maximum number of connection attempts in progress at
+            once.
+        dial_count: the number of connection attempts in progress, updated
+            with `client_cmd_queues_cv` acquired.
+        dial_failure_expiry: how long (in seconds) a failed address is
+            remembered.
+        sync_peers: the number of nodes to download blocks from at once when
+            syncing.
+        peer_queue_size: the number of commands queued for a peer above which
+            announcements to the peer are dropped.
+        max_peer_lag: how long (in seconds) a command may wait for a peer
+            before the peer is disconnected.
 
         connection_timeout: timeout value for connection establishment.
         peer_timeout: timeout value for peer link inactivity.
+        frame_checksum: True if the node asks its peers to checksum every
+            message.
 
         verbose: indicates whether workers should print out useful info.
         hexlen: maximum hex string length.
@@ -79,10 +123,21 @@ class Node(object):
     # This parameter decides the state cache's size:
     STATE_CACHE_SIZE = 5
 
+    # States of blocks at heights multiple of this parameter are cached when
+    # a branch of blocks is added:
+    STATE_CHECKPOINT_INTERVAL = 100
+
     # This parameter decides the data directory tree's height:
     DIR_DEPTH = 2
 
-    # Name of the file where block IDs are stored.
+    # Name of the file where the block tree is persisted.
+    BLOCK_INDEX_FILENAME = "block_index.data"
+
+    # Name of the file where the top block's state is persisted.
+    TOP_STATE_FILENAME = "top_state.data"
+
+    # Name of the file where block IDs used to be stored, before the block
+    # tree was persisted:
     BLOCK_ID_FILENAME = "block_ids.data"
 
     def __init__(self, conf: Dict[str, Any]):
@@ -98,11 +153,15 @@ class Node(object):
 
         self.block_tree = BlockTree()
         self.block_tree_lock = Lock()
+        self.prune_depth = conf["PRUNE_DEPTH"]
+        self.prune_block_files = conf["PRUNE_BLOCK_FILES"]
         self.vis_block_q = None
 
         self.unconnected_addrs = set(conf["INITIAL_PEER_ADDRESSES"])
         self.connected_addrs = set()
         self.addrs_cv = Condition()
+        self.unvalidated_addrs = {}
+        self.failed_addrs = {}
 
         self.name = conf["NAME"]
         self.virt_loc = conf["VIRTUAL_LOCATION"]
@@ -112,18 +171,43 @@ class Node(object):
         self.connected_addrs.add(self.public_addr)
 
         self.data_dir = conf["DATA_DIRECTORY"]
-
-        self.tx_id_pool = Pool(conf["TRANSACTION_ID_POOL_SIZE"])
-        self.block_id_pool = Pool(conf["BLOCK_ID_POOL_SIZE"])
+        self.block_index_file = BlockIndexFile(
+            os.path.join(self.data_dir, Node.BLOCK_INDEX_FILENAME))
+        self.top_state_file = StateFile(
+            os.path.join(self.data_dir, Node.TOP_STATE_FILENAME))
+
+        self.tx_id_pool = RollingBloomFilter(
+            conf["TRANSACTION_ID_POOL_SIZE"],
+            conf["ID_POOL_FALSE_POSITIVE_RATE"]
+        )
+        self.block_id_pool = RollingBloomFilter(
+            conf["BLOCK_ID_POOL_SIZE"],
+            conf["ID_POOL_FALSE_POSITIVE_RATE"]
+        )
         self.addr_pool = Pool(conf["ADDRESS_POOL_SIZE"])
         self.token_pool = Pool(conf["TOKEN_POOL_SIZE"])
 
+        self.mempool = Mempool(conf["MEMPOOL_SIZE"], ExtendedState())
+        self.orphan_tx_pool = OrphanPool(
+            conf["ORPHAN_TRANSACTION_POOL_SIZE"],
+            conf["ORPHAN_TRANSACTIONS_PER_PEER"],
+            conf["ORPHAN_TRANSACTION_EXPIRY"]
+        )
+        self.orphan_block_pool = OrphanBlockPool(
+            conf["ORPHAN_BLOCK_POOL_SIZE"],
+            conf["ORPHAN_BLOCK_EXPIRY"]
+        )
+
+        self.change_cv = Condition()
+        self.change_count = 0
+
         self.tx_queue = Queue()
         self.block_queue = Queue()
         self.addr_queue = Queue()
         self.valid_obj_queue = Queue()
         self.orphan_queue = Queue()
 
+        self.loop = asyncio.new_event_loop()
         self.client_cmd_queues = set()
         self.client_cmd_queues_cv = Condition()
 
@@ -133,30 +217,46 @@ class Node(object):
 
         self.min_peers, self.max_peers = conf["PEERS_RANGE"]
         self.peers_smp = Semaphore(self.max_peers * 2)
+        self.max_dials = conf["MAX_CONCURRENT_DIALS"]
+        self.dial_count = 0
+        self.dial_failure_expiry = conf["DIAL_FAILURE_EXPIRY"]
+        self.sync_peers = conf["SYNC_PEERS"]
+        self.peer_queue_size = conf["PEER_QUEUE_SIZE"]
+        self.max_peer_lag = conf["PEER_MAX_LAG"]
 
         self.connection_timeout = conf["CONNECTION_TIMEOUT"]
         self.peer_timeout = conf["PEER_TIMEOUT"]
+        self.frame_checksum = conf["FRAME_CHECKSUM"]
 
         self.verbose = conf["VERBOSE"]
         self.hexlen = conf["HEX_STRING_LENGTH"]
 
-    def add_unconnected_address(self, addr: Tuple[str, int]) -> bool:
+    def add_unconnected_address(self, addr: Tuple[str, int],
+                                unvalidated: object = None) -> bool:
         """
-        Add an address to the node's unconnected address list.
+        Add an address to the node's unconnected address list, unless it
+        failed recently.
 
         Notes: this method is thread-safe.
 
         Args:
             addr: the address to be added.
+            unvalidated: the wrapped address, if the address has not been
+                validated yet.
 
         Returns:
             True if actually added.
 
         """
         with self.addrs_cv:
+            if self._has_failed_address(addr):
+                return False
+
             if addr not in self.connected_addrs:
                 if addr not in self.unconnected_addrs:
                     self.unconnected_addrs.add(addr)
+                    if unvalidated is not None:
+                        self.unvalidated_addrs[addr] = unvalidated
                     self.addrs_cv.notify()
                     return True
 
@@ -203,6 +303,42 @@ class Node(object):
                 return True
             return False
 
+    def pop_unvalidated_address(self, addr: Tuple[str, int]) \
+            -> Optional[object]:
+        """
+        Mark a popped unconnected address as validated.
+
+        Notes: this method is thread-safe.
+
+        Args:
+            addr: the address, which has just been connected to.
+
+        Returns:
+            The wrapped address given when it was added, or None if it was
+            validated already.
+
+        """
+        with self.addrs_cv:
+            return self.unvalidated_addrs.pop(addr, None)
+
+    def add_failed_address(self, addr: Tuple[str, int]) -> None:
+        """Remember that an address could not be connected to. This method
+        is thread-safe."""
+        with self.addrs_cv:
+            self.failed_addrs[addr] = time.time() + self.dial_failure_expiry
+
+    def has_failed_address(self, addr: Tuple[str, int]) -> bool:
+        """Return True if an address could not be connected to recently.
+        This method is thread-safe."""
+        with self.addrs_cv:
+            return self._has_failed_address(addr)
+
+    def needs_peers(self) -> bool:
+        """Return True if the peers are fewer than the minimum number of
+        peers. This method is thread-safe."""
+        with self.client_cmd_queues_cv:
+            return len(self.client_cmd_queues) < self.min_peers
+
     def pop_random_unconnected_address(self) -> Tuple[str, int]:
         """
         Pop a random unconnected address.
@@ -221,6 +357,17 @@ class Node(object):
             self.unconnected_addrs.remove(addr)
             return addr
 
+    def _has_failed_address(self, addr: Tuple[str, int]) -> bool:
+        """Return True if an address could not be connected to recently,
+        `addrs_cv` being acquired."""
+        expiration = self.failed_addrs.get(addr)
+        if expiration is None:
+            return False
+        if expiration <= time.time():
+            del self.failed_addrs[addr]
+            return False
+        return True
+
     def get_block_path(self, block_id: bytes, make_dir: bool = True) -> str:
         """Return the path where a block is or to be stored."""
         block_id_h = block_id.hex()
@@ -252,10 +399,98 @@ class Node(object):
         # save block data
         self.save_block_data(block.to_bytes(), block.get_id())
 
-        # save block ID
-        with open(os.path.join(self.data_dir, Node.BLOCK_ID_FILENAME),
-                  "ab") as f:
-            f.write(block.get_id())
+        # save block index record
+        self.block_index_file.append([(
+            block.get_id(),
+            block.prev_id,
+            self.block_tree.get_block_height(block.get_id()),
+            BlockIndexFile.VALID
+        )])
+
+    def save_block_index(self) -> None:
+        """Save the index records of all the blocks in the block tree."""
+        with self.block_tree_lock:
+            entries = self.block_tree.entries
+            records = [
+                (block_id, entries[block_id].parent.block_id,
+                 entries[block_id].height, BlockIndexFile.VALID)
+                for block_id in self.block_tree.traverse()
+                if block_id != HASH_OF_NULL
+            ]
+
+        self.block_index_file.append(records)
+
+    def load_block_index(self) -> int:
+        """
+        Rebuild the block tree from the block index file.
+
+        Notes: the top state is read from the top state file, and cached for
+        the mempool and the miner. Only if the file is missing, or behind the
+        block index, the main chain's blocks after the saved state are
+        parsed, once, and the file is brought up to date. Other states are
+        computed from the saved blocks when they are first needed.
+
+        Raises:
+            KeyError, AssertionError: if the block index file is corrupted.
+            FileNotFoundError: if a main chain block file is missing.
+
+        Returns:
+            The number of blocks added.
+
+        """
+        # keep the latest record of each block, in the order the records
+        # were written (a pruned block may be added again later)
+        blocks = {}
+        for block_id, prev_id, height, flag in self.block_index_file.read():
+            blocks.pop(block_id, None)
+            if flag == BlockIndexFile.VALID:
+                blocks[block_id] = (prev_id, height)
+
+        with self.block_tree_lock:
+            for block_id, (prev_id, height) in blocks.items():
+                self.block_tree.add(block_id, prev_id)
+                assert self.block_tree.get_block_height(block_id) == height
+
+        # start from the saved top state
+        top_id = self.block_tree.get_top_block()
+        state = self.read_top_state()
+        if state is not None:
+            self.state_cache.add(state.latest_id, state)
+
+        # otherwise, replay the main chain once (from the saved state if it
+        # is behind)
+        if state is None or state.latest_id != top_id:
+            self.state_cache.add(top_id, self.get_state(top_id))
+            self.save_top_state(top_id)
+
+        return len(blocks)
+
+    def read_top_state(self) -> Optional[ExtendedState]:
+        """Return the state saved in the top state file, or None if there
+        is no usable one."""
+        if not self.top_state_file.exists():
+            return None
+
+        try:
+            state = self.top_state_file.read()
+        except (OSError, AssertionError):
+            return None
+
+        # the block index may have been written without the state
+        if not self.block_tree.has_block(state.latest_id) or \
+                self.block_tree.get_block_height(state.latest_id) != \
+                state.age:
+            return None
+
+        return state
+
+    def save_top_state(self, top_id: bytes) -> None:
+        """Save the state of the top block to the top state file."""
+        if self.state_cache.haskey(top_id):
+            state = self.state_cache.get(top_id)
+        else:
+            state = self.get_state(top_id)
+        self.top_state_file.write(state)
 
     def load_block(self, block_id: bytes) -> Block:
         """Load a block, given its ID."""
@@ -280,49 +515,230 @@ class Node(object):
             True if the block is actually added.
 
         """
+        return self.add_blocks([block], save_block) == 1
 
-        # check duplicate block
-        if self.block_tree.has_block(block.get_id()):
-            return False  # simply return
+    def add_blocks(self, blocks: List[Block], save_block: bool = True) -> int:
+        """
+        Add a branch of blocks to this node's block tree.
 
-        # check orphaned block
-        if not self.block_tree.has_block(block.prev_id):
-            self.orphan_queue.put(block)
-            return False
+        The blocks are processed by a single working state. Only the last
+        block's state and the states at checkpoints are cached.
 
-        # validate/process received block
-        state = self.get_state(block.prev_id)
-        state.process_block(block)
+        Warnings: This method is not thread-safe and should only be called
+        by one thread.
 
-        # update state cache
-        self.state_cache.add(block.get_id(), state)
+        Args:
+            blocks: the blocks to be added, each extending the previous one.
+            save_block: True if the blocks need to be saved.
 
-        # update block tree
+        Raises:
+            BlockError: if a block is invalid. The blocks before it are
+                still added.
+
+        Returns:
+            The number of blocks actually added.
+
+        """
+
+        # skip duplicate blocks
+        i = 0
+        while (i < len(blocks) and
+               self.block_tree.has_block(blocks[i].get_id())):
+            i += 1
+        blocks = blocks[i:]
+        if not blocks:
+            return 0
+
+        # check orphaned blocks
+        if not self.block_tree.has_block(blocks[0].prev_id):
+            for block in blocks:
+                self.orphan_queue.put(block)
+            return 0
+
+        top_id = self.block_tree.get_top_block()
+        state = self.get_state(blocks[0].prev_id)
+        added = []
+        try:
+            for block in blocks:
+                if block.prev_id != state.latest_id:
+                    raise BlockError(
+                        "Invalid previous block ID!",
+                        BlockError.INVALID_PREV_ID,
+                        block
+                    )
+
+                # validate/process the block (the working state is dropped if
+                # the block is invalid, no need to back it up)
+                state.process_block(block, backup=False)
+
+                # update state cache
+                if block is blocks[-1]:
+                    self.state_cache.add(block.get_id(), state)
+                elif state.age % Node.STATE_CHECKPOINT_INTERVAL == 0:
+                    self.state_cache.add(block.get_id(), copy.deepcopy(state))
+
+                # update block tree
+                with self.block_tree_lock:
+                    self.block_tree.add(block.get_id(), block.prev_id)
+
+                    # push the block to the block tree visualizer
+                    if self.vis_block_q:
+                        self.vis_block_q.put((
+                            block.get_id(), block.prev_id,
+                            block.txs[0].outputs[0].owner.hex()
+                        ))
+
+                # save the block if required
+                if save_block:
+                    self.save_block(block)
+
+                added.append(block)
+
+        finally:
+            if added:
+                # move the mempool onto the new top block
+                new_top_id = self.block_tree.get_top_block()
+                if new_top_id != top_id:
+                    self.update_mempool(next(block for block in added
+                                             if block.get_id() == new_top_id))
+
+                    if self.prune_depth is not None:
+                        self.prune_side_branches(save_ids=save_block)
+
+                    # keep the saved top state in line with the index
+                    if save_block:
+                        self.save_top_state(new_top_id)
+
+                    self.notify_change()
+
+                # release orphaned transactions waiting for the blocks'
+                # transactions
+                for block in added:
+                    for tx in block.txs:
+                        for orphan in self.orphan_tx_pool.pop_children(tx):
+                            self.tx_queue.put(orphan)
+
+        return len(added)
+
+    def update_mempool(self, top_block: Block) -> None:
+        """
+        Move the mempool onto the top block of the block tree.
+
+        Warnings: This method is not thread-safe and should only be called
+        by the thread adding blocks.
+
+        Args:
+            top_block: the top block of the block tree.
+
+        """
+        try:
+            if top_block.prev_id == self.mempool.get_tip():
+                self.mempool.connect_block(top_block)
+                return
+
+            # disconnect blocks from the old branch, connect blocks from the
+            # new branch
+            to_disconnect, to_connect = self.block_tree.get_path_between(
+                self.mempool.get_tip(), top_block.get_id())
+            for block_id in to_disconnect:
+                self.mempool.disconnect_block(block_id)
+            for block_id in to_connect[:-1]:
+                self.mempool.connect_block(self.load_block(block_id))
+            self.mempool.connect_block(top_block)
+
+        except (KeyError, AssertionError, OSError):
+            # the reorganization is too deep for the mempool to follow, or a
+            # block of the new branch has no file (pruned or never saved)
+            self.mempool.rebase(self.get_state(top_block.get_id()))
+
+    def notify_change(self) -> None:
+        """
+        Wake up threads waiting for the top block or the mempool to change.
+
+        Notes: this method is thread-safe.
+        """
+        with self.change_cv:
+            self.change_count += 1
+            self.change_cv.notify_all()
+
+    def wait_for_change(self, change_count: int, timeout: float) -> bool:
+        """
+        Wait until the top block or the mempool changes.
+
+        Notes: this method is thread-safe.
+
+        Args:
+            change_count: the value of `change_count` last seen by the caller.
+            timeout: the maximum waiting time (in seconds).
+
+        Returns:
+            True if a change happened since `change_count` was seen, False
+            on timeout.
+
+        """
+        with self.change_cv:
+            return self.change_cv.wait_for(
+                lambda: self.change_count != change_count, timeout)
+
+    def prune_side_branches(self, save_ids: bool = True) -> None:
+        """
+        Remove stale side branches from the block tree, the state cache and,
+        if required, the data directory.
+
+        Warnings: This method is not thread-safe and should only be called
+        by the thread adding blocks.
+
+        Args:
+            save_ids: True if the pruning needs to be recorded in the block
+                index file.
+
+        """
         with self.block_tree_lock:
-            self.block_tree.add(block.get_id(), block.prev_id)
+            pruned_ids = self.block_tree.prune(self.prune_depth)
 
-            # push the block to the block tree visualizer
-            if self.vis_block_q:
-                self.vis_block_q.put((block.get_id(), block.prev_id,
-                                      block.txs[0].outputs[0].owner.hex()))
+        if not pruned_ids:
+            return
 
-        # save the block if required
-        if save_block:
-            self.save_block(block)
+        for block_id in pruned_ids:
+            self.state_cache.remove(block_id)
 
-        return True
+        if save_ids:
+            self.block_index_file.append(
+                (block_id, HASH_OF_NULL, 0, BlockIndexFile.PRUNED)
+                for block_id in pruned_ids
+            )
+
+        if self.prune_block_files:
+            for block_id in pruned_ids:
+                try:
+                    os.remove(self.get_block_path(block_id, make_dir=False))
+                except FileNotFoundError:
+                    pass
 
     def get_state(self, block_id: bytes) -> ExtendedState:
-        """Get the state after process a block, given the block ID."""
-        if self.state_cache.haskey(block_id):
-            state = copy.deepcopy(self.state_cache.get(block_id))
+        """
+        Get the state after process a block, given the block ID.
+
+        Notes: if the state is not cached, it is computed from the state of
+        the nearest ancestor whose state is cached.
+        """
+        # find the nearest ancestor whose state is cached
+        path = []
+        with self.block_tree_lock:
+            entry = self.block_tree.entries[block_id]
+            while entry and not self.state_cache.haskey(entry.block_id):
+                path.append(entry.block_id)
+                entry = entry.parent
+
+        if entry:
+            state = copy.deepcopy(self.state_cache.get(entry.block_id))
         else:
-            # the block is old, the state after has been removed from cache.
+            # the root block's state has been removed from cache
             state = ExtendedState()
-            for bid in self.block_tree.get_path(block_id):
-                if bid == HASH_OF_NULL:
-                    continue
-                state.process_block(self.load_block(bid))
+            path.pop()
+
+        for bid in reversed(path):
+            state.process_block(self.load_block(bid), backup=False)
 
         return state
 
@@ -0,0 +1,72 @@
+from kmacoin.globaldef.hash import HASH_SIZE
+
+from typing import Iterable, Iterator, Tuple
+
+import os
+
+
+class BlockIndexFile(object):
+    """
+    An append-only file of block index records.
+
+    A record is made of a block ID, the block's `prev_id`, the block's height
+    and a flag telling whether the block is valid or has been pruned. The
+    records are written in the order the blocks are added, so a block's
+    record always comes after its previous block's. The `prev_id` and height
+    of a pruned block's record are not used.
+
+    Attributes:
+        path: where the file is stored.
+
+    """
+    # Field sizes of a record:
+    ID_FSZ = HASH_SIZE
+    PREV_ID_FSZ = HASH_SIZE
+    HEIGHT_FSZ = 4
+    FLAG_FSZ = 1
+    RECORD_SIZE = ID_FSZ + PREV_ID_FSZ + HEIGHT_FSZ + FLAG_FSZ
+
+    # Flags:
+    VALID = 0
+    PRUNED = 1
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def exists(self) -> bool:
+        """Test if the file has been created."""
+        return os.path.isfile(self.path)
+
+    def append(self, records: Iterable[Tuple[bytes, bytes, int, int]]) \
+            -> None:
+        """Append (block ID, prev_id, height, flag) records to the file."""
+        data = b"".join(
+            block_id + prev_id +
+            height.to_bytes(BlockIndexFile.HEIGHT_FSZ, "big") +
+            flag.to_bytes(BlockIndexFile.FLAG_FSZ, "big")
+            for block_id, prev_id, height, flag in records
+        )
+        with open(self.path, "ab") as f:
+            f.write(data)
+
+    def read(self) -> Iterator[Tuple[bytes, bytes, int, int]]:
+        """
+        Read all the (block ID, prev_id, height, flag) records of the file.
+
+        Notes: the file is read at once. A truncated record at the end of
+        the file, left by an interrupted write, is ignored.
+        """
+        with open(self.path, "rb") as f:
+            data = f.read()
+
+        height_pos = BlockIndexFile.ID_FSZ + BlockIndexFile.PREV_ID_FSZ
+        flag_pos = height_pos + BlockIndexFile.HEIGHT_FSZ
+        for i in range(0, len(data) - BlockIndexFile.RECORD_SIZE + 1,
+                       BlockIndexFile.RECORD_SIZE):
+            record = data[i:i + BlockIndexFile.RECORD_SIZE]
+            yield (
+                record[:BlockIndexFile.ID_FSZ],
+                record[BlockIndexFile.ID_FSZ:height_pos],
+                int.from_bytes(record[height_pos:flag_pos], "big"),
+                record[flag_pos]
+            )
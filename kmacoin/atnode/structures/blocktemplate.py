@@ -0,0 +1,245 @@
+from kmacoin.objects.transaction import Transaction
+
+from typing import Dict, List, Optional, Set
+
+import heapq
+
+
+class BlockTemplate(object):
+    """
+    A snapshot of the transactions to be put in the next block.
+
+    Attributes:
+        prev_id: ID of the block the template is built on.
+        txs: the transactions, parents before children.
+        fee: the total fee of the transactions.
+        version: the template builder's version when the snapshot was taken.
+
+    """
+    def __init__(self, prev_id: bytes, txs: List[Transaction], fee: int,
+                 version: int):
+        self.prev_id = prev_id
+        self.txs = txs
+        self.fee = fee
+        self.version = version
+
+
+class TemplateBuilder(object):
+    """
+    Build block templates from a mempool's transactions.
+
+    Transactions are picked as packages: a transaction together with its
+    pooled ancestors not picked yet, ordered by the package's fee per byte.
+    A new pooled transaction is added to the current template without
+    rebuilding it.
+
+    Notes: the builder is not thread-safe, the mempool's lock must be held
+    when any of its methods is called.
+
+    Attributes:
+        mempool: the mempool the builder works for.
+        max_count: the maximum number of transactions in a template.
+        tx_ids: IDs of the template's transactions (the dictionary's values
+            are not used), parents before children.
+        fee: the total fee of the template's transactions.
+        leaves: a heap of (fee_rate, seq, tx_id) of the template's
+            transactions, used to find the worst transaction without
+            children in the template.
+        valid: False if the template needs to be rebuilt.
+        version: incremented every time the template changes.
+        snapshot: the latest snapshot of the template, if still up to date.
+
+    """
+    tx_ids: Dict[bytes, None]
+    snapshot: Optional[BlockTemplate]
+
+    def __init__(self, mempool: 'Mempool', max_count: int):
+        self.mempool = mempool
+        self.max_count = max_count
+        self.tx_ids = {}
+        self.fee = 0
+        self.leaves = []
+        self.valid = False
+        self.version = 0
+        self.snapshot = None
+
+    def get_template(self) -> BlockTemplate:
+        """Return a snapshot of the current template."""
+        if not self.valid:
+            self.rebuild()
+
+        if self.snapshot is None:
+            entries = self.mempool.entries
+            self.snapshot = BlockTemplate(
+                self.mempool.get_tip(),
+                [entries[tx_id].tx for tx_id in self.tx_ids],
+                self.fee,
+                self.version
+            )
+
+        return self.snapshot
+
+    def invalidate(self) -> None:
+        """Mark the template to be rebuilt, e.g. after the mempool's tip
+        changes."""
+        self.valid = False
+        self.version += 1
+        self.snapshot = None
+
+    def has_transaction(self, tx_id: bytes) -> bool:
+        """Test for transaction membership."""
+        return tx_id in self.tx_ids
+
+    def rebuild(self) -> None:
+        """Rebuild the template from all pooled transactions."""
+        entries = self.mempool.entries
+        self.tx_ids = {}
+        self.fee = 0
+        self.leaves = []
+
+        heap = []
+        for tx_id, entry in entries.items():
+            heap.append((-self._get_package_fee_rate(self._get_package(entry)),
+                         entry.seq, tx_id))
+        heapq.heapify(heap)
+
+        while heap and len(self.tx_ids) < self.max_count:
+            neg_fee_rate, seq, tx_id = heapq.heappop(heap)
+            if tx_id in self.tx_ids:
+                continue  # already picked as an ancestor
+
+            # the package shrinks when some ancestors are picked
+            package = self._get_package(entries[tx_id])
+            fee_rate = self._get_package_fee_rate(package)
+            if fee_rate != -neg_fee_rate:
+                heapq.heappush(heap, (-fee_rate, seq, tx_id))
+                continue
+
+            if len(self.tx_ids) + len(package) <= self.max_count:
+                self._append(package)
+
+        self.valid = True
+        self.version += 1
+        self.snapshot = None
+
+    def on_added(self, entry: 'MempoolEntry') -> None:
+        """Update the template when a transaction enters the mempool."""
+        if not self.valid:
+            return  # the transaction is considered at the next rebuild
+
+        package = self._get_package(entry)
+        if len(self.tx_ids) + len(package) <= self.max_count:
+            self._append(package)
+
+        elif len(package) == 1:
+            # replace the worst transaction without children in the template,
+            # other than an ancestor of the new one: its parents look childless
+            # as long as the new transaction is out of the template
+            worst = self._pop_worst_leaf(self._get_ancestor_ids(entry))
+            if worst is None:
+                return
+            if worst.fee_rate < entry.fee_rate:
+                self._remove_leaf(worst)
+                self._append(package)
+            else:
+                heapq.heappush(self.leaves, (worst.fee_rate, worst.seq,
+                                             worst.tx.get_id()))
+                return
+
+        else:
+            return
+
+        self.version += 1
+        self.snapshot = None
+
+    def on_removed(self, tx_id: bytes) -> None:
+        """Update the template when a transaction leaves the mempool."""
+        if tx_id in self.tx_ids:
+            self.invalidate()
+
+    def _get_package(self, entry: 'MempoolEntry') -> List['MempoolEntry']:
+        """Return an entry and its ancestors not in the template, parents
+        before children."""
+        entries = self.mempool.entries
+        package = []
+        seen = set()
+        stack = [(entry, False)]
+        while stack:
+            current, expanded = stack.pop()
+            if expanded:
+                package.append(current)
+                continue
+            tx_id = current.tx.get_id()
+            if tx_id in seen:
+                continue
+            seen.add(tx_id)
+            stack.append((current, True))
+            for parent_id in current.parents:
+                if parent_id not in seen and parent_id not in self.tx_ids:
+                    stack.append((entries[parent_id], False))
+
+        return package
+
+    def _get_ancestor_ids(self, entry: 'MempoolEntry') -> Set[bytes]:
+        """Return the IDs of an entry's pooled ancestors."""
+        entries = self.mempool.entries
+        ancestor_ids = set()
+        stack = list(entry.parents)
+        while stack:
+            tx_id = stack.pop()
+            if tx_id not in ancestor_ids:
+                ancestor_ids.add(tx_id)
+                stack.extend(entries[tx_id].parents)
+
+        return ancestor_ids
+
+    @staticmethod
+    def _get_package_fee_rate(package: List['MempoolEntry']) -> float:
+        """Return the fee per byte of a package."""
+        return (sum(entry.fee for entry in package) /
+                sum(entry.size for entry in package))
+
+    def _append(self, package: List['MempoolEntry']) -> None:
+        """Append a package to the template."""
+        for entry in package:
+            self.tx_ids[entry.tx.get_id()] = None
+            self.fee += entry.fee
+            heapq.heappush(self.leaves, (entry.fee_rate, entry.seq,
+                                         entry.tx.get_id()))
+
+    def _pop_worst_leaf(self, excluded_ids: Set[bytes]) \
+            -> Optional['MempoolEntry']:
+        """Pop the worst transaction without children in the template, whose
+        ID is not in `excluded_ids`."""
+        entries = self.mempool.entries
+        excluded = []
+        worst = None
+        while self.leaves:
+            item = heapq.heappop(self.leaves)
+            _, seq, tx_id = item
+            entry = entries.get(tx_id)
+            if (entry is None or entry.seq != seq or
+                    tx_id not in self.tx_ids):
+                continue
+            if any(child_id in self.tx_ids for child_id in entry.children):
+                continue  # pushed again when its children are removed
+            if tx_id in excluded_ids:
+                excluded.append(item)
+                continue
+            worst = entry
+            break
+
+        for item in excluded:
+            heapq.heappush(self.leaves, item)
+        return worst
+
+    def _remove_leaf(self, entry: 'MempoolEntry') -> None:
+        """Remove a transaction without children from the template."""
+        del self.tx_ids[entry.tx.get_id()]
+        self.fee -= entry.fee
+        entries = self.mempool.entries
+        for parent_id in entry.parents:
+            if parent_id in self.tx_ids:
+                parent = entries[parent_id]
+                heapq.heappush(self.leaves, (parent.fee_rate, parent.seq,
+                                             parent_id))
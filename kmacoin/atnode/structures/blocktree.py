@@ -1,116 +1,73 @@
 from kmacoin.globaldef.hash import HASH_OF_NULL
 
-from typing import List, Dict, Iterator
+from typing import List, Dict, Set, Iterator, Optional, Tuple
 
 
-class BlockBranch(object):
+def get_skip_height(height: int) -> int:
     """
-    A branch of blocks.
-
-    Attributes:
-        parent: the branch's parent.
-        branch_index: the branch's index in its parent's list of sub-branches.
-        root_block_index: the root block's index in the parent branch.
-        block_ids: list of block IDs belonging to the branch.
-        sub_branches: the branch's sub-branches.
+    Return the height of the block an entry at some height skips to.
 
+    Notes: heights are chosen so that any ancestor can be reached in a
+    logarithmic number of steps.
     """
-    def __init__(self, first_block_id: bytes, parent: 'BlockBranch' = None,
-                 branch_index: int = None, root_block_index: int = None, ):
-        self.parent = parent
-        self.branch_index = branch_index
-        self.root_block_index = root_block_index
-        self.block_ids: List[bytes] = [first_block_id]
-        self.sub_branches: List[BlockBranch] = []
-
-    def add(self, block_id: bytes, prev_block_addr: List[int]) \
-            -> Dict[bytes, List[int]]:
-        """
-        Add a block to the branch or one of its sub-branches.
+    if height < 2:
+        return 0
 
-        If a sub-branch's length is bigger than the main branch after the block
-        is added, it will takeover and become new main branch.
+    # clear the lowest set bit once or twice
+    if height & 1:
+        n = height - 1
+        n &= n - 1
+        return (n & (n - 1)) + 1
+    else:
+        return height & (height - 1)
 
-        Args:
-            block_id: the block ID to be added.
-            prev_block_addr: the address of the block extended by the added
-                block.
 
-        Returns:
-            Addresses of blocks whose positions have been changed.
+class BlockIndexEntry(object):
+    """
+    An entry of the block index.
 
-        """
-        if len(prev_block_addr) == 1:
-            block_index = prev_block_addr[0]
-            if block_index == len(self.block_ids) - 1:
-                self.block_ids.append(block_id)
-                return {block_id: [block_index + 1]}
-            else:
-                new_branch = BlockBranch(
-                    block_id,
-                    parent=self,
-                    root_block_index=block_index,
-                    branch_index=len(self.sub_branches)
-                )
-                self.sub_branches.append(new_branch)
-                return {block_id: [new_branch.branch_index, 0]}
-        else:
-            branch_index, next_addr = prev_block_addr[0], prev_block_addr[1:]
-            sub_branch = self.sub_branches[branch_index]
-            result = sub_branch.add(block_id, next_addr)
-            for k, v in result.items():
-                result[k] = [branch_index] + v
-
-            if len(sub_branch.block_ids) <= \
-                    len(self.block_ids) - sub_branch.root_block_index - 1:
-                return result
-            else:
-                return {**result, **self.swap(branch_index)}
-
-    def get_path(self, block_addr: List[int]) -> Iterator[bytes]:
-        """Get all the block IDs on the path to a specific block,
-        given its address."""
-        if len(block_addr) == 1:
-            index = block_addr[0]
-            for i in range(index + 1):
-                yield self.block_ids[i]
-        else:
-            index, next_addr = block_addr[0], block_addr[1:]
-            sub_branch = self.sub_branches[index]
-            for i in range(sub_branch.root_block_index + 1):
-                yield self.block_ids[i]
+    Attributes:
+        block_id: the block's ID.
+        parent: the entry of the block's previous block.
+        height: the number of blocks between the root block and this block.
+        skip: the entry of an ancestor at height `get_skip_height(height)`.
+        child_count: the number of blocks extending this block.
 
-            yield from sub_branch.get_path(next_addr)
+    """
+    # many entries are kept, don't give each of them a `__dict__`
+    __slots__ = ("block_id", "parent", "height", "skip", "child_count")
 
-    def swap(self, index: int) -> Dict[bytes, List[int]]:
-        """
-        Swap the main branch with a sub-branch.
+    def __init__(self, block_id: bytes, parent: Optional['BlockIndexEntry']):
+        self.block_id = block_id
+        self.parent = parent
+        self.height = parent.height + 1 if parent else 0
+        self.skip = parent.get_ancestor(get_skip_height(self.height)) \
+            if parent else None
+        self.child_count = 0
 
-        Args:
-            index: index of the sub-branch.
+    def get_ancestor(self, height: int) -> Optional['BlockIndexEntry']:
+        """Return the entry of the ancestor at a given height, in O(log n)
+        steps."""
+        if height > self.height or height < 0:
+            return None
 
-        Returns:
-            Addresses of blocks whose positions have been changed.
+        walk = self
+        while walk.height > height:
+            skip_height = get_skip_height(walk.height)
+            prev_skip_height = get_skip_height(walk.height - 1)
 
-        """
-        sub_branch = self.sub_branches[index]
-        tmp = sub_branch.block_ids
-        sub_branch.block_ids = self.block_ids[sub_branch.root_block_index + 1:]
-        self.block_ids = self.block_ids[:sub_branch.root_block_index + 1] + tmp
-
-        result = {}
-        for i in range(len(sub_branch.block_ids)):
-            result[sub_branch.block_ids[i]] = [index, i]
-        for i in range(sub_branch.root_block_index + 1, len(self.block_ids)):
-            result[self.block_ids[i]] = [i]
-        return result
+            # only skip if the parent can't skip better
+            if walk.skip is not None and (
+                skip_height == height or
+                (skip_height > height and not
+                 (prev_skip_height < skip_height - 2 and
+                  prev_skip_height >= height))
+            ):
+                walk = walk.skip
+            else:
+                walk = walk.parent
 
-    def traverse(self) -> Iterator[bytes]:
-        """Traverse all the blocks in the branch and its sub-branches."""
-        for block_id in self.block_ids:
-            yield block_id
-        for sub_branch in self.sub_branches:
-            yield from sub_branch.traverse()
+        return walk
 
 
 class BlockTree(object):
@@ -118,37 +75,224 @@ class BlockTree(object):
     A tree of blocks.
 
     Attributes:
-        main_branch: the tree's body.
-        addresses: block ID -> address. address of the form: [index of block ID
-            in main branch], or [index of sub-branch] + address of block ID in
-            sub-branch.
+        entries: block ID -> entry of the block index, the root block first,
+            a block always after its previous block.
+        main_chain: IDs of the blocks on the main branch, indexed by height.
+        leaves: IDs of the blocks not extended by any block.
 
     """
+    entries: Dict[bytes, BlockIndexEntry]
+    main_chain: List[bytes]
+    leaves: Set[bytes]
+
+    # A locator lists this many blocks before it gets sparser:
+    LOCATOR_DENSE_COUNT = 10
+
     def __init__(self):
-        self.main_branch = BlockBranch(HASH_OF_NULL)
-        self.addresses: Dict[bytes, List[int]] = {HASH_OF_NULL: [0]}
+        self.entries = {HASH_OF_NULL: BlockIndexEntry(HASH_OF_NULL, None)}
+        self.main_chain = [HASH_OF_NULL]
+        self.leaves = {HASH_OF_NULL}
 
     def add(self, block_id: bytes, prev_id: bytes):
-        """Add a block, given its block ID and `prev_id`."""
-        self.addresses = {**self.addresses, **self.main_branch.add(
-            block_id, self.addresses[prev_id])}
+        """
+        Add a block, given its block ID and `prev_id`.
+
+        If the block's branch becomes longer than the main branch, it will
+        takeover and become new main branch.
+        """
+        entry = BlockIndexEntry(block_id, self.entries[prev_id])
+        self.entries[block_id] = entry
+        entry.parent.child_count += 1
+        self.leaves.discard(prev_id)
+        self.leaves.add(block_id)
+
+        if entry.height < len(self.main_chain):
+            return
+
+        if prev_id == self.main_chain[-1]:
+            self.main_chain.append(block_id)
+        else:
+            fork = self.find_fork(self.main_chain[-1], block_id)
+            _, to_connect = self.get_path_between(fork, block_id)
+            self.main_chain[self.entries[fork].height + 1:] = to_connect
+
+    def prune(self, depth: int) -> List[bytes]:
+        """
+        Remove the side branches forked more than `depth` blocks below the
+        top block.
+
+        Args:
+            depth: how deep a side branch may fork below the top block.
+
+        Returns:
+            IDs of the removed blocks.
+
+        """
+        min_height = self.get_height() - depth
+        removed = []
+        for leaf_id in list(self.leaves):
+            if self.is_on_main_chain(leaf_id):
+                continue
+
+            fork = self.entries[self.find_fork(self.main_chain[-1], leaf_id)]
+            if fork.height >= min_height:
+                continue
+
+            # remove the branch up to the fork, or to a block shared with
+            # another branch (which will be removed from its own leaf)
+            entry = self.entries[leaf_id]
+            self.leaves.remove(leaf_id)
+            while entry is not fork and entry.child_count == 0:
+                del self.entries[entry.block_id]
+                removed.append(entry.block_id)
+                entry.parent.child_count -= 1
+                entry = entry.parent
+
+        return removed
 
     def get_height(self) -> int:
         """Return the height of this tree. The root block doesn't count."""
-        return len(self.main_branch.block_ids) - 1
+        return len(self.main_chain) - 1
 
     def get_top_block(self) -> bytes:
         """Return the ID of the top block of this tree."""
-        return self.main_branch.block_ids[-1]
+        return self.main_chain[-1]
 
     def has_block(self, block_id: bytes) -> bool:
         """Test for block membership."""
-        return block_id in self.addresses
+        return block_id in self.entries
+
+    def get_block_height(self, block_id: bytes) -> int:
+        """Return the height of a block."""
+        return self.entries[block_id].height
+
+    def is_on_main_chain(self, block_id: bytes) -> bool:
+        """Test if a block is on the main branch."""
+        height = self.entries[block_id].height
+        return (height < len(self.main_chain) and
+                self.main_chain[height] == block_id)
+
+    def get_ancestor(self, block_id: bytes, height: int) -> Optional[bytes]:
+        """Return the ID of a block's ancestor at a given height."""
+        entry = self.entries[block_id].get_ancestor(height)
+        return entry.block_id if entry else None
+
+    def find_fork(self, block_id1: bytes, block_id2: bytes) -> bytes:
+        """Return the ID of the lowest common ancestor of two blocks, in
+        O(log n) steps."""
+        entry1 = self.entries[block_id1]
+        entry2 = self.entries[block_id2]
+        height = min(entry1.height, entry2.height)
+        entry1 = entry1.get_ancestor(height)
+        entry2 = entry2.get_ancestor(height)
+
+        # entries at a same height skip to a same height: while their skips
+        # differ, the fork is below the skips, which can be jumped to
+        while entry1 is not entry2:
+            if entry1.skip is not entry2.skip:
+                entry1 = entry1.skip
+                entry2 = entry2.skip
+            else:
+                entry1 = entry1.parent
+                entry2 = entry2.parent
+
+        return entry1.block_id
+
+    def get_path_between(self, from_id: bytes, to_id: bytes) \
+            -> Tuple[List[bytes], List[bytes]]:
+        """
+        Get the path from a block to another.
+
+        Args:
+            from_id: ID of the starting block.
+            to_id: ID of the ending block.
+
+        Returns:
+            (IDs of the blocks to go back from, starting with `from_id`, IDs
+            of the blocks to go forward to, ending with `to_id`). Their
+            common ancestor is in neither list.
+
+        """
+        fork = self.entries[self.find_fork(from_id, to_id)]
+
+        to_disconnect = []
+        walk = self.entries[from_id]
+        while walk is not fork:
+            to_disconnect.append(walk.block_id)
+            walk = walk.parent
+
+        to_connect = []
+        walk = self.entries[to_id]
+        while walk is not fork:
+            to_connect.append(walk.block_id)
+            walk = walk.parent
+        to_connect.reverse()
+
+        return to_disconnect, to_connect
+
+    def get_locator(self) -> List[bytes]:
+        """
+        Return a locator of the main branch: IDs of main branch blocks from
+        the top block down to the root block, every block for the top
+        `LOCATOR_DENSE_COUNT` blocks, then exponentially sparser.
+
+        Notes: another tree finds the fork point of its own main branch and
+        this one from the first block of the locator it has.
+        """
+        locator = []
+        step = 1
+        height = self.get_height()
+        while True:
+            locator.append(self.main_chain[height])
+            if height == 0:
+                return locator
+
+            if len(locator) >= BlockTree.LOCATOR_DENSE_COUNT:
+                step *= 2
+            height = max(height - step, 0)
+
+    def get_range(self, locator: List[bytes], stop_id: Optional[bytes],
+                  max_count: int) -> List[bytes]:
+        """
+        Get the IDs of the blocks following a locator.
+
+        Args:
+            locator: IDs of blocks of another tree, the highest first.
+            stop_id: ID of the block the range leads to, or None for the
+                top block.
+            max_count: the maximum number of IDs to be returned.
+
+        Returns:
+            The IDs of the blocks after the fork point of the locator's
+            branch and the branch of `stop_id`, on the way to `stop_id`,
+            in chain order. The fork point is the root block if no locator
+            block is known.
+
+        """
+        if stop_id is None or not self.has_block(stop_id):
+            stop_id = self.main_chain[-1]
+
+        start_id = next((block_id for block_id in locator
+                         if self.has_block(block_id)), HASH_OF_NULL)
+        fork = self.entries[self.find_fork(start_id, stop_id)]
+
+        # main branch blocks are looked up by height
+        if self.is_on_main_chain(stop_id):
+            stop_height = self.entries[stop_id].height
+            return self.main_chain[
+                fork.height + 1: min(stop_height, fork.height + max_count) + 1]
+
+        _, to_connect = self.get_path_between(fork.block_id, stop_id)
+        return to_connect[:max_count]
 
     def get_path(self, block_id: bytes) -> Iterator[bytes]:
         """Get all the block IDs on the path to a specific block."""
-        return self.main_branch.get_path(self.addresses[block_id])
+        fork = self.find_fork(self.main_chain[-1], block_id)
+        _, side_path = self.get_path_between(fork, block_id)
+        yield from self.main_chain[:self.entries[fork].height + 1]
+        yield from side_path
 
     def traverse(self) -> Iterator[bytes]:
-        """Traverse all the blocks in the tree."""
-        yield from self.main_branch.traverse()
+        """Traverse all the blocks in the tree, a block always after its
+        previous block."""
+        yield from list(self.entries)
@@ -0,0 +1,134 @@
+from kmacoin.objects.block import Block
+
+from threading import Condition
+from typing import List, Dict, Optional, Tuple
+
+import heapq
+
+
+class BlockWindows(object):
+    """
+    A thread-safe schedule of the blocks to be downloaded during a sync.
+
+    The blocks are split into windows of consecutive blocks. Downloaders
+    take windows in any order, while the downloaded windows are given out
+    to be validated in chain order.
+
+    Attributes:
+        block_ids: IDs of the blocks to be downloaded, in chain order.
+        window_size: the number of blocks of a window.
+        max_ahead: windows are taken at most this many windows after the
+            next one to be validated.
+        todo: a heap of indexes of the windows to be taken.
+        in_progress: the number of windows being downloaded.
+        done: window index -> the window's blocks, of the downloaded
+            windows which have not been given out yet.
+        next_index: index of the next window to be given out.
+        downloaders: the number of running downloaders.
+        aborted: True if the sync has been aborted.
+        cv: a condition variable, synchronizing accesses to the schedule.
+
+    """
+    block_ids: List[bytes]
+    todo: List[int]
+    done: Dict[int, List[Block]]
+
+    def __init__(self, block_ids: List[bytes], window_size: int,
+                 max_ahead: int):
+        self.block_ids = block_ids
+        self.window_size = window_size
+        self.max_ahead = max_ahead
+        self.todo = list(range(self.get_window_count()))
+        self.in_progress = 0
+        self.done = {}
+        self.next_index = 0
+        self.downloaders = 0
+        self.aborted = False
+        self.cv = Condition()
+
+    def get_window_count(self) -> int:
+        """Return the number of windows."""
+        return -(-len(self.block_ids) // self.window_size)
+
+    def join(self) -> None:
+        """Register a downloader."""
+        with self.cv:
+            self.downloaders += 1
+
+    def leave(self) -> None:
+        """Unregister a downloader."""
+        with self.cv:
+            self.downloaders -= 1
+            self.cv.notify_all()
+
+    def take(self, blocking: bool = True) \
+            -> Optional[Tuple[int, List[bytes]]]:
+        """
+        Take a window to be downloaded.
+
+        Args:
+            blocking: True to wait until a window is available.
+
+        Returns:
+            (index, block IDs) of the window, or None if no window is
+            available.
+
+        """
+        with self.cv:
+            while True:
+                if self.aborted:
+                    return None
+
+                if self.todo and \
+                        self.todo[0] < self.next_index + self.max_ahead:
+                    i = heapq.heappop(self.todo)
+                    self.in_progress += 1
+                    return i, self.block_ids[i * self.window_size:
+                                             (i + 1) * self.window_size]
+
+                # a window being downloaded may still be given back
+                if not blocking or not self.todo and self.in_progress == 0:
+                    return None
+
+                self.cv.wait()
+
+    def give_back(self, i: int) -> None:
+        """Give back a window which could not be downloaded."""
+        with self.cv:
+            heapq.heappush(self.todo, i)
+            self.in_progress -= 1
+            self.cv.notify_all()
+
+    def complete(self, i: int, blocks: List[Block]) -> None:
+        """Hand in the blocks of a downloaded window."""
+        with self.cv:
+            self.done[i] = blocks
+            self.in_progress -= 1
+            self.cv.notify_all()
+
+    def pop_next(self) -> Optional[List[Block]]:
+        """
+        Remove and return the blocks of the next window, in chain order,
+        waiting until it has been downloaded.
+
+        Returns:
+            The blocks, or None if every window has been given out, the sync
+            has been aborted or no downloader is left.
+
+        """
+        with self.cv:
+            while self.next_index not in self.done:
+                if self.next_index >= self.get_window_count() or \
+                        self.aborted or self.downloaders == 0:
+                    return None
+                self.cv.wait()
+
+            self.next_index += 1
+            self.cv.notify_all()
+            return self.done.pop(self.next_index - 1)
+
+    def abort(self) -> None:
+        """Stop giving out windows."""
+        with self.cv:
+            self.aborted = True
+            self.cv.notify_all()
@@ -0,0 +1,70 @@
+from collections import deque
+from typing import Any, Deque
+
+import asyncio
+
+
+class LoopQueue(object):
+    """
+    A FIFO queue, filled by any thread and emptied by a coroutine running on
+    an event loop.
+
+    Notes: `put` is thread-safe. An item is in the queue as soon as `put`
+    returns, only the waiting coroutine is woken up later.
+
+    Attributes:
+        loop: the event loop where the queue is emptied.
+        items: the queued items.
+        event: set when an item is put.
+
+    """
+    items: Deque[Any]
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.items = deque()
+        self.event = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def put(self, item: Any) -> None:
+        """Put an item into the queue."""
+        self.items.append(item)
+        self.loop.call_soon_threadsafe(self.event.set)
+
+    async def wait(self) -> None:
+        """Wait until an item is available."""
+        while not self:
+            self.event.clear()
+            await self.event.wait()
+
+    async def wait_put(self) -> None:
+        """Wait until an item is put."""
+        self.event.clear()
+        await self.event.wait()
+
+    async def get(self) -> Any:
+        """Remove and return an item, waiting until one is available."""
+        await self.wait()
+        return self.get_nowait()
+
+    def get_nowait(self) -> Any:
+        """
+        Remove and return an item.
+
+        Raises:
+            IndexError: if the queue is empty.
+
+        """
+        return self.items.popleft()
+
+    def peek_nowait(self) -> Any:
+        """
+        Return the next item without removing it.
+
+        Raises:
+            IndexError: if the queue is empty.
+
+        """
+        return self.items[0]
@@ -0,0 +1,433 @@
+from kmacoin.objects.transaction import Transaction
+from kmacoin.objects.block import Block
+from kmacoin.objects.coin import Coin
+from kmacoin.objects.state import TransactionError
+from kmacoin.objects.xstate import ExtendedState
+from kmacoin.atnode.structures.blocktemplate import BlockTemplate, \
+    TemplateBuilder
+
+from threading import RLock
+from typing import Dict, List, Set, Tuple
+
+import heapq
+
+
+class MempoolError(Exception):
+    """
+    Raised when a valid transaction cannot be accepted to a mempool.
+
+    Attributes:
+        code: a type code indicates why the transaction is rejected.
+        tx: the rejected transaction.
+
+    """
+
+    # All error codes:
+    ALREADY_IN_POOL = 0
+    CONFLICT = 1
+    POOL_FULL = 2
+
+    def __init__(self, msg: str, code: int, tx: Transaction):
+        super().__init__(msg)
+        self.code = code
+        self.tx = tx
+
+
+class MempoolEntry(object):
+    """
+    A transaction stored in a mempool.
+
+    Attributes:
+        tx: the transaction.
+        fee: the transaction fee.
+        size: the size of the serialized transaction.
+        fee_rate: the fee per byte.
+        input_coins: the coins destroyed by the transaction, kept so that the
+            transaction can be undone.
+        seq: the entry's position in arrival order. An entry always has a
+            bigger `seq` than its parents.
+        parents: IDs of pooled transactions whose coins are spent by this one.
+        children: IDs of pooled transactions spending this one's coins.
+
+    """
+    parents: Set[bytes]
+    children: Set[bytes]
+
+    def __init__(self, tx: Transaction, fee: int, input_coins: List[Coin],
+                 seq: int):
+        self.tx = tx
+        self.fee = fee
+        self.size = len(tx.to_bytes())
+        self.fee_rate = fee / self.size
+        self.input_coins = input_coins
+        self.seq = seq
+        self.parents = set()
+        self.children = set()
+
+
+class Mempool(object):
+    """
+    A thread-safe pool of valid, unconfirmed transactions.
+
+    Every pooled transaction is applied to `state`, a private copy of the
+    latest state. A new transaction is therefore checked against the latest
+    state plus the transactions already in the pool.
+
+    Attributes:
+        max_size: the maximum total size (in bytes) of pooled transactions.
+        state: the latest state with all pooled transactions applied.
+        entries: transaction ID -> entry.
+        spenders: coin ID -> ID of the pooled transaction spending the coin.
+        size: the total size of pooled transactions.
+        version: incremented every time the pool changes.
+        lock: to synchronize concurrent accesses to the pool.
+        eviction_heap: a heap of (fee_rate, seq, tx_id), the worst entry at
+            the top.
+        next_seq: `seq` of the next received transaction.
+        first_seq: `seq` of the latest transaction put back from a
+            disconnected block. Such transactions come before all others.
+        undo_records: block ID -> (metadata of `state` before the block,
+            [(transaction, input coins)]), for recently connected blocks.
+        template_builder: the builder of block templates.
+
+    Notes: removed entries are left in the eviction heap and skipped when
+    popped.
+
+    """
+    entries: Dict[bytes, MempoolEntry]
+    spenders: Dict[Tuple[bytes, int], bytes]
+    undo_records: Dict[bytes, Tuple[tuple, List[Tuple[Transaction,
+                                                      List[Coin]]]]]
+
+    # This parameter decides how many recently connected blocks can be
+    # disconnected without rebuilding the pool:
+    MAX_UNDO_RECORDS = 100
+
+    def __init__(self, max_size: int, state: ExtendedState):
+        self.max_size = max_size
+        self.state = state
+        self.entries = {}
+        self.spenders = {}
+        self.size = 0
+        self.version = 0
+        self.lock = RLock()
+        self.eviction_heap = []
+        self.next_seq = 0
+        self.first_seq = 0
+        self.undo_records = {}
+        self.template_builder = TemplateBuilder(self, Block.MAX_TXS - 2)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get_tip(self) -> bytes:
+        """Return the ID of the block the pool is built on."""
+        return self.state.latest_id
+
+    def has_transaction(self, tx_id: bytes) -> bool:
+        """Test for transaction membership."""
+        return tx_id in self.entries
+
+    def get_transactions(self) -> Dict[bytes, Transaction]:
+        """Return transaction ID -> transaction, of all pooled
+        transactions."""
+        with self.lock:
+            return {tx_id: entry.tx for tx_id, entry in self.entries.items()}
+
+    def add(self, tx: Transaction) -> int:
+        """
+        Try to add a transaction.
+
+        Args:
+            tx: the transaction to be added.
+
+        Raises:
+            TransactionError: if the transaction is invalid.
+            MempoolError: if the transaction is valid but rejected.
+
+        Returns:
+            The transaction fee.
+
+        """
+        with self.lock:
+            tx_id = tx.get_id()
+            if tx_id in self.entries:
+                raise MempoolError("Transaction already in pool!",
+                                   MempoolError.ALREADY_IN_POOL, tx)
+
+            # check for double-spends of pooled transactions' inputs
+            for coin_id in tx.input_ids:
+                if coin_id in self.spenders:
+                    raise MempoolError("Conflicting transaction found!",
+                                       MempoolError.CONFLICT, tx)
+
+            # validate the transaction (input coins are destroyed if valid)
+            input_coins = [self.state.coins.get(coin_id)
+                           for coin_id in tx.input_ids]
+            fee = self.state.process_transaction(tx)
+
+            self._add_entry(MempoolEntry(tx, fee, input_coins,
+                                         self.next_seq))
+            self.next_seq += 1
+
+            # keep the pool under its size limit
+            self._evict()
+            if tx_id not in self.entries:
+                raise MempoolError("Transaction fee too low!",
+                                   MempoolError.POOL_FULL, tx)
+
+            self.template_builder.on_added(self.entries[tx_id])
+            return fee
+
+    def get_template(self) -> BlockTemplate:
+        """
+        Return the most valuable transactions for a new block.
+
+        Transactions are picked together with their pooled ancestors, by the
+        fee per byte of such packages. Parents come before their children.
+
+        """
+        with self.lock:
+            return self.template_builder.get_template()
+
+    def connect_block(self, block: Block) -> None:
+        """
+        Move the pool onto a block extending the block it is built on.
+
+        Transactions confirmed by the block leave the pool. Pooled
+        transactions spending the same coins as the block's transactions are
+        removed together with their descendants. The cost depends on the size
+        of the block, not on the size of the pool.
+
+        Args:
+            block: a valid block whose `prev_id` is the pool's tip.
+
+        Raises:
+            AssertionError: if the block doesn't extend the pool's tip.
+            KeyError: if the block doesn't match the pool's state.
+
+        """
+        with self.lock:
+            assert block.prev_id == self.state.latest_id
+            coins = self.state.coins
+            undo = []
+
+            reward_tx = block.txs[0]
+            for i in range(len(reward_tx.outputs)):
+                coins[(reward_tx.get_id(), i)] = reward_tx.outputs[i]
+            undo.append((reward_tx, []))
+
+            for tx in block.txs[1:]:
+                tx_id = tx.get_id()
+
+                # pooled transaction -> its effect is already in `state`
+                entry = self.entries.get(tx_id)
+                if entry:
+                    self._remove_confirmed(entry)
+                    undo.append((tx, entry.input_coins))
+                    continue
+
+                # remove conflicting transactions, then apply the transaction
+                for coin_id in tx.input_ids:
+                    if coin_id in self.spenders:
+                        self._remove(self.spenders[coin_id])
+                undo.append((tx, [coins.pop(coin_id)
+                                  for coin_id in tx.input_ids]))
+                for i in range(len(tx.outputs)):
+                    coins[(tx_id, i)] = tx.outputs[i]
+
+            # keep the undo record
+            self.undo_records[block.get_id()] = (self._get_metadata(), undo)
+            if len(self.undo_records) > Mempool.MAX_UNDO_RECORDS:
+                del self.undo_records[next(iter(self.undo_records))]
+
+            # update metadata
+            self.state.latest_id = block.get_id()
+            self.state.latest_timestamp = block.timestamp
+            self.state.grow()
+            self.template_builder.invalidate()
+            self.version += 1
+
+    def disconnect_block(self, block_id: bytes) -> None:
+        """
+        Move the pool back onto the parent of the block it is built on.
+
+        The block's transactions are put back into the pool. Pooled
+        transactions spending the block's reward are removed.
+
+        Args:
+            block_id: ID of the pool's tip.
+
+        Raises:
+            AssertionError: if the block is not the pool's tip.
+            KeyError: if the block's undo record is not kept anymore.
+
+        """
+        with self.lock:
+            assert block_id == self.state.latest_id
+            metadata, undo = self.undo_records.pop(block_id)
+
+            # put the transactions back, children before parents
+            for tx, input_coins in undo[:0:-1]:
+                fee = (sum(coin.value for coin in input_coins) -
+                       sum(coin.value for coin in tx.outputs))
+                self.first_seq -= 1
+                self._add_entry(MempoolEntry(tx, fee, input_coins,
+                                             self.first_seq))
+
+            # the block's reward disappears with the block
+            reward_tx, _ = undo[0]
+            for i in range(len(reward_tx.outputs)):
+                coin_id = (reward_tx.get_id(), i)
+                if coin_id in self.spenders:
+                    self._remove(self.spenders[coin_id])
+                del self.state.coins[coin_id]
+
+            self._set_metadata(metadata)
+            self._evict()
+            self.template_builder.invalidate()
+            self.version += 1
+
+    def rebase(self, state: ExtendedState) -> None:
+        """
+        Move the pool onto a new latest state.
+
+        Pooled transactions are re-applied in arrival order, invalid ones are
+        dropped. Unlike `connect_block` and `disconnect_block`, the cost
+        depends on the size of the pool.
+
+        Args:
+            state: the new latest state, owned by the pool from now on.
+
+        """
+        with self.lock:
+            entries = sorted(self.entries.values(), key=lambda e: e.seq)
+            self.state = state
+            self.entries = {}
+            self.spenders = {}
+            self.size = 0
+            self.eviction_heap = []
+            self.undo_records = {}
+
+            for entry in entries:
+                if any(coin_id in self.spenders
+                       for coin_id in entry.tx.input_ids):
+                    continue
+                input_coins = [self.state.coins.get(coin_id)
+                               for coin_id in entry.tx.input_ids]
+                try:
+                    fee = self.state.process_transaction(entry.tx)
+                except TransactionError:
+                    continue
+                self._add_entry(MempoolEntry(entry.tx, fee, input_coins,
+                                             entry.seq))
+
+            self.template_builder.invalidate()
+            self.version += 1
+
+    def _add_entry(self, entry: MempoolEntry) -> None:
+        """Index an entry whose transaction has been applied to `state`."""
+        tx_id = entry.tx.get_id()
+        for coin_id in entry.tx.input_ids:
+            self.spenders[coin_id] = tx_id
+            parent = self.entries.get(coin_id[0])
+            if parent:
+                parent.children.add(tx_id)
+                entry.parents.add(coin_id[0])
+
+        # children may be pooled before their parent is put back
+        for i in range(len(entry.tx.outputs)):
+            child_id = self.spenders.get((tx_id, i))
+            if child_id:
+                self.entries[child_id].parents.add(tx_id)
+                entry.children.add(child_id)
+
+        self.entries[tx_id] = entry
+        self.size += entry.size
+        heapq.heappush(self.eviction_heap, (entry.fee_rate, entry.seq, tx_id))
+        self.version += 1
+
+    def _remove(self, tx_id: bytes) -> None:
+        """Remove an entry and its descendants, undoing their transactions."""
+
+        # order the entry and its descendants so that children come first
+        order = []
+        seen = set()
+        stack = [(tx_id, False)]
+        while stack:
+            current_id, expanded = stack.pop()
+            if expanded:
+                order.append(current_id)
+                continue
+            if current_id in seen:
+                continue
+            seen.add(current_id)
+            stack.append((current_id, True))
+            for child_id in self.entries[current_id].children:
+                if child_id not in seen:
+                    stack.append((child_id, False))
+
+        for current_id in order:
+            self._remove_entry(current_id)
+        self._compact()
+
+    def _remove_entry(self, tx_id: bytes) -> None:
+        """Remove an entry without children, undoing its transaction."""
+        entry = self.entries.pop(tx_id)
+        tx = entry.tx
+        for i in range(len(tx.outputs)):
+            del self.state.coins[(tx_id, i)]
+        for coin_id, coin in zip(tx.input_ids, entry.input_coins):
+            self.state.coins[coin_id] = coin
+            del self.spenders[coin_id]
+        for parent_id in entry.parents:
+            self.entries[parent_id].children.discard(tx_id)
+
+        self.size -= entry.size
+        self.template_builder.on_removed(tx_id)
+        self.version += 1
+
+    def _remove_confirmed(self, entry: MempoolEntry) -> None:
+        """Remove an entry whose transaction has been confirmed, keeping its
+        effect on `state`."""
+        tx_id = entry.tx.get_id()
+        del self.entries[tx_id]
+        for coin_id in entry.tx.input_ids:
+            del self.spenders[coin_id]
+        for parent_id in entry.parents:
+            self.entries[parent_id].children.discard(tx_id)
+        for child_id in entry.children:
+            self.entries[child_id].parents.discard(tx_id)
+
+        self.size -= entry.size
+        self._compact()
+
+    def _get_metadata(self) -> tuple:
+        """Return the metadata of `state`."""
+        return (self.state.age, self.state.reward, self.state.threshold,
+                self.state.latest_id, self.state.latest_timestamp,
+                self.state.last_threshold_update)
+
+    def _set_metadata(self, metadata: tuple) -> None:
+        """Restore the metadata of `state`."""
+        (self.state.age, self.state.reward, self.state.threshold,
+         self.state.latest_id, self.state.latest_timestamp,
+         self.state.last_threshold_update) = metadata
+
+    def _evict(self) -> None:
+        """Remove the entries with the lowest fee rates until the pool fits
+        in its size limit."""
+        while self.size > self.max_size:
+            _, seq, tx_id = heapq.heappop(self.eviction_heap)
+            entry = self.entries.get(tx_id)
+            if entry is not None and entry.seq == seq:
+                self._remove(tx_id)
+
+    def _compact(self) -> None:
+        """Drop removed entries from the eviction heap once they make up most
+        of it."""
+        if len(self.eviction_heap) > 2 * len(self.entries) + 64:
+            self.eviction_heap = [item for item in self.eviction_heap
+                                  if item[2] in self.entries and
+                                  self.entries[item[2]].seq == item[1]]
+            heapq.heapify(self.eviction_heap)
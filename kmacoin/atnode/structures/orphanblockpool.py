@@ -0,0 +1,136 @@
+from kmacoin.objects.block import Block
+
+from threading import Lock
+from typing import Dict, List, Set, Tuple, Optional
+
+import time
+
+
+class OrphanBlockPool(object):
+    """
+    A thread-safe pool of orphaned blocks, i.e. blocks whose previous blocks
+    are not found yet, indexed by their missing previous blocks.
+
+    Orphans extending one another form chains. A chain is waiting for the
+    missing previous block of its lowest orphan (its root), which is fetched
+    only once for all the orphans of the chain.
+
+    Attributes:
+        max_size: the maximum number of orphans.
+        expiry: how long (in seconds) an orphan is kept.
+        orphans: block ID -> (block, expiration time), the oldest orphan
+            first.
+        waiting: block ID -> IDs of orphans extending the block.
+        fetching: IDs of the missing blocks being fetched.
+        lock: to synchronize concurrent accesses to the pool.
+
+    """
+    orphans: Dict[bytes, Tuple[Block, float]]
+    waiting: Dict[bytes, Set[bytes]]
+    fetching: Set[bytes]
+
+    def __init__(self, max_size: int, expiry: float):
+        self.max_size = max_size
+        self.expiry = expiry
+        self.orphans = {}
+        self.waiting = {}
+        self.fetching = set()
+        self.lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.orphans)
+
+    def add(self, block: Block) -> Optional[bytes]:
+        """
+        Add an orphan, and find the missing block its chain is waiting for.
+
+        Args:
+            block: the orphaned block (or an object wrapping it).
+
+        Returns:
+            The ID of the missing block, if it has to be fetched. None if it
+            (or a block of the chain) is being fetched already, or the orphan
+            is a duplicate.
+
+        """
+        with self.lock:
+            self._expire()
+
+            block_id = block.get_id()
+            if block_id in self.orphans:
+                return None
+
+            # make room by dropping the oldest orphan
+            if len(self.orphans) >= self.max_size:
+                self._remove(next(iter(self.orphans)))
+
+            self.orphans[block_id] = (block, time.time() + self.expiry)
+            self.waiting.setdefault(block.prev_id, set()).add(block_id)
+
+            # walk down to the root of the orphan's chain, a block being
+            # fetched comes with its missing ancestors
+            missing_id = block_id
+            while missing_id in self.orphans:
+                if missing_id in self.fetching:
+                    return None
+                missing_id = self.orphans[missing_id][0].prev_id
+
+            if missing_id in self.fetching:
+                return None
+            self.fetching.add(missing_id)
+            return missing_id
+
+    def done_fetching(self, block_id: bytes) -> None:
+        """Mark a missing block as not being fetched anymore, whether it has
+        been found or not."""
+        with self.lock:
+            self.fetching.discard(block_id)
+
+    def pop_branches(self, block_id: bytes) -> List[List[Block]]:
+        """
+        Remove and return the orphans extending a block, directly or not.
+
+        Args:
+            block_id: ID of the block which has just been added.
+
+        Returns:
+            Branches of orphans in chain order, one per orphan not extended
+            by any other. Orphans shared by several branches are in each of
+            them.
+
+        """
+        with self.lock:
+            self._expire()
+
+            branches = []
+            stack = [[self._remove(child_id)]
+                     for child_id in self.waiting.get(block_id, set()).copy()]
+            while stack:
+                branch = stack.pop()
+                child_ids = self.waiting.get(branch[-1].get_id(), set())
+                if not child_ids:
+                    branches.append(branch)
+                for child_id in child_ids.copy():
+                    stack.append(branch + [self._remove(child_id)])
+
+            return branches
+
+    def _remove(self, block_id: bytes) -> Block:
+        """Remove an orphan and return it."""
+        block, _ = self.orphans.pop(block_id)
+        block_ids = self.waiting.get(block.prev_id)
+        if block_ids is not None:
+            block_ids.discard(block_id)
+            if not block_ids:
+                del self.waiting[block.prev_id]
+
+        return block
+
+    def _expire(self) -> None:
+        """Remove expired orphans."""
+        now = time.time()
+        while self.orphans:
+            oldest_id = next(iter(self.orphans))
+            if self.orphans[oldest_id][1] > now:
+                break
+            self._remove(oldest_id)
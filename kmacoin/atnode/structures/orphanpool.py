@@ -0,0 +1,127 @@
+from kmacoin.objects.transaction import Transaction
+
+from threading import Lock
+from typing import Dict, List, Set, Tuple, Any
+
+import time
+
+
+class OrphanPool(object):
+    """
+    A thread-safe pool of orphaned transactions, i.e. transactions spending
+    coins which are not found yet.
+
+    Notes: orphans are kept wrapped in `XObject`s, so that a released orphan
+    is processed again with the peer it came from. The wrapper's attributes
+    are the transaction's ones.
+
+    Attributes:
+        max_size: the maximum number of orphans.
+        max_per_peer: the maximum number of orphans received from one peer.
+        expiry: how long (in seconds) an orphan is kept.
+        orphans: transaction ID -> (wrapped transaction, peer, expiration
+            time), the oldest orphan first.
+        waiting: coin ID -> IDs of orphans spending the coin.
+        peer_counts: peer -> the number of orphans received from the peer.
+        lock: to synchronize concurrent accesses to the pool.
+
+    """
+    orphans: Dict[bytes, Tuple['XObject', Any, float]]
+    waiting: Dict[Tuple[bytes, int], Set[bytes]]
+    peer_counts: Dict[Any, int]
+
+    def __init__(self, max_size: int, max_per_peer: int, expiry: float):
+        self.max_size = max_size
+        self.max_per_peer = max_per_peer
+        self.expiry = expiry
+        self.orphans = {}
+        self.waiting = {}
+        self.peer_counts = {}
+        self.lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.orphans)
+
+    def get_transactions(self) -> Dict[bytes, 'XObject']:
+        """Return transaction ID -> wrapped transaction, of all orphans."""
+        with self.lock:
+            return {tx_id: orphan[0]
+                    for tx_id, orphan in self.orphans.items()}
+
+    def add(self, tx: 'XObject', peer: Any = None) -> bool:
+        """
+        Try to add an orphan.
+
+        Args:
+            tx: the orphaned transaction, wrapped in an `XObject`.
+            peer: the peer which sent the transaction.
+
+        Returns:
+            True if the orphan is actually added, otherwise False.
+
+        """
+        with self.lock:
+            self._expire()
+
+            tx_id = tx.get_id()
+            if tx_id in self.orphans:
+                return False
+            if self.peer_counts.get(peer, 0) >= self.max_per_peer:
+                return False
+
+            # make room by dropping the oldest orphan
+            if len(self.orphans) >= self.max_size:
+                self._remove(next(iter(self.orphans)))
+
+            self.orphans[tx_id] = (tx, peer, time.time() + self.expiry)
+            for coin_id in tx.input_ids:
+                self.waiting.setdefault(coin_id, set()).add(tx_id)
+            self.peer_counts[peer] = self.peer_counts.get(peer, 0) + 1
+            return True
+
+    def pop_children(self, tx: Transaction) -> List['XObject']:
+        """
+        Remove and return the orphans spending a transaction's coins.
+
+        Args:
+            tx: the transaction which has just been accepted.
+
+        Returns:
+            The released orphans (wrapped), the oldest first.
+
+        """
+        with self.lock:
+            self._expire()
+
+            tx_id = tx.get_id()
+            children = set()
+            for i in range(len(tx.outputs)):
+                children |= self.waiting.get((tx_id, i), set())
+
+            return [self._remove(child_id) for child_id in
+                    sorted(children, key=lambda i: self.orphans[i][2])]
+
+    def _remove(self, tx_id: bytes) -> 'XObject':
+        """Remove an orphan and return it."""
+        tx, peer, _ = self.orphans.pop(tx_id)
+        for coin_id in tx.input_ids:
+            tx_ids = self.waiting.get(coin_id)
+            if tx_ids is not None:
+                tx_ids.discard(tx_id)
+                if not tx_ids:
+                    del self.waiting[coin_id]
+
+        self.peer_counts[peer] -= 1
+        if self.peer_counts[peer] == 0:
+            del self.peer_counts[peer]
+
+        return tx
+
+    def _expire(self) -> None:
+        """Remove expired orphans."""
+        now = time.time()
+        while self.orphans:
+            oldest_id = next(iter(self.orphans))
+            if self.orphans[oldest_id][2] > now:
+                break
+            self._remove(oldest_id)
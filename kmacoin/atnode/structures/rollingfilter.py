@@ -0,0 +1,103 @@
+from threading import Lock
+from typing import List
+
+import hashlib
+import math
+import os
+
+
+class RollingBloomFilter(object):
+    """
+    A thread-safe, memory-compact set of recently added IDs.
+
+    The filter is made of `GENERATIONS` Bloom filters, each holding up to
+    `capacity / (GENERATIONS - 1)` IDs. New IDs go to the current filter.
+    When it is full, the oldest filter is cleared and becomes the current
+    one, so at least the `capacity` latest IDs are always remembered.
+
+    Unlike `Pool`, the filter may report an ID as already added when it is
+    not (false positive), with a probability of about `fp_rate`.
+
+    Attributes:
+        generation_capacity: the maximum number of IDs in each filter.
+        bit_count: the number of bits in each filter.
+        hash_count: the number of bits set for each ID.
+        filters: the Bloom filters' bit arrays.
+        current: index of the current filter.
+        count: the number of IDs in the current filter.
+        salt: a random key, making the positions unpredictable to peers.
+        lock: to synchronize concurrent accesses to the filter.
+
+    """
+    filters: List[bytearray]
+
+    # The number of Bloom filters:
+    GENERATIONS = 3
+
+    def __init__(self, capacity: int, fp_rate: float):
+        self.generation_capacity = math.ceil(
+            capacity / (RollingBloomFilter.GENERATIONS - 1))
+
+        # an ID is looked up in every filter, share the false positive rate
+        fp_rate /= RollingBloomFilter.GENERATIONS
+        self.bit_count = math.ceil(
+            -self.generation_capacity * math.log(fp_rate) / math.log(2) ** 2)
+        self.hash_count = max(1, round(
+            self.bit_count / self.generation_capacity * math.log(2)))
+
+        self.filters = [bytearray((self.bit_count + 7) // 8)
+                        for _ in range(RollingBloomFilter.GENERATIONS)]
+        self.current = 0
+        self.count = 0
+        self.salt = os.urandom(16)
+        self.lock = Lock()
+
+    def add(self, obj: bytes) -> bool:
+        """
+        Try to add an ID.
+
+        Args:
+            obj: the ID to be added.
+
+        Returns:
+            True if the ID is actually added, otherwise False.
+
+        """
+        positions = self._get_positions(obj)
+        with self.lock:
+            if self._contains(positions):  # the ID is already added.
+                return False
+
+            # clear the oldest filter when the current one is full
+            if self.count == self.generation_capacity:
+                self.current = (self.current + 1) % len(self.filters)
+                self.filters[self.current] = bytearray(
+                    len(self.filters[self.current]))
+                self.count = 0
+
+            bits = self.filters[self.current]
+            for p in positions:
+                bits[p >> 3] |= 1 << (p & 7)
+            self.count += 1
+
+            return True
+
+    def __contains__(self, obj: bytes) -> bool:
+        positions = self._get_positions(obj)
+        with self.lock:
+            return self._contains(positions)
+
+    def _contains(self, positions: List[int]) -> bool:
+        """Test if all the bits at some positions are set in one filter."""
+        for bits in self.filters:
+            if all(bits[p >> 3] & (1 << (p & 7)) for p in positions):
+                return True
+        return False
+
+    def _get_positions(self, obj: bytes) -> List[int]:
+        """Return the positions of the bits representing an ID."""
+        digest = hashlib.blake2b(obj, digest_size=16, key=self.salt).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return [(h1 + i * h2) % self.bit_count
+                for i in range(self.hash_count)]
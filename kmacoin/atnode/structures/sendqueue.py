@@ -0,0 +1,126 @@
+from kmacoin.atnode.structures.loopqueue import LoopQueue
+
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple, Callable
+
+import asyncio
+import time
+
+
+class SendQueue(LoopQueue):
+    """
+    A bounded `LoopQueue` of commands for a peer, made of priority lanes and
+    measuring how long the commands wait.
+
+    Notes: items are taken from the first non-empty lane, in FIFO order
+    within a lane. A droppable item (e.g. a transaction announcement) is
+    dropped if its lane is full. Other items are always queued, even beyond
+    `max_size`, so that they are never lost.
+
+    Attributes:
+        max_size: the number of items of a lane above which droppable items
+            are dropped.
+        get_lane: a function returning the index of an item's lane.
+        lanes: (put time, item) of the queued items of each lane, the
+            highest priority lane first.
+        dropped: the number of dropped items.
+        peak_depth: the maximum number of items ever queued at once.
+        latency: the average time (in seconds) an item waits in the queue,
+            recent items weighing more.
+        max_latency: the maximum time (in seconds) an item waited.
+
+    """
+    lanes: List[Deque[Tuple[float, Any]]]
+
+    # weight of the latest item in `latency`:
+    LATENCY_WEIGHT = 0.1
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_size: int,
+                 lane_count: int = 1,
+                 get_lane: Callable[[Any], int] = lambda item: 0):
+        super().__init__(loop)
+        self.max_size = max_size
+        self.get_lane = get_lane
+        self.lanes = [deque() for _ in range(lane_count)]
+        self.dropped = 0
+        self.peak_depth = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+
+    def __len__(self) -> int:
+        return sum(len(lane) for lane in self.lanes)
+
+    def put(self, item: Any, droppable: bool = False) -> None:
+        """
+        Put an item into its lane.
+
+        Args:
+            item: the item.
+            droppable: True to drop the item if its lane is full.
+
+        """
+        lane = self.lanes[self.get_lane(item)]
+        if droppable and len(lane) >= self.max_size:
+            self.dropped += 1
+            return
+
+        lane.append((time.monotonic(), item))
+        self.loop.call_soon_threadsafe(self.event.set)
+        self.peak_depth = max(self.peak_depth, len(self))
+
+    def get_nowait(self) -> Any:
+        """
+        Remove and return an item.
+
+        Raises:
+            IndexError: if the queue is empty.
+
+        """
+        put_time, item = self._get_lane().popleft()
+        latency = time.monotonic() - put_time
+        self.latency += SendQueue.LATENCY_WEIGHT * (latency - self.latency)
+        self.max_latency = max(self.max_latency, latency)
+        return item
+
+    def peek_nowait(self) -> Any:
+        """
+        Return the next item without removing it.
+
+        Raises:
+            IndexError: if the queue is empty.
+
+        """
+        return self._get_lane()[0][1]
+
+    def get_lag(self) -> float:
+        """Return how long (in seconds) the oldest queued item has been
+        waiting, 0 if the queue is empty."""
+        put_times = [lane[0][0] for lane in self.lanes if lane]
+        if not put_times:
+            return 0.0
+        return time.monotonic() - min(put_times)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return the queue's metrics."""
+        return {
+            "depth": len(self),
+            "lane_depths": [len(lane) for lane in self.lanes],
+            "peak_depth": self.peak_depth,
+            "dropped": self.dropped,
+            "latency": self.latency,
+            "max_latency": self.max_latency,
+            "lag": self.get_lag(),
+        }
+
+    def _get_lane(self) -> Deque[Tuple[float, Any]]:
+        """
+        Return the first non-empty lane.
+
+        Raises:
+            IndexError: if the queue is empty.
+
+        """
+        for lane in self.lanes:
+            if lane:
+                return lane
+        raise IndexError("The queue is empty!")
@@ -77,6 +77,12 @@ class StateCache(object):
         _, value = item.obj
         return value
 
+    def remove(self, key: bytes):
+        """Remove a key and its value from this cache, if any."""
+        item = self.items_dict.pop(key, None)
+        if item is not None:
+            self.items_dll.remove(item)
+
     def haskey(self, key: bytes) -> bool:
         """Test cache hit/miss."""
         return key in self.items_dict
@@ -0,0 +1,105 @@
+from kmacoin.globaldef.hash import HASH_SIZE
+from kmacoin.objects.block import Block
+from kmacoin.objects.coin import Coin
+from kmacoin.objects.transaction import Transaction
+from kmacoin.objects.xstate import ExtendedState
+
+import io
+import os
+
+
+class StateFile(object):
+    """
+    A file holding a snapshot of a state, e.g. the top block's one, so that
+    it doesn't need to be computed again from the blocks.
+
+    The file is made of the state's metadata, then its coins, each with its
+    coin ID. It is replaced at once when written, so an interrupted write
+    leaves the previous snapshot.
+
+    Attributes:
+        path: where the file is stored.
+
+    """
+    # Field sizes of the metadata:
+    LATEST_ID_FSZ = HASH_SIZE
+    AGE_FSZ = 4
+    REWARD_FSZ = Coin.VALUE_FSZ
+    THRESHOLD_FSZ = HASH_SIZE
+    TIMESTAMP_FSZ = Block.TIMESTAMP_FSZ
+    FLAG_FSZ = 1
+    COIN_COUNT_FSZ = 4
+
+    # Field sizes of a coin:
+    TX_ID_FSZ = Transaction.TX_ID_FSZ
+    SEQ_FSZ = Transaction.SEQ_FSZ
+    COIN_FSZ = Coin.SIZE
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def exists(self) -> bool:
+        """Test if the file has been created."""
+        return os.path.isfile(self.path)
+
+    def write(self, state: ExtendedState) -> None:
+        """Replace the file's snapshot with a state's one."""
+        last_update = state.last_threshold_update
+        data = b"".join([
+            state.latest_id,
+            state.age.to_bytes(StateFile.AGE_FSZ, "big"),
+            state.reward.to_bytes(StateFile.REWARD_FSZ, "big"),
+            state.threshold,
+            state.latest_timestamp.to_bytes(StateFile.TIMESTAMP_FSZ, "big"),
+            int(last_update is not None).to_bytes(StateFile.FLAG_FSZ, "big"),
+            (last_update or 0).to_bytes(StateFile.TIMESTAMP_FSZ, "big"),
+            len(state.coins).to_bytes(StateFile.COIN_COUNT_FSZ, "big"),
+            b"".join(
+                tx_id + seq.to_bytes(StateFile.SEQ_FSZ, "big") +
+                coin.to_bytes()
+                for (tx_id, seq), coin in state.coins.items()
+            )
+        ])
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    def read(self) -> ExtendedState:
+        """
+        Read the file's snapshot.
+
+        Raises:
+            AssertionError: if the file is truncated.
+
+        """
+        with open(self.path, "rb") as f:
+            r = io.BytesIO(f.read())
+
+        def read_exact(size: int) -> bytes:
+            data = r.read(size)
+            assert len(data) == size  # truncated file
+            return data
+
+        def read_int(size: int) -> int:
+            return int.from_bytes(read_exact(size), "big")
+
+        state = ExtendedState()
+        state.latest_id = read_exact(StateFile.LATEST_ID_FSZ)
+        state.age = read_int(StateFile.AGE_FSZ)
+        state.reward = read_int(StateFile.REWARD_FSZ)
+        state.threshold = read_exact(StateFile.THRESHOLD_FSZ)
+        state.latest_timestamp = read_int(StateFile.TIMESTAMP_FSZ)
+        has_last_update = read_int(StateFile.FLAG_FSZ)
+        last_update = read_int(StateFile.TIMESTAMP_FSZ)
+        state.last_threshold_update = last_update if has_last_update \
+            else None
+
+        for _ in range(read_int(StateFile.COIN_COUNT_FSZ)):
+            coin_id = (read_exact(StateFile.TX_ID_FSZ),
+                       read_int(StateFile.SEQ_FSZ))
+            state.coins[coin_id] = Coin.read_from(
+                io.BytesIO(read_exact(StateFile.COIN_FSZ)))
+
+        return state
@@ -28,7 +28,17 @@ class AddressProcessor(Thread):
                     continue
                 if addr in self.node.connected_addrs:
                     continue
+                if self.node.has_failed_address(addr):
+                    continue
+
+                # while peers are needed, connecting to the address as a peer
+                # validates it, rather than a separate connection
+                if self.node.needs_peers():
+                    self.node.add_unconnected_address(addr, unvalidated=xaddr)
+                    continue
+
                 if not self.validate(addr):
+                    self.node.add_failed_address(addr)
                     continue
                 if self.node.add_unconnected_address(addr):
                     self.node.valid_obj_queue.put(xaddr)
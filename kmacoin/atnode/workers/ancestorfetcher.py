@@ -0,0 +1,117 @@
+from kmacoin.objects.block import Block
+from kmacoin.network.protocol import Protocol
+from kmacoin.atnode.node import Node
+from kmacoin.atnode.workers.client import Client
+from kmacoin.atnode.workers.server import XObject, Server
+
+from threading import Thread
+from queue import Queue
+from typing import List, Optional
+
+
+class AncestorFetcher(Thread):
+    """
+    This class represents an ancestor fetcher, fetching a missing block and
+    its missing ancestors for the orphans waiting for it.
+
+    Notes: the blocks are asked for in ranges if the node understands block
+    locators, otherwise one at a time. The fetched branch is pushed to the
+    block queue, and the waiting orphans are released once it is added.
+
+    Attributes:
+        node: a node which it works for.
+        block_id: ID of the missing block.
+        server_thread: the local server which received the orphans; the
+            blocks are asked for through its partner client.
+
+    """
+    def __init__(self, node: Node, block_id: bytes, server_thread: Server):
+        super().__init__()
+        self.node = node
+        self.block_id = block_id
+        self.server_thread = server_thread
+
+    def run(self):
+        try:
+            cmd_q = self.server_thread.partner.cmd_queue
+            tmp_q = Queue()
+
+            branch = []
+            if self.server_thread.partner.s.version >= \
+                    Protocol.VERSION_LOCATORS:
+                branch = self.get_range(cmd_q, tmp_q)
+                if branch is None:  # broken link
+                    return
+                branch.reverse()
+
+            # get the missing blocks one at a time until the branch can be
+            # connected to the block tree
+            block_id = branch[-1].prev_id if branch else self.block_id
+            while not self.node.block_tree.has_block(block_id):
+                with self.node.client_cmd_queues_cv:
+                    if cmd_q not in self.node.client_cmd_queues:
+                        return  # broken link
+                    cmd_q.put([Client.CMD_REQ_BLOCK, block_id, tmp_q])
+
+                block = tmp_q.get()
+                if not block:  # broken link
+                    return
+                branch.append(block)
+                block_id = block.prev_id
+
+            # push the branch to the block queue, to be added at once
+            if branch:
+                for block in branch:
+                    self.node.block_id_pool.add(block.get_id())
+                self.node.block_queue.put([
+                    XObject(block, Protocol.REQ_BLOCK, self.server_thread)
+                    for block in reversed(branch)
+                ])
+
+        finally:
+            self.node.orphan_block_pool.done_fetching(self.block_id)
+
+    def get_range(self, cmd_q, tmp_q: Queue) -> Optional[List[Block]]:
+        """
+        Get the missing block and its ancestors missing from the block tree
+        with REQ_BLOCK_RANGE messages, starting from the fork point of the
+        local main branch.
+
+        Args:
+            cmd_q: the command queue of the client to ask with.
+            tmp_q: a queue where the client puts its replies.
+
+        Returns:
+            The blocks in chain order, or None if the connection is broken.
+            The list is empty if the node didn't send the requested branch.
+
+        """
+        with self.node.block_tree_lock:
+            locator = self.node.block_tree.get_locator()
+
+        blocks = []
+        while True:
+            with self.node.client_cmd_queues_cv:
+                if cmd_q not in self.node.client_cmd_queues:
+                    return None
+                cmd_q.put([Client.CMD_REQ_BLOCK_RANGE, locator,
+                           self.block_id, tmp_q])
+
+            received = tmp_q.get()
+            if received is None:
+                return None
+
+            # the blocks must form a branch, following the previous ones
+            for block in received:
+                if blocks and block.prev_id != blocks[-1].get_id():
+                    return []
+                blocks.append(block)
+
+            if not received:
+                return []
+            if blocks[-1].get_id() == self.block_id:
+                return blocks
+
+            # a range is limited in size, go on from the last received block
+            locator = [blocks[-1].get_id()] + \
+                locator[:Protocol.MAX_LOCATOR_LEN - 1]
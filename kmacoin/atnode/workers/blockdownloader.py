@@ -0,0 +1,80 @@
+from kmacoin.network.kmasocket import KMASocket
+from kmacoin.network.protocol import Protocol
+from kmacoin.atnode.node import Node
+from kmacoin.atnode.structures.blockwindows import BlockWindows
+
+from collections import deque
+from threading import Thread
+from typing import Tuple, List, Deque
+
+
+class BlockDownloader(Thread):
+    """
+    This class represents a block downloader, downloading windows of blocks
+    from a node during a sync.
+
+    Notes: the requests of a window are sent at once, and up to
+    `MAX_WINDOWS_IN_FLIGHT` windows are requested before their blocks are
+    received, so that the connection is kept busy. If something goes wrong,
+    the windows in flight are given back to be downloaded from other nodes,
+    and the downloader stops.
+
+    Attributes:
+        node: a node which it works for.
+        addr: the address of the node to download from.
+        windows: the schedule of the blocks to be downloaded.
+
+    """
+    MAX_WINDOWS_IN_FLIGHT = 4
+
+    def __init__(self, node: Node, addr: Tuple[str, int],
+                 windows: BlockWindows):
+        super().__init__()
+        self.node = node
+        self.addr = addr
+        self.windows = windows
+        self.windows.join()
+
+    def run(self):
+        s = KMASocket(virt_loc=self.node.virt_loc, name=self.node.name)
+        s.settimeout(self.node.connection_timeout)
+
+        # (index, block IDs) of the requested windows, in request order
+        in_flight: Deque[Tuple[int, List[bytes]]] = deque()
+        try:
+            s.connect(self.addr)
+            while True:
+                # request more windows, waiting only if none is in flight
+                while len(in_flight) < BlockDownloader.MAX_WINDOWS_IN_FLIGHT:
+                    window = self.windows.take(blocking=not in_flight)
+                    if window is None:
+                        break
+                    s.sendall(b"".join(Protocol.REQ_BLOCK + block_id
+                                       for block_id in window[1]))
+                    in_flight.append(window)
+
+                if not in_flight:
+                    return
+
+                # receive the blocks of the oldest window
+                i, block_ids = in_flight[0]
+                blocks = []
+                for block_id in block_ids:
+                    block = s.recv_block()
+                    assert block.get_id() == block_id
+                    blocks.append(block)
+
+                in_flight.popleft()
+                self.windows.complete(i, blocks)
+
+        except (OSError, AssertionError):
+            for i, _ in in_flight:
+                self.windows.give_back(i)
+
+            if self.node.verbose:
+                print("[WARNING] Error downloading blocks from {}".format(
+                    self.addr))
+
+        finally:
+            s.close()
+            self.windows.leave()
@@ -4,6 +4,7 @@ from kmacoin.objects.block import Block
 from kmacoin.atnode.node import Node
 
 from threading import Thread
+from typing import List
 
 
 class BlockProcessor(Thread):
@@ -28,46 +29,64 @@ class BlockProcessor(Thread):
                 else:
                     assert False
 
-            # obj should be a block now
-            block: Block = obj
+            # obj should be a block or a branch of blocks now
+            blocks: List[Block] = obj if isinstance(obj, list) else [obj]
+            new_blocks = [block for block in blocks if
+                          not self.node.block_tree.has_block(block.get_id())]
 
             # verify and update the block tree
             try:
-                if not self.node.add_block(block):
-                    continue  # duplicate or orphaned block
-
-                self.node.valid_obj_queue.put(block)
-
-                if self.node.verbose:
-                    new_state = self.node.state_cache.get(block.get_id())
-                    new_age = new_state.age
-
-                    # print new block info
-                    print("\n({}) New block received.".format(new_age))
-                    print("Block ID: {}...".
-                          format(block.get_id().hex()[:self.node.hexlen]))
-                    new_coin = block.txs[0].outputs[0]
-                    print("{} KMAC added to account {}...".format(
-                        new_coin.value,
-                        new_coin.owner.hex()[:self.node.hexlen]
-                    ))
-
-                    # check if threshold is updated
-                    if (new_age % THRESHOLD_UPDATE_INTERVAL == 1 and
-                            new_age != 1):
-                        print("\nThreshold updated to {}...".format(
-                            new_state.threshold.hex()[:self.node.hexlen]))
-
-                    # check if reward is updated
-                    if new_age % REWARD_UPDATE_INTERVAL == 0:
-                        print("\nReward updated to {} KMAC.".
-                              format(new_state.reward))
+                self.node.add_blocks(blocks)
 
             except BlockError as err:
                 if self.node.verbose:
                     print("\n[WARNING] Receive an invalid block.")
                     print("Block ID: {}...".
-                          format(block.get_id().hex()[:self.node.hexlen]))
+                          format(err.block.get_id().hex()[:self.node.hexlen]))
                     print("({})".format(err))
 
                 # may add action to ban the node which sent the invalid block...
+
+            # relay the added blocks (not the duplicate or orphaned ones)
+            for block in new_blocks:
+                if not self.node.block_tree.has_block(block.get_id()):
+                    continue
+
+                self.node.valid_obj_queue.put(block)
+
+                # release the orphans waiting for the block (if any)
+                for branch in self.node.orphan_block_pool.pop_branches(
+                        block.get_id()):
+                    self.node.block_queue.put(branch)
+
+                if self.node.verbose:
+                    self.print_block_info(block)
+
+    def print_block_info(self, block: Block) -> None:
+        """Print out a new block's info."""
+        new_age = self.node.block_tree.get_block_height(block.get_id())
+
+        # print new block info
+        print("\n({}) New block received.".format(new_age))
+        print("Block ID: {}...".
+              format(block.get_id().hex()[:self.node.hexlen]))
+        new_coin = block.txs[0].outputs[0]
+        print("{} KMAC added to account {}...".format(
+            new_coin.value,
+            new_coin.owner.hex()[:self.node.hexlen]
+        ))
+
+        # the state is not cached for every block of a branch
+        if not self.node.state_cache.haskey(block.get_id()):
+            return
+        new_state = self.node.state_cache.get(block.get_id())
+
+        # check if threshold is updated
+        if new_age % THRESHOLD_UPDATE_INTERVAL == 1 and new_age != 1:
+            print("\nThreshold updated to {}...".format(
+                new_state.threshold.hex()[:self.node.hexlen]))
+
+        # check if reward is updated
+        if new_age % REWARD_UPDATE_INTERVAL == 0:
+            print("\nReward updated to {} KMAC.".
+                  format(new_state.reward))
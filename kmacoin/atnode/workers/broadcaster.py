@@ -13,7 +13,12 @@ import random
 
 
 class Broadcaster(Thread):
-    """This class represents a broadcaster in KMA-Coin system."""
+    """
+    This class represents a broadcaster in KMA-Coin system.
+
+    Notes: transactions and addresses are dropped for the peers whose command
+    queues are full, blocks are always queued.
+    """
     def __init__(self, node: Node):
         super().__init__()
         self.node = node
@@ -73,27 +78,28 @@ class Broadcaster(Thread):
             ):
                 if cmd_queue == exclude:
                     continue
-                cmd_queue.put([Client.CMD_SEND, addr_data])
+                cmd_queue.put([Client.CMD_SEND, addr_data], droppable=True)
 
     def broadcast_transaction(self, tx: Transaction, exclude: Queue = None) \
             -> None:
         """Broadcast a transaction."""
-        data1 = Protocol.INF_TRANSACTION + tx.get_id()
-        data2 = tx.to_bytes()
+        tx_id = tx.get_id()
+        data = tx.to_bytes()
 
         with self.node.client_cmd_queues_cv:
             for cmd_queue in self.node.client_cmd_queues:
                 if cmd_queue == exclude:
                     continue
-                cmd_queue.put([Client.CMD_INFORM, data1, data2])
+                cmd_queue.put([Client.CMD_INFORM_TRANSACTION, tx_id, data],
+                              droppable=True)
 
     def broadcast_block(self, block: Block, exclude: Queue = None) -> None:
         """Broadcast a block."""
-        data1 = Protocol.INF_BLOCK + block.get_id()
-        data2 = block.to_bytes()
+        data = block.to_bytes()
 
         with self.node.client_cmd_queues_cv:
             for cmd_queue in self.node.client_cmd_queues:
                 if cmd_queue == exclude:
                     continue
-                cmd_queue.put([Client.CMD_INFORM, data1, data2])
+                # blocks are never dropped
+                cmd_queue.put([Client.CMD_INFORM_BLOCK, block, data])
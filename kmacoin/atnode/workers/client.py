@@ -1,72 +1,161 @@
-from kmacoin.network.kmasocket import KMASocket
+from kmacoin.objects.block import Block
+from kmacoin.network.aiokmasocket import AsyncKMASocket
 from kmacoin.network.protocol import Protocol
 from kmacoin.atnode.node import Node
+from kmacoin.atnode.structures.sendqueue import SendQueue
 
-from typing import Tuple
-from threading import Thread
-from queue import Queue, Empty
+from collections import deque
+from typing import Tuple, List, Deque, Optional
+from queue import Queue
 
+import asyncio
 
-class Client(Thread):
+
+class Client(object):
     """
     This class represents a client in KMA-Coin system.
 
+    Notes: a client runs as a coroutine on its node's event loop, and must be
+    created there.
+
     Attributes:
         node: a node which it works for.
         s: a socket which is used to communicate with a remote server.
-        cmd_queue: a queue where the client fetches commands.
+        cmd_queue: a bounded queue where the client fetches commands, filled
+            by any thread. Commands are taken from one lane per kind, the
+            block lanes first. Transaction and address announcements are
+            dropped when their lanes are full.
         peer_addr: the remote server's address.
-        partner: a local server thread holding another connection to a same
-            node.
+        partner: a local server holding another connection to a same node.
+        pending_invs: the serialized transactions of each sent INF_INV
+            message whose reply has not been received, the oldest first.
+        reply_task: a task receiving the reply to the oldest pending INF_INV
+            message, started while the client had nothing else to do.
 
     """
+    pending_invs: Deque[List[bytes]]
+    reply_task: Optional[asyncio.Task]
 
     # Command codes:
     CMD_EXIT = 0
     CMD_SEND = 1
     CMD_INFORM = 2
     CMD_REQ_BLOCK = 3
+    CMD_INFORM_BLOCK = 4
+    CMD_INFORM_TRANSACTION = 5
+    CMD_REQ_BLOCK_RANGE = 6
+
+    # Command queue lanes, the highest priority first:
+    LANE_BLOCK = 0
+    LANE_BLOCK_REQUEST = 1
+    LANE_TRANSACTION = 2
+    LANE_ADDRESS = 3
+    LANE_COUNT = 4
+
+    # The maximum number of INF_INV messages waiting for their replies:
+    MAX_PENDING_INVS = 8
 
-    def __init__(self, node: Node, s: KMASocket, peer_addr: Tuple[str, int],
-                 partner):
-        super().__init__()
+    # How often (in seconds) the client checks if its peer falls behind:
+    WATCH_INTERVAL = 1
+
+    def __init__(self, node: Node, s: AsyncKMASocket,
+                 peer_addr: Tuple[str, int], partner):
         self.node = node
         self.s = s
 
         self.peer_addr = peer_addr
         self.partner = partner
         self.partner.partner = self
+        self.pending_invs = deque()
+        self.reply_task = None
 
-        self.cmd_queue = Queue()
+        self.cmd_queue = SendQueue(self.node.loop, self.node.peer_queue_size,
+                                   Client.LANE_COUNT, Client.get_lane)
         with self.node.client_cmd_queues_cv:
             self.node.client_cmd_queues.add(self.cmd_queue)
 
-    def run(self):
-        cmd: int
+    def start(self) -> None:
+        """
+        Start running on the node's event loop.
+
+        Notes: this method is thread-safe.
+        """
+        asyncio.run_coroutine_threadsafe(self.run(), self.node.loop)
+
+    async def run(self):
+        cmd: Optional[int]
         q: Queue
 
+        watcher = asyncio.ensure_future(self.watch())
         try:
             while True:
+                # no command is being processed until one is taken
+                cmd, args = None, []
+
+                # receive the replies to INF_INV messages when the window is
+                # full, or there is nothing else to do, unless a block comes
+                while self.pending_invs:
+                    if self.cmd_queue and (
+                            len(self.pending_invs) < Client.MAX_PENDING_INVS or
+                            Client.get_lane(self.cmd_queue.peek_nowait()) ==
+                            Client.LANE_BLOCK):
+                        break
+                    await self.wait_inv_reply()
+
+                # leave the commands queued while the peer is slow to
+                # receive, so that the watcher notices the lag
+                await self.s.drain()
+
                 # Look for command
-                cmd, *args = self.cmd_queue.get()
+                cmd, *args = await self.cmd_queue.get()
+
+                # only INF_INV messages are pipelined, other commands wait
+                # for the pending replies, except blocks
+                if cmd == Client.CMD_INFORM_TRANSACTION and \
+                        self.s.version >= Protocol.VERSION_BATCHED_INV:
+                    self.send_inv([args])
+                    continue
+                if cmd == Client.CMD_INFORM_BLOCK:
+                    await self.inform_block(*args)
+                    continue
+                while self.pending_invs:
+                    await self.process_inv_reply()
 
                 if cmd == Client.CMD_EXIT:
                     assert False
                 elif cmd == Client.CMD_SEND:
                     data = args[0]
-                    self.s.sendall(data)
+                    self.s.send_message(data[:Protocol.TYPE_CODE_FSZ],
+                                        data[Protocol.TYPE_CODE_FSZ:])
                 elif cmd == Client.CMD_INFORM:
                     data1, data2 = args
-                    self.s.inform(data1, data2)
+                    await self.s.inform(data1, data2)
+                elif cmd == Client.CMD_INFORM_TRANSACTION:
+                    tx_id, data = args
+                    await self.s.inform(Protocol.INF_TRANSACTION + tx_id,
+                                        data)
                 elif cmd == Client.CMD_REQ_BLOCK:
                     block_id, q = args
-                    self.s.sendall(Protocol.REQ_BLOCK + block_id)
-                    q.put(self.s.recv_block())
+                    self.s.send_message(Protocol.REQ_BLOCK, block_id)
+                    await self.s.recv_payload(Protocol.REQ_BLOCK)
+                    q.put(await self.s.recv_block())
+                elif cmd == Client.CMD_REQ_BLOCK_RANGE:
+                    locator, stop_id, q = args
+                    self.s.send_message(
+                        Protocol.REQ_BLOCK_RANGE,
+                        AsyncKMASocket.locator_to_bytes(locator, stop_id)
+                    )
+                    await self.s.recv_payload(Protocol.REQ_BLOCK_RANGE)
+                    q.put([await self.s.recv_block() for _ in range(
+                        await self.s.recv_int(Protocol.BLOCK_LIST_LEN_FSZ))])
                 else:
                     raise Exception("Unknown client command!")
 
         except (OSError, AssertionError):
             # release resources
+            watcher.cancel()
+            if self.reply_task is not None:
+                self.reply_task.cancel()
             self.s.close()
             self.node.peers_smp.release()
 
@@ -81,19 +170,122 @@ class Client(Thread):
 
             # wake up the thread waiting for the result of last command (if
             # any)
-            if cmd == Client.CMD_REQ_BLOCK:
-                q.put(None)
+            if cmd in (Client.CMD_REQ_BLOCK, Client.CMD_REQ_BLOCK_RANGE):
+                args[-1].put(None)
 
             # clean up the client's command queue
-            try:
-                while True:
-                    cmd, *args = self.cmd_queue.get(block=False)
-                    if cmd == Client.CMD_REQ_BLOCK:
-                        q = args[-1]
-                        q.put(None)
-            except Empty:
-                pass
+            while self.cmd_queue:
+                cmd, *args = self.cmd_queue.get_nowait()
+                if cmd in (Client.CMD_REQ_BLOCK, Client.CMD_REQ_BLOCK_RANGE):
+                    q = args[-1]
+                    q.put(None)
 
             if self.node.verbose:
                 print("\nDisconnected peer at: {}.".format(
                     self.peer_addr if self.peer_addr else "Unknown"))
+
+    @staticmethod
+    def get_lane(cmd: list) -> int:
+        """Return the command queue lane of a command."""
+        if cmd[0] in (Client.CMD_EXIT, Client.CMD_INFORM_BLOCK):
+            return Client.LANE_BLOCK
+        if cmd[0] in (Client.CMD_REQ_BLOCK, Client.CMD_REQ_BLOCK_RANGE):
+            return Client.LANE_BLOCK_REQUEST
+        if cmd[0] == Client.CMD_SEND:
+            return Client.LANE_ADDRESS
+        return Client.LANE_TRANSACTION
+
+    async def watch(self) -> None:
+        """Disconnect the peer once the oldest queued command has waited
+        more than the node's maximum peer lag."""
+        while True:
+            await asyncio.sleep(Client.WATCH_INTERVAL)
+            if self.cmd_queue.get_lag() > self.node.max_peer_lag:
+                break
+
+        if self.node.verbose:
+            print("\n[WARNING] Peer at {} falls behind, disconnecting...".
+                  format(self.peer_addr))
+            print("Send queue: {}".format(self.cmd_queue.get_stats()))
+
+        # the client notices it at its next send/recv
+        self.s.close()
+
+    def send_inv(self, txs: List[List[bytes]]) -> None:
+        """
+        Announce some transactions, and the ones of the CMD_INFORM_TRANSACTION
+        commands at the head of the command queue, with one INF_INV message.
+
+        Args:
+            txs: [transaction ID, serialized transaction] of the
+                transactions.
+
+        """
+        while len(txs) < Protocol.MAX_INV and self.cmd_queue and \
+                self.cmd_queue.peek_nowait()[0] == \
+                Client.CMD_INFORM_TRANSACTION:
+            txs.append(self.cmd_queue.get_nowait()[1:])
+
+        self.s.send_inv([tx_id for tx_id, _ in txs])
+        self.pending_invs.append([data for _, data in txs])
+
+    async def inform_block(self, block: Block, data: bytes) -> None:
+        """
+        Inform the remote server of a block, before the pending INF_INV
+        messages are done with.
+
+        Notes: the server handles messages in order, so the replies to the
+        pending INF_INV messages are received before the block's one, and
+        the wanted transactions are sent once the block has been sent.
+
+        Args:
+            block: the block.
+            data: the serialized block.
+
+        """
+        wanted = []
+
+        async def recv_inv_replies():
+            while self.pending_invs:
+                wanted.extend(await self.recv_inv_reply())
+
+        await self.s.inform_block(block, data, recv_inv_replies)
+        for tx_data in wanted:
+            self.s.send_message(Protocol.TRANSACTION, tx_data)
+
+    async def wait_inv_reply(self) -> None:
+        """Receive the reply to the oldest pending INF_INV message, then send
+        the wanted transactions, unless a command is put first. The reply is
+        then still being received by `reply_task`."""
+        if self.reply_task is None:
+            self.reply_task = asyncio.ensure_future(self.s.recv_inv_reply())
+
+        waiter = asyncio.ensure_future(self.cmd_queue.wait_put())
+        await asyncio.wait([self.reply_task, waiter],
+                           return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+
+        if self.reply_task.done():
+            await self.process_inv_reply()
+
+    async def recv_inv_reply(self) -> List[bytes]:
+        """Receive the reply to the oldest pending INF_INV message, returning
+        the wanted transactions."""
+        if self.reply_task is None:
+            indexes = await self.s.recv_inv_reply()
+        else:
+            task, self.reply_task = self.reply_task, None
+            indexes = await task
+
+        txs = self.pending_invs.popleft()
+        wanted = []
+        for index in indexes:
+            assert index < len(txs)
+            wanted.append(txs[index])
+        return wanted
+
+    async def process_inv_reply(self) -> None:
+        """Receive the reply to the oldest pending INF_INV message, then send
+        the wanted transactions."""
+        for tx_data in await self.recv_inv_reply():
+            self.s.send_message(Protocol.TRANSACTION, tx_data)
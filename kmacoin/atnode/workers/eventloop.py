@@ -0,0 +1,17 @@
+from kmacoin.atnode.node import Node
+
+from threading import Thread
+
+import asyncio
+
+
+class EventLoop(Thread):
+    """This class represents the thread running a node's event loop, where
+    all the node's peer connections are served."""
+    def __init__(self, node: Node):
+        super().__init__()
+        self.node = node
+
+    def run(self):
+        asyncio.set_event_loop(self.node.loop)
+        self.node.loop.run_forever()
@@ -1,17 +1,30 @@
-from kmacoin.network.kmasocket import KMASocket
+from kmacoin.network.aiokmasocket import AsyncKMASocket
 from kmacoin.atnode.node import Node
 from kmacoin.atnode.workers.server import Server
 
-from threading import Thread
+from typing import Tuple
 
+import asyncio
 
-class Listener(Thread):
-    """This class represents a listener in KMA-Coin system."""
+
+class Listener(object):
+    """
+    This class represents a listener in KMA-Coin system.
+
+    Notes: a listener runs on its node's event loop.
+    """
     def __init__(self, node: Node):
-        super().__init__()
         self.node = node
 
-    def run(self):
+    def start(self) -> None:
+        """
+        Start listening on the node's event loop.
+
+        Notes: this method is thread-safe.
+        """
+        asyncio.run_coroutine_threadsafe(self.run(), self.node.loop)
+
+    async def run(self):
         # no listening address given -> return
         if not self.node.public_addr:
             if self.node.verbose:
@@ -19,12 +32,13 @@ class Listener(Thread):
                 print("No listening address given.")
             return
 
-        # create the server socket
-        ss = KMASocket(virt_loc=self.node.virt_loc, name=self.node.name)
-
-        # try to bind to the listening address
+        # try to bind to the listening address, then start accepting incoming
+        # connections
         try:
-            ss.bind(self.node.listening_addr)
+            await AsyncKMASocket.start_server(
+                self.node.virt_loc, self.node.listening_addr, self.accept,
+                name=self.node.name
+            )
             if self.node.verbose:
                 print("\nListener is at {}".format(self.node.listening_addr))
 
@@ -33,18 +47,20 @@ class Listener(Thread):
                 print("\n[WARNING] Listener is not running!")
                 print("Cannot bind to {}.".format(self.node.listening_addr))
 
-            ss.close()
+    async def accept(self, client_s: AsyncKMASocket,
+                     client_addr: Tuple[str, int]) -> None:
+        """Serve an accepted connection."""
+
+        # refuse the connection if there are too many peers already, rather
+        # than blocking the event loop
+        if not self.node.peers_smp.acquire(blocking=False):
+            client_s.close()
             return
 
-        # start listening and accepting incoming connections
-        ss.listen()
-        while True:
-            self.node.peers_smp.acquire()
-            client_s, client_addr = ss.accept()
-            client_s.settimeout(self.node.peer_timeout)
-            Server(
-                self.node,
-                KMASocket.from_vlpsocket(client_s),
-                allow_swap_roles=True,
-                allow_req_token=True
-            ).start()
+        client_s.settimeout(self.node.peer_timeout)
+        await Server(
+            self.node,
+            client_s,
+            allow_swap_roles=True,
+            allow_req_token=True
+        ).run()
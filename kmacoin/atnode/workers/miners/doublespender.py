@@ -15,8 +15,9 @@ from kmacoin.objects.xstate import ExtendedState
 from kmacoin.atnode.node import Node
 
 from threading import Thread
-from queue import Empty
+from typing import List, Tuple
 
+import copy
 import os
 import time
 
@@ -37,6 +38,9 @@ class DoubleSpender(Thread):
             hash_rate = self.node.hash_rate
         self.virt_attempt_time_cost = 1.0 / hash_rate
         self.sleep_time = self.virt_attempt_time_cost
+        self.attempt_start = None  # when the pending attempt has started
+        # the last change seen (a standalone miner, without node, sees none)
+        self.change_count = 0 if node is None else node.change_count
 
         # training the miner
         for _ in range(3):
@@ -64,33 +68,76 @@ class DoubleSpender(Thread):
         """Similar to `attempt`, but this method is expected to finish in
         a pre-defined amount of time.
 
+        If the top block or the mempool changes in the meantime, this method
+        returns False early, and the next call resumes the pending attempt
+        (most likely on an updated block).
+
         Notes: each call to this method will automatically adjust this miner's
         sleep time for better accuracy at later attempts.
         """
-        t1 = time.time()
+        if self.attempt_start is None:
+            self.attempt_start = time.time()
+        t1 = self.attempt_start
 
         # sleep then make a real attempt
-        time.sleep(self.sleep_time)
+        timeout = t1 + self.sleep_time - time.time()
+        if timeout > 0:
+            if self.node is None:
+                time.sleep(timeout)
+            elif self.node.wait_for_change(self.change_count, timeout):
+                return False
         result = self.attempt(block, threshold)
 
         t2 = time.time()
 
         # adjust the sleep time
         self.sleep_time += self.virt_attempt_time_cost - (t2-t1)
+        self.attempt_start = None
 
         return result
 
+    @staticmethod
+    def select_transactions(state: ExtendedState, txs: List[Transaction]) \
+            -> Tuple[List[Transaction], int]:
+        """
+        Select the transactions which are valid in turn on a state, e.g. the
+        one of a private branch that the mempool is not built on.
+
+        Args:
+            state: the state (left unchanged).
+            txs: the candidate transactions, parents before children.
+
+        Returns:
+            (the valid transactions, their total fee).
+
+        """
+        state = copy.copy(state)
+        state.coins = dict(state.coins)
+        selected = []
+        total_fee = 0
+        for tx in txs:
+            try:
+                total_fee += state.process_transaction(tx)
+                selected.append(tx)
+            except TransactionError:
+                continue  # e.g. spending coins of the public branch
+
+        return selected, total_fee
+
     def run(self):
         height: int = -1
         tmp_block: Block = Block(HASH_OF_NULL)
         latest_state: ExtendedState  # the oldest (highest age) state
         found = False  # indicates if a block was found by this miner last turn
         reward: int  # the reward for each valid block found
+        template_version = None  # the template the block was filled with
 
         attack: bool = False
         private_blocks = []
 
         while True:
+            # changes from now on interrupt the attempt below
+            self.change_count = self.node.change_count
 
             # check if attack has done
             if attack:
@@ -108,9 +155,8 @@ class DoubleSpender(Thread):
 
                 if not found:  # block found by other miners
 
-                    # pull back transactions in temporary block
-                    for tx in tmp_block.txs[1:]:  # exclude `reward_tx`
-                        self.node.tx_queue.put(tx)
+                    # drop transactions in temporary block (they are still
+                    # kept in the mempool)
                     tmp_block.clear_transactions()
 
                     # get the latest state
@@ -129,37 +175,37 @@ class DoubleSpender(Thread):
                         value=reward
                     )])
                 tmp_block.add_transaction(reward_tx)
+                template_version = None
 
                 if height == DoubleSpender.START_HEIGHT:
                     attack = True
 
-            # check for new transactions
-            reward_change = False
-            while True:
-                if len(tmp_block.txs) == Block.MAX_TXS:
-                    break
-                try:
-                    tx = self.node.tx_queue.get(block=False)
-                    fee = latest_state.process_transaction(tx)
-                    tmp_block.add_transaction(tx)
-                    self.node.valid_obj_queue.put(tx)
-                    if fee:
-                        reward += fee
-                        reward_change = True
-
-                except Empty:  # the transaction queue is empty
-                    break
-                except TransactionError:  # current transaction is invalid
-                    continue  # just move on
-
-            # collect the transaction fee
-            if reward_change:
-                reward_tx = Transaction(input_ids=[], outputs=[
-                    Coin(
-                        owner=self.node.owner,
-                        value=reward
-                    )])
-                tmp_block.replace_transaction(0, reward_tx)
+            # refill the temporary block if the block template has changed
+            template = self.node.mempool.get_template()
+            if template.version != template_version:
+                template_version = template.version
+
+                # the mempool may lag behind the temporary block, and is
+                # never built on the private branch, whose own state decides
+                if attack:
+                    txs, fee = DoubleSpender.select_transactions(
+                        latest_state, template.txs)
+                elif template.prev_id == tmp_block.prev_id:
+                    txs, fee = template.txs, template.fee
+                else:
+                    txs = None
+
+                if txs is not None:
+                    reward = latest_state.reward + fee
+                    reward_tx = Transaction(input_ids=[], outputs=[
+                        Coin(
+                            owner=self.node.owner,
+                            value=reward
+                        )])
+                    tmp_block.clear_transactions()
+                    tmp_block.add_transaction(reward_tx)
+                    for tx in txs:
+                        tmp_block.add_transaction(tx)
 
             # prepare to mine
             tmp_block.update_timestamp()
@@ -183,6 +229,11 @@ class DoubleSpender(Thread):
 
                 # prepare to mine a new block
                 height += 1
+                for tx in tmp_block.txs[1:]:
+                    try:
+                        latest_state.process_transaction(tx)
+                    except TransactionError:
+                        continue  # the mempool was on another state
                 latest_state.process_transaction(tmp_block.txs[0],
                                                  check_balance=False)
                 latest_state.latest_id = tmp_block.get_id()
@@ -2,12 +2,10 @@ from kmacoin.globaldef.hash import HASH_OF_NULL
 from kmacoin.objects.block import Block
 from kmacoin.objects.transaction import Transaction
 from kmacoin.objects.coin import Coin
-from kmacoin.objects.state import TransactionError
 from kmacoin.objects.xstate import ExtendedState
 from kmacoin.atnode.node import Node
 
 from threading import Thread
-from queue import Empty
 
 import os
 import time
@@ -22,6 +20,9 @@ class LazyMiner(Thread):
             hash_rate = self.node.hash_rate
         self.virt_attempt_time_cost = 1.0 / hash_rate
         self.sleep_time = self.virt_attempt_time_cost
+        self.attempt_start = None  # when the pending attempt has started
+        # the last change seen (a standalone miner, without node, sees none)
+        self.change_count = 0 if node is None else node.change_count
 
         # training the miner
         for _ in range(3):
@@ -49,19 +50,31 @@ class LazyMiner(Thread):
         """Similar to `attempt`, but this method is expected to finish in
         a pre-defined amount of time.
 
+        If the top block or the mempool changes in the meantime, this method
+        returns False early, and the next call resumes the pending attempt
+        (most likely on an updated block).
+
         Notes: each call to this method will automatically adjust this miner's
         sleep time for better accuracy at later attempts.
         """
-        t1 = time.time()
+        if self.attempt_start is None:
+            self.attempt_start = time.time()
+        t1 = self.attempt_start
 
         # sleep then make a real attempt
-        time.sleep(self.sleep_time)
+        timeout = t1 + self.sleep_time - time.time()
+        if timeout > 0:
+            if self.node is None:
+                time.sleep(timeout)
+            elif self.node.wait_for_change(self.change_count, timeout):
+                return False
         result = self.attempt(block, threshold)
 
         t2 = time.time()
 
         # adjust the sleep time
         self.sleep_time += self.virt_attempt_time_cost - (t2-t1)
+        self.attempt_start = None
 
         return result
 
@@ -71,16 +84,18 @@ class LazyMiner(Thread):
         latest_state: ExtendedState  # the oldest (highest age) state
         found = False  # indicates if a block was found by this miner last turn
         reward: int  # the reward for each valid block found
+        template_version = None  # the template the block was filled with
 
         while True:
+            # changes from now on interrupt the attempt below
+            self.change_count = self.node.change_count
             # check if the block tree has grown
             if height < self.node.block_tree.get_height() or found:
 
                 if not found:  # block found by other miners
 
-                    # pull back transactions in temporary block
-                    for tx in tmp_block.txs[1:]:  # exclude `reward_tx`
-                        self.node.tx_queue.put(tx)
+                    # drop transactions in temporary block (they are still
+                    # kept in the mempool)
                     tmp_block.clear_transactions()
 
                     # get the latest state
@@ -99,34 +114,25 @@ class LazyMiner(Thread):
                         value=reward
                     )])
                 tmp_block.add_transaction(reward_tx)
-
-            # check for new transactions
-            reward_change = False
-            while True:
-                if len(tmp_block.txs) == Block.MAX_TXS:
-                    break
-                try:
-                    tx = self.node.tx_queue.get(block=False)
-                    fee = latest_state.process_transaction(tx)
-                    tmp_block.add_transaction(tx)
-                    self.node.valid_obj_queue.put(tx)
-                    if fee:
-                        reward += fee
-                        reward_change = True
-
-                except Empty:  # the transaction queue is empty
-                    break
-                except TransactionError:  # current transaction is invalid
-                    continue  # just move on
-
-            # collect the transaction fee
-            if reward_change:
-                reward_tx = Transaction(input_ids=[], outputs=[
-                    Coin(
-                        owner=self.node.owner,
-                        value=reward
-                    )])
-                tmp_block.replace_transaction(0, reward_tx)
+                template_version = None
+
+            # refill the temporary block if the block template has changed
+            template = self.node.mempool.get_template()
+            if template.version != template_version:
+                template_version = template.version
+
+                # the mempool may lag behind the temporary block
+                if template.prev_id == tmp_block.prev_id:
+                    reward = latest_state.reward + template.fee
+                    reward_tx = Transaction(input_ids=[], outputs=[
+                        Coin(
+                            owner=self.node.owner,
+                            value=reward
+                        )])
+                    tmp_block.clear_transactions()
+                    tmp_block.add_transaction(reward_tx)
+                    for tx in template.txs:
+                        tmp_block.add_transaction(tx)
 
             # prepare to mine
             tmp_block.update_timestamp()
@@ -10,12 +10,10 @@ from kmacoin.globaldef.hash import HASH_OF_NULL
 from kmacoin.objects.block import Block
 from kmacoin.objects.transaction import Transaction
 from kmacoin.objects.coin import Coin
-from kmacoin.objects.state import TransactionError
 from kmacoin.objects.xstate import ExtendedState
 from kmacoin.atnode.node import Node
 
 from threading import Thread
-from queue import Empty
 
 import os
 import time
@@ -92,23 +90,6 @@ class SystemFreezer(Thread):
                     )])
                 tmp_block.add_transaction(reward_tx)
 
-            # check for new transactions
-            while True:
-                if len(tmp_block.txs) == Block.MAX_TXS:
-                    break
-                try:
-                    tx = self.node.tx_queue.get(block=False)
-
-                    # if the transaction is valid, broadcast it but don't add
-                    # it to the block being mined.
-                    latest_state.process_transaction(tx)
-                    self.node.valid_obj_queue.put(tx)
-
-                except Empty:  # the transaction queue is empty
-                    break
-                except TransactionError:  # current transaction is invalid
-                    continue  # just move on
-
             # prepare to mine
             tmp_block.update_timestamp()
 
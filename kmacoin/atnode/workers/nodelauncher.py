@@ -1,16 +1,22 @@
 from kmacoin.globaldef.hash import HASH_SIZE
+from kmacoin.objects.block import Block
 from kmacoin.network.kmasocket import KMASocket
 from kmacoin.network.protocol import Protocol
 from kmacoin.objects.xstate import BlockError
 from kmacoin.atnode.workers.addressprocessor import AddressProcessor
+from kmacoin.atnode.workers.blockdownloader import BlockDownloader
 from kmacoin.atnode.workers.blockprocessor import BlockProcessor
 from kmacoin.atnode.workers.broadcaster import Broadcaster
+from kmacoin.atnode.workers.eventloop import EventLoop
 from kmacoin.atnode.workers.listener import Listener
 from kmacoin.atnode.workers.peeradder import PeerAdder
 from kmacoin.atnode.workers.branchbuilder import BranchBuilder
+from kmacoin.atnode.workers.transactionprocessor import TransactionProcessor
 from kmacoin.atnode.node import Node
+from kmacoin.atnode.structures.blockwindows import BlockWindows
 
 from threading import Thread
+from typing import List, Optional, Tuple
 
 import os
 import random
@@ -25,36 +31,41 @@ class NodeLauncher(Thread):
 
     """
 
+    # Blocks are downloaded in windows of this many blocks when syncing:
+    SYNC_WINDOW_SIZE = 64
+
+    # Windows are downloaded at most this many windows ahead of the next one
+    # to be added:
+    SYNC_MAX_AHEAD = 16
+
     def __init__(self, node: Node):
         super().__init__()
         self.node = node
 
     def run(self):
         # resume current state (if the node had joined the network earlier)
-        path = os.path.join(self.node.data_dir, Node.BLOCK_ID_FILENAME)
-        if os.path.isfile(path):
+        if self.node.block_index_file.exists():
 
             if self.node.verbose:
-                print("\nFetching local block data...")
+                print("\nLoading local block index...")
 
-            i = 0
-            with open(path, "rb") as f:
-                try:
-                    while True:
-                        block_id = f.read(HASH_SIZE)
-                        if not block_id:
-                            break
-                        block = self.node.load_block(block_id)
-                        self.node.add_block(block, save_block=False)
-                        i += 1
-                except (FileNotFoundError, AssertionError):
-                    if self.node.verbose:
-                        print("[ERROR] The data directory is corrupted!")
-                    return
+            try:
+                i = self.node.load_block_index()
+                self.node.mempool.rebase(self.node.get_latest_state())
+            except (FileNotFoundError, KeyError, AssertionError):
+                if self.node.verbose:
+                    print("[ERROR] The data directory is corrupted!")
+                return
 
             if self.node.verbose:
                 print("{} blocks have been added!".format(i))
 
+        elif os.path.isfile(
+                os.path.join(self.node.data_dir, Node.BLOCK_ID_FILENAME)):
+            # migrate from the block ID file, by adding every block again
+            if not self.migrate_block_ids():
+                return
+
         # synchronize with other nodes
         if not self.node.unconnected_addrs:
             if self.node.verbose:
@@ -63,6 +74,7 @@ class NodeLauncher(Thread):
 
         else:
             i = 0
+            j = None  # the number of added addresses, once requested
             while True:
                 i += 1
 
@@ -76,23 +88,33 @@ class NodeLauncher(Thread):
                     print("\nTry to synchronize with {}".format(addr))
 
                 try:
-                    # connect and send a REQ_BLOCKS message
+                    # connect and get the IDs of the blocks to be added
                     s.connect(addr)
-                    s.sendall(Protocol.REQ_BLOCKS)
-                    s.send_int(self.node.block_tree.get_height(),
-                               Protocol.BLOCK_HEIGHT_FSZ)
+                    block_ids = self.get_block_ids(s)
+
+                    if block_ids is None:
+                        # a legacy node closes the connection -> connect
+                        # again and receive the blocks with REQ_BLOCKS
+                        s.close()
+                        s = KMASocket(virt_loc=self.node.virt_loc,
+                                      name=self.node.name)
+                        s.settimeout(self.node.connection_timeout)
+                        s.connect(addr)
+                        n = self.receive_blocks(s)
+                    elif block_ids:
+                        # learn more nodes to download from first
+                        if j is None:
+                            j = self.get_addresses(s)
+                        n = self.download_blocks(block_ids, addr)
+                        assert n > 0  # no progress
+                    else:
+                        n = 0
 
-                    n = s.recv_int(Protocol.BLOCK_LIST_LEN_FSZ)
                     if n == 0:
                         # Block chain synchronization completes!
                         # Now, add more KMA-Coin server addresses.
-                        s.sendall(Protocol.REQ_ADDR_LIST)
-                        n = s.recv_int(Protocol.ADDR_LIST_LEN_FSZ)
-                        j = 0
-                        for _ in range(n):
-                            if self.node.add_unconnected_address(
-                                    s.recv_address()):
-                                j += 1
+                        if j is None:
+                            j = self.get_addresses(s)
 
                         if self.node.verbose:
                             print("{} addresses added!".format(j))
@@ -100,19 +122,13 @@ class NodeLauncher(Thread):
 
                         break
 
-                    # receive the blocks
-                    if self.node.verbose:
-                        print("Adding {} blocks...".format(n))
-
-                    for _ in range(n):
-                        self.node.add_block(s.recv_block())
-
                 except (OSError, AssertionError, BlockError):
                     # Something wrong happened!
                     if self.node.verbose:
                         print("[WARNING] Error synchronizing with {}".
                               format(addr))
                     self.node.unconnected_addrs.remove(addr)
+                    self.node.add_failed_address(addr)
                     if self.node.unconnected_addrs:
                         continue
 
@@ -134,9 +150,11 @@ class NodeLauncher(Thread):
                 latest_state.threshold.hex()[:self.node.hexlen]))
 
         # spawn workers
+        EventLoop(self.node).start()
         AddressProcessor(self.node).start()
         BlockProcessor(self.node).start()
         BranchBuilder(self.node).start()
+        TransactionProcessor(self.node).start()
         Broadcaster(self.node).start()
         PeerAdder(self.node).start()
         Listener(self.node).start()
@@ -146,3 +164,178 @@ class NodeLauncher(Thread):
             self.node.miner_module)
         exec(cmd)
         LazyMiner(self.node).start()
+
+    def get_block_ids(self, s: KMASocket) -> Optional[List[bytes]]:
+        """
+        Get the IDs of a node's main chain blocks which are missing from the
+        local block tree, even if the local main chain is on another fork.
+
+        Args:
+            s: a socket connected to the node.
+
+        Returns:
+            The block IDs, or None if the node closed the connection without
+            replying, as a legacy node does.
+
+        """
+        block_ids = []
+        locator = self.node.block_tree.get_locator()
+        while True:
+            s.sendall(Protocol.REQ_BLOCK_IDS)
+            s.send_locator(locator, None)
+            try:
+                n = s.recv_int(Protocol.BLOCK_ID_LIST_LEN_FSZ)
+            except (OSError, AssertionError):
+                if not block_ids:
+                    return None
+                raise
+
+            for _ in range(n):
+                block_ids.append(s.recv_exact(Block.ID_FSZ))
+            if n < Protocol.MAX_BLOCK_IDS:
+                break
+
+            # go on from the last received block
+            locator = block_ids[-1:]
+
+        # skip the blocks already in a side branch
+        i = 0
+        while i < len(block_ids) and \
+                self.node.block_tree.has_block(block_ids[i]):
+            i += 1
+        return block_ids[i:]
+
+    def get_addresses(self, s: KMASocket) -> int:
+        """
+        Add the addresses known by a node to the unconnected addresses.
+
+        Args:
+            s: a socket connected to the node.
+
+        Returns:
+            The number of added addresses.
+
+        """
+        s.sendall(Protocol.REQ_ADDR_LIST)
+        n = s.recv_int(Protocol.ADDR_LIST_LEN_FSZ)
+        j = 0
+        for _ in range(n):
+            if self.node.add_unconnected_address(s.recv_address()):
+                j += 1
+
+        return j
+
+    def download_blocks(self, block_ids: List[bytes],
+                        addr: Tuple[str, int]) -> int:
+        """
+        Download blocks from several nodes at once, and add them in chain
+        order while the next ones are being downloaded.
+
+        Args:
+            block_ids: IDs of the blocks, in chain order.
+            addr: the address of the node which gave the IDs.
+
+        Returns:
+            The number of added blocks.
+
+        Raises:
+            BlockError: if a block is invalid.
+
+        """
+        windows = BlockWindows(block_ids, NodeLauncher.SYNC_WINDOW_SIZE,
+                               NodeLauncher.SYNC_MAX_AHEAD)
+
+        # download from the node which gave the IDs and some others
+        others = [a for a in self.node.unconnected_addrs if a != addr]
+        addrs = [addr] + random.sample(
+            others, min(len(others), self.node.sync_peers - 1))
+        downloaders = [BlockDownloader(self.node, a, windows) for a in addrs]
+        for downloader in downloaders:
+            downloader.start()
+
+        if self.node.verbose:
+            print("Downloading {} blocks from {} nodes...".format(
+                len(block_ids), len(addrs)))
+
+        # add the downloaded blocks
+        n = 0
+        try:
+            while True:
+                blocks = windows.pop_next()
+                if blocks is None:
+                    break
+                self.node.add_blocks(blocks)
+                n += len(blocks)
+
+        finally:
+            windows.abort()
+            for downloader in downloaders:
+                downloader.join()
+
+        if self.node.verbose:
+            print("{} blocks have been added!".format(n))
+
+        return n
+
+    def receive_blocks(self, s: KMASocket) -> int:
+        """
+        Receive blocks from a legacy node with a REQ_BLOCKS message, then
+        add them.
+
+        Args:
+            s: a socket connected to the node.
+
+        Returns:
+            The number of received blocks.
+
+        Raises:
+            BlockError: if a block is invalid.
+
+        """
+        s.sendall(Protocol.REQ_BLOCKS)
+        s.send_int(self.node.block_tree.get_height(),
+                   Protocol.BLOCK_HEIGHT_FSZ)
+
+        n = s.recv_int(Protocol.BLOCK_LIST_LEN_FSZ)
+        if n:
+            if self.node.verbose:
+                print("Adding {} blocks...".format(n))
+
+            self.node.add_blocks([s.recv_block() for _ in range(n)])
+
+        return n
+
+    def migrate_block_ids(self) -> bool:
+        """
+        Rebuild the block tree from the block ID file, by parsing and adding
+        every block again, then save the block index file.
+
+        Returns:
+            True if the migration succeeds.
+
+        """
+        if self.node.verbose:
+            print("\nFetching local block data...")
+
+        i = 0
+        path = os.path.join(self.node.data_dir, Node.BLOCK_ID_FILENAME)
+        with open(path, "rb") as f:
+            try:
+                while True:
+                    block_id = f.read(HASH_SIZE)
+                    if not block_id:
+                        break
+                    block = self.node.load_block(block_id)
+                    self.node.add_block(block, save_block=False)
+                    i += 1
+            except (FileNotFoundError, AssertionError):
+                if self.node.verbose:
+                    print("[ERROR] The data directory is corrupted!")
+                return False
+
+        self.node.save_block_index()
+
+        if self.node.verbose:
+            print("{} blocks have been added!".format(i))
+
+        return True
@@ -1,66 +1,199 @@
-from kmacoin.network.kmasocket import KMASocket
+from kmacoin.network.aiokmasocket import AsyncKMASocket
 from kmacoin.network.protocol import Protocol
+from kmacoin.network.peersession import PeerSession
 from kmacoin.atnode.node import Node
 from kmacoin.atnode.workers.server import Server
 from kmacoin.atnode.workers.client import Client
 
 from threading import Thread
+from typing import Tuple, Optional
+
+import asyncio
 
 
 class PeerAdder(Thread):
-    """This class represents a peer adder in KMA-Coin system."""
+    """
+    This class represents a peer adder in KMA-Coin system.
+
+    Notes: the peer adder waits for peers to be needed in its own thread, but
+    connects to them on its node's event loop, trying several addresses at
+    once so that a dead address doesn't hold up the others. A peer link is a
+    peer session over one connection if the node understands it, otherwise
+    two connections, one of which swaps roles.
+    """
     def __init__(self, node: Node):
         super().__init__()
         self.node = node
 
+        # the number of connections becoming peer links, only used on the
+        # event loop
+        self.joining = 0
+
     def run(self):
         while True:
 
-            # wait until the number of peers is less than required
+            # wait until the number of peers is less than required, and
+            # another connection attempt is allowed. More addresses than
+            # missing peers are tried at once, the first ones to answer win.
             with self.node.client_cmd_queues_cv:
-                while len(self.node.client_cmd_queues) >= self.node.min_peers:
+                while len(self.node.client_cmd_queues) >= \
+                        self.node.min_peers or \
+                        self.node.dial_count >= self.node.max_dials:
                     self.node.client_cmd_queues_cv.wait()
 
             # get an unconnected address
             addr = self.node.pop_random_unconnected_address()
 
-            # acquire the semaphore 2 times to create 2 sockets.
+            # acquire the semaphore 2 times, for a server and a client
             self.node.peers_smp.acquire()
             self.node.peers_smp.acquire()
-            s1 = KMASocket(virt_loc=self.node.virt_loc, name=self.node.name)
-            s2 = KMASocket(virt_loc=self.node.virt_loc, name=self.node.name)
-            s1.settimeout(self.node.connection_timeout)
-            s2.settimeout(self.node.connection_timeout)
-
-            # try to connect
-            try:
-                s1.connect(addr)
-                s2.connect(addr)
-
-                # turn `s1` into server-side socket
-                s2.sendall(Protocol.REQ_TOKEN)
-                token = s2.recv_exact(Protocol.TOKEN_FSZ)
-                s1.sendall(Protocol.REQ_SWAP_ROLES + token)
-                s1.send_address(self.node.public_addr)
-                response = s1.recv_exact(Protocol.TYPE_CODE_FSZ)
-                assert response == Protocol.REP_PROCEED
 
-                # spawn a server and a client for this new peer link
-                s1.settimeout(self.node.peer_timeout)
-                s2.settimeout(self.node.peer_timeout)
-                server_thread = Server(self.node, s1, allow_swap_roles=False,
-                                       allow_req_token=False)
-                server_thread.start()
-                Client(self.node, s2, addr, server_thread).start()
+            # connect on the node's event loop, without waiting for it
+            with self.node.client_cmd_queues_cv:
+                self.node.dial_count += 1
+            asyncio.run_coroutine_threadsafe(self.dial(addr), self.node.loop)
 
-                # update the connected address list
-                assert self.node.add_connected_address(addr)
+    async def dial(self, addr: Tuple[str, int]) -> None:
+        """
+        Try to make a node a peer, as one of the concurrent connection
+        attempts.
 
-                if self.node.verbose:
-                    print("\nAdded peer at {}.".format(addr))
+        Notes: a failed address is remembered, so that it isn't tried again
+        for a while. An address which has not been validated yet is
+        broadcast once the connection succeeds. If enough peers are found by
+        other attempts first, the connection is given up and the address is
+        kept as an unconnected address.
 
-            except (OSError, AssertionError):
-                s1.close()
-                s2.close()
+        Args:
+            addr: the node's address.
+
+        """
+        try:
+            added = await self.add_peer(addr, only_if_needed=True)
+            if added is False:
+                self.node.pop_unvalidated_address(addr)
+                self.node.add_failed_address(addr)
+                self.node.peers_smp.release()
+                self.node.peers_smp.release()
+                return
+
+            # the address is valid, as it could be connected to
+            xaddr = self.node.pop_unvalidated_address(addr)
+            if xaddr is not None:
+                self.node.valid_obj_queue.put(xaddr)
+
+            if not added:
+                # keep the address for later
+                self.node.add_unconnected_address(addr)
                 self.node.peers_smp.release()
                 self.node.peers_smp.release()
+
+        finally:
+            with self.node.client_cmd_queues_cv:
+                self.node.dial_count -= 1
+                self.node.client_cmd_queues_cv.notify()
+
+    async def add_peer(self, addr: Tuple[str, int],
+                       only_if_needed: bool = False) -> Optional[bool]:
+        """
+        Try to connect to a node and make it a peer.
+
+        Args:
+            addr: the node's address.
+            only_if_needed: True to give up once connected if the node has
+                enough peers in the meantime.
+
+        Returns:
+            True if the node actually becomes a peer, None if it has been
+            given up, False if it can't be connected to.
+
+        """
+        s1 = AsyncKMASocket(virt_loc=self.node.virt_loc, name=self.node.name)
+        s2 = None
+        s1.settimeout(self.node.connection_timeout)
+        joined = False
+
+        # try to connect
+        try:
+            # negotiate the framed protocol, a legacy node closes the
+            # connection instead -> connect again without negotiating
+            await s1.connect(addr)
+            framed = await s1.negotiate(self.node.frame_checksum)
+            if not framed:
+                s1.close()
+                s1 = AsyncKMASocket(virt_loc=self.node.virt_loc,
+                                    name=self.node.name)
+                s1.settimeout(self.node.connection_timeout)
+                await s1.connect(addr)
+
+            # other connection attempts may have found the missing peers
+            if only_if_needed:
+                with self.node.client_cmd_queues_cv:
+                    if len(self.node.client_cmd_queues) + self.joining >= \
+                            self.node.min_peers:
+                        s1.close()
+                        return None
+            self.joining += 1
+            joined = True
+
+            if s1.version >= Protocol.VERSION_SESSIONS:
+                # turn the connection into a peer session
+                s1.send_message(
+                    Protocol.REQ_SESSION,
+                    AsyncKMASocket.address_to_bytes(self.node.public_addr)
+                )
+                response = await s1.recv_message_type()
+                assert response == Protocol.REP_PROCEED
+
+                session = PeerSession(s1, dialed=True)
+                session.start()
+                server_s = session.server_channel
+                client_s = session.client_channel
+
+            else:
+                # connect again, and turn `s1` into server-side socket
+                s2 = AsyncKMASocket(virt_loc=self.node.virt_loc,
+                                    name=self.node.name)
+                s2.settimeout(self.node.connection_timeout)
+                await s2.connect(addr)
+                if framed:
+                    assert await s2.negotiate(self.node.frame_checksum)
+
+                s2.send_message(Protocol.REQ_TOKEN)
+                await s2.recv_payload(Protocol.REQ_TOKEN)
+                token = await s2.recv_exact(Protocol.TOKEN_FSZ)
+                s1.send_message(
+                    Protocol.REQ_SWAP_ROLES,
+                    token +
+                    AsyncKMASocket.address_to_bytes(self.node.public_addr)
+                )
+                response = await s1.recv_message_type()
+                assert response == Protocol.REP_PROCEED
+
+                server_s, client_s = s1, s2
+
+            # spawn a server and a client for this new peer link
+            server_s.settimeout(self.node.peer_timeout)
+            client_s.settimeout(self.node.peer_timeout)
+            server = Server(self.node, server_s, allow_swap_roles=False,
+                            allow_req_token=False)
+            server.start()
+            Client(self.node, client_s, addr, server).start()
+
+            # update the connected address list
+            assert self.node.add_connected_address(addr)
+
+            if self.node.verbose:
+                print("\nAdded peer at {}.".format(addr))
+
+            return True
+
+        except (OSError, AssertionError):
+            s1.close()
+            if s2 is not None:
+                s2.close()
+            return False
+
+        finally:
+            if joined:
+                self.joining -= 1
@@ -1,13 +1,16 @@
 from kmacoin.objects.block import Block
 from kmacoin.objects.transaction import Transaction
-from kmacoin.network.kmasocket import KMASocket
+from kmacoin.objects.compactblock import CompactBlock
+from kmacoin.network.aiokmasocket import AsyncKMASocket
 from kmacoin.network.protocol import Protocol
+from kmacoin.network.peersession import PeerSession
 from kmacoin.atnode.node import Node
 from kmacoin.atnode.structures.pool import ObjectNotFound
 from kmacoin.atnode.workers.client import Client
 
-from threading import Thread
+from typing import List, Dict, Set, Optional, Sequence
 
+import asyncio
 import os
 
 
@@ -23,7 +26,7 @@ class XObject(object):
     Attributes:
         obj: an object which is wrapped.
         typecode: the type of a message which the object is sent with.
-        server_thread: a server thread which has received the message/object.
+        server_thread: a server which has received the message/object.
 
     """
     def __init__(self, obj: object, typecode: int = None,
@@ -36,70 +39,114 @@ class XObject(object):
         return getattr(self.obj, name)
 
 
-class Server(Thread):
+class Server(object):
     """
     This class represents a server in KMA-Coin system.
 
+    Notes: a server runs as a coroutine on its node's event loop.
+
     Attributes:
         node: a node which it works for.
         s: a socket which is used to communicate with a remote client.
         allow_swap_roles: indicates whether or not to accept a REQ_SWAP_ROLES
-            message.
+            or REQ_SESSION message.
         allow_req_token: indicates whether or not to accept a REQ_TOKEN
             message.
-        partner: a local client thread holding another connection to a same
-            node.
+        allow_req_version: indicates whether or not to accept a REQ_VERSION
+            message.
+        partner: a local client holding another connection to a same node.
+        wanted_tx_ids: IDs of the transactions asked for in replies to INF_INV
+            messages, and not received yet.
 
     """
-    def __init__(self, node: Node, s: KMASocket, allow_swap_roles: bool,
+    wanted_tx_ids: Set[bytes]
+
+    def __init__(self, node: Node, s: AsyncKMASocket, allow_swap_roles: bool,
                  allow_req_token: bool):
-        super().__init__()
         self.node = node
         self.s = s
         self.allow_swap_roles = allow_swap_roles
         self.allow_req_token = allow_req_token
+        self.allow_req_version = True
         self.partner = None
+        self.wanted_tx_ids = set()
+
+    def start(self) -> None:
+        """
+        Start serving on the node's event loop.
+
+        Notes: this method is thread-safe.
+        """
+        asyncio.run_coroutine_threadsafe(self.run(), self.node.loop)
 
-    def run(self):
+    async def run(self):
         try:
             while True:
                 # get the message type code
-                msg_type_code = self.s.recv_exact(Protocol.TYPE_CODE_FSZ)
+                msg_type_code = await self.s.recv_message_type()
 
                 # call appropriate handler
-                if msg_type_code == Protocol.PING:
-                    self.process_ping()
+                if msg_type_code == Protocol.REQ_VERSION:
+                    await self.process_req_version()
+                    continue
+                elif msg_type_code == Protocol.PING:
+                    await self.process_ping()
                 elif msg_type_code == Protocol.REQ_TOKEN:
-                    self.process_req_token()
+                    await self.process_req_token()
                 elif msg_type_code == Protocol.REQ_SWAP_ROLES:
-                    self.process_req_swap_roles()
+                    await self.process_req_swap_roles()
                     return
+                elif msg_type_code == Protocol.REQ_SESSION:
+                    await self.process_req_session()
                 elif msg_type_code == Protocol.INF_ADDR:
-                    self.process_inf_address()
+                    await self.process_inf_address()
                 elif msg_type_code == Protocol.INF_TRANSACTION:
-                    self.process_inf_transaction()
+                    await self.process_inf_transaction()
+                elif msg_type_code == Protocol.INF_INV:
+                    await self.process_inf_inv()
+                elif msg_type_code == Protocol.TRANSACTION:
+                    await self.process_transaction()
                 elif msg_type_code == Protocol.INF_BLOCK:
-                    self.process_inf_block()
+                    await self.process_inf_block()
+                elif msg_type_code == Protocol.INF_COMPACT_BLOCK:
+                    await self.process_inf_compact_block()
                 elif msg_type_code == Protocol.REQ_BLOCK:
-                    self.process_req_block()
+                    await self.process_req_block()
                 elif msg_type_code == Protocol.REQ_BLOCKS:
-                    self.process_req_blocks()
+                    await self.process_req_blocks()
+                elif msg_type_code == Protocol.REQ_BLOCK_IDS:
+                    await self.process_req_block_ids()
+                elif msg_type_code == Protocol.REQ_BLOCK_RANGE:
+                    await self.process_req_block_range()
                 elif msg_type_code == Protocol.REQ_ADDR_LIST:
-                    self.process_req_addr_list()
+                    await self.process_req_addr_list()
                 else:
                     assert False  # unknown message type code -> abort
 
-                self.allow_swap_roles = False  # allow at 1st message only
+                # allow at 1st message only
+                self.allow_swap_roles = False
+                self.allow_req_version = False
+
+                # stop serving while the client is slow to receive
+                await self.s.drain()
 
         except (OSError, AssertionError):
             self.s.close()
             self.node.peers_smp.release()
 
-    def process_ping(self):
+    async def process_ping(self):
         """Process a PING message."""
-        self.s.sendall(Protocol.PONG)
+        self.s.send_message(Protocol.PONG)
+
+    async def process_req_version(self):
+        """Process a REQ_VERSION message."""
+        if not self.allow_req_version:
+            assert False  # not allowed -> abort
 
-    def process_req_token(self):
+        await self.s.accept_negotiation()
+        self.allow_req_version = False
+
+    async def process_req_token(self):
         """Process a REQ_TOKEN message."""
         if not self.allow_req_token:
             assert False  # not allowed -> abort
@@ -110,24 +157,24 @@ class Server(Thread):
             token = os.urandom(Protocol.TOKEN_FSZ)
 
         # send the token
-        self.s.sendall(token)
+        self.s.send_payload(Protocol.REQ_TOKEN, token)
 
         # don't allow the client to request another token
         self.allow_req_token = False
 
-    def process_req_swap_roles(self):
+    async def process_req_swap_roles(self):
         """Process a REQ_SWAP_ROLES message."""
         if not self.allow_swap_roles:
             assert False  # not allowed -> abort
 
         # get and validate the token
-        token = self.s.recv_exact(Protocol.TOKEN_FSZ)
+        token = await self.s.recv_exact(Protocol.TOKEN_FSZ)
         try:
             server_thread = self.node.token_pool.pop(token)
         except ObjectNotFound:
             assert False  # token not in pool -> abort
 
-        addr = self.s.recv_address()
+        addr = await self.s.recv_address()
         if addr:
             if not self.node.add_connected_address(addr):
                 assert False  # already connected -> abort
@@ -140,15 +187,51 @@ class Server(Thread):
             ))
 
         # spawn a client
-        self.s.sendall(Protocol.REP_PROCEED)
+        self.s.send_message(Protocol.REP_PROCEED)
         Client(self.node, self.s, addr, server_thread).start()
 
         if self.node.verbose:
             print("\nAdded peer at: {}.".format(addr if addr else "Unknown"))
 
-    def process_inf_address(self):
+    async def process_req_session(self):
+        """Process a REQ_SESSION message."""
+        if not self.allow_swap_roles or \
+                self.s.version < Protocol.VERSION_SESSIONS:
+            assert False  # not allowed -> abort
+
+        addr = await self.s.recv_address()
+
+        # the client takes a peer slot too, refuse rather than wait
+        if not self.node.peers_smp.acquire(blocking=False):
+            assert False  # too many peers -> abort
+
+        if addr:
+            if not self.node.add_connected_address(addr):
+                self.node.peers_smp.release()
+                assert False  # already connected -> abort
+
+            # put the address to queue to be broadcasted later
+            self.node.addr_queue.put(XObject(
+                    obj=addr,
+                    typecode=Protocol.REQ_SWAP_ROLES,
+                    server_thread=self
+            ))
+
+        # go on serving through the session, and spawn a client
+        self.s.send_message(Protocol.REP_PROCEED)
+        session = PeerSession(self.s, dialed=False)
+        session.server_channel.settimeout(self.node.peer_timeout)
+        session.client_channel.settimeout(self.node.peer_timeout)
+        self.s = session.server_channel
+        session.start()
+        Client(self.node, session.client_channel, addr, self).start()
+
+        if self.node.verbose:
+            print("\nAdded peer at: {}.".format(addr if addr else "Unknown"))
+
+    async def process_inf_address(self):
         """Process a INF_ADDRESS message."""
-        addr = self.s.recv_address()
+        addr = await self.s.recv_address()
         if addr and self.node.addr_pool.add(addr):
             self.node.addr_queue.put(XObject(
                     obj=addr,
@@ -156,75 +239,234 @@ class Server(Thread):
                     server_thread=self
             ))
 
-    def process_inf_transaction(self):
+    async def process_inf_transaction(self):
         """Process a INF_TRANSACTION message."""
-        tx_id = self.s.recv_exact(Transaction.TX_ID_FSZ)
+        tx_id = await self.s.recv_exact(Transaction.TX_ID_FSZ)
 
         # if new transaction ID -> receive the transaction then put to queue
         if self.node.tx_id_pool.add(tx_id):
-            self.s.sendall(Protocol.REP_PROCEED)
+            self.s.send_message(Protocol.REP_PROCEED)
+            await self.s.recv_payload(Protocol.INF_TRANSACTION)
             self.node.tx_queue.put(XObject(
-                    obj=self.s.recv_transaction(),
+                    obj=await self.s.recv_transaction(),
                     typecode=Protocol.INF_TRANSACTION,
                     server_thread=self
             ))
 
         # if transaction ID already received -> send REP_STOP
         else:
-            self.s.sendall(Protocol.REP_STOP)
+            self.s.send_message(Protocol.REP_STOP)
+
+    async def process_inf_inv(self):
+        """Process a INF_INV message."""
+        if self.s.version < Protocol.VERSION_BATCHED_INV:
+            assert False  # not negotiated -> abort
+
+        tx_ids = [
+            await self.s.recv_exact(Transaction.TX_ID_FSZ)
+            for _ in range(await self.s.recv_int(Protocol.INV_COUNT_FSZ))
+        ]
+
+        # ask for the new transactions
+        indexes = [i for i, tx_id in enumerate(tx_ids)
+                   if self.node.tx_id_pool.add(tx_id)]
+        self.wanted_tx_ids.update(tx_ids[i] for i in indexes)
+        self.s.send_payload(
+            Protocol.INF_INV,
+            len(indexes).to_bytes(Protocol.INV_COUNT_FSZ, "big") +
+            b"".join(i.to_bytes(Protocol.INV_COUNT_FSZ, "big")
+                     for i in indexes)
+        )
+
+    async def process_transaction(self):
+        """Process a TRANSACTION message."""
+        tx = await self.s.recv_transaction()
+        try:
+            self.wanted_tx_ids.remove(tx.get_id())
+        except KeyError:
+            assert False  # not asked for -> abort
+
+        self.node.tx_queue.put(XObject(
+                obj=tx,
+                typecode=Protocol.INF_TRANSACTION,
+                server_thread=self
+        ))
 
-    def process_inf_block(self):
+    async def process_inf_block(self):
         """Process a INF_BLOCK message."""
-        block_id = self.s.recv_exact(Block.ID_FSZ)
+        block_id = await self.s.recv_exact(Block.ID_FSZ)
 
         # if new block ID -> receive the block then put to queue
         if self.node.block_id_pool.add(block_id):
-            self.s.sendall(Protocol.REP_PROCEED)
+            self.s.send_message(Protocol.REP_PROCEED)
+            await self.s.recv_payload(Protocol.INF_BLOCK)
             self.node.block_queue.put(XObject(
-                    obj=self.s.recv_block(),
+                    obj=await self.s.recv_block(),
                     typecode=Protocol.INF_BLOCK,
                     server_thread=self
             ))
 
         # if block ID already received -> send REP_STOP
         else:
-            self.s.sendall(Protocol.REP_STOP)
+            self.s.send_message(Protocol.REP_STOP)
 
-    def process_req_block(self):
+    async def process_inf_compact_block(self):
+        """Process a INF_COMPACT_BLOCK message."""
+        if self.s.version < Protocol.VERSION_COMPACT_BLOCKS:
+            assert False  # not negotiated -> abort
+
+        block_id = await self.s.recv_exact(Block.ID_FSZ)
+
+        # if block ID already received -> send REP_STOP
+        if not self.node.block_id_pool.add(block_id):
+            self.s.send_message(Protocol.REP_STOP)
+            return
+
+        # receive the compact block, then find its transactions in the pools
+        self.s.send_message(Protocol.REP_PROCEED)
+        await self.s.recv_payload(Protocol.INF_COMPACT_BLOCK)
+        cblock = await self.s.recv_compact_block()
+        txs = await asyncio.get_event_loop().run_in_executor(
+            None, self.match_transactions, cblock)
+
+        # ask for the missing transactions. If the block is still wrong, a
+        # short ID matched a wrong transaction -> ask for all of them.
+        await self.request_transactions(
+            txs, [i for i, tx in enumerate(txs) if tx is None])
+        block = cblock.to_block(txs)
+        if block.get_id() != block_id:
+            await self.request_transactions(txs, range(1, len(txs)))
+            block = cblock.to_block(txs)
+            assert block.get_id() == block_id
+
+        self.s.send_message(Protocol.REP_STOP)
+        self.node.block_queue.put(XObject(
+                obj=block,
+                typecode=Protocol.INF_COMPACT_BLOCK,
+                server_thread=self
+        ))
+
+    def match_transactions(self, cblock: CompactBlock) \
+            -> List[Optional[Transaction]]:
+        """Find a compact block's transactions in the node's pools."""
+        known: Dict[bytes, Transaction] = self.node.mempool.get_transactions()
+
+        # orphans are kept wrapped
+        known.update({tx_id: xtx.obj for tx_id, xtx in
+                      self.node.orphan_tx_pool.get_transactions().items()})
+        return cblock.match(known)
+
+    async def request_transactions(self, txs: List[Optional[Transaction]],
+                                   indexes: Sequence[int]) -> None:
+        """Ask the client for some transactions of a compact block, then put
+        them to `txs`."""
+        if not indexes:
+            return
+
+        self.s.send_message(
+            Protocol.REP_REQ_TXS,
+            len(indexes).to_bytes(Block.TX_COUNT_FSZ, "big") +
+            b"".join(i.to_bytes(Block.TX_COUNT_FSZ, "big") for i in indexes)
+        )
+        await self.s.recv_payload(Protocol.INF_COMPACT_BLOCK)
+        for i in indexes:
+            txs[i] = await self.s.recv_transaction()
+
+    async def process_req_block(self):
         """Process a REQ_BLOCK message."""
-        block_id = self.s.recv_exact(Block.ID_FSZ)
+        block_id = await self.s.recv_exact(Block.ID_FSZ)
         try:
-            self.s.sendall(self.node.load_block_data(block_id))
+            data = await self.load_blocks_data([block_id])
         except FileNotFoundError:
             assert False
+        self.s.send_payload(Protocol.REQ_BLOCK, data[0])
 
-    def process_req_blocks(self):
+    async def process_req_blocks(self):
         """Process a REQ_BLOCKS message."""
 
         # receive client's block height
-        height = self.s.recv_int(Protocol.BLOCK_HEIGHT_FSZ)
+        height = await self.s.recv_int(Protocol.BLOCK_HEIGHT_FSZ)
 
         # collect the block IDS
-        to_be_sent_ids = self.node.block_tree.main_branch.block_ids[
+        to_be_sent_ids = self.node.block_tree.main_chain[
                          height + 1: height + 1 + Protocol.MAX_BLOCKS]
 
         # send the blocks
-        self.s.send_int(len(to_be_sent_ids), Protocol.BLOCK_LIST_LEN_FSZ)
-        for block_id in to_be_sent_ids:
-            self.s.sendall(self.node.load_block_data(block_id))
+        blocks_data = Server.fit_in_frame(
+            await self.load_blocks_data(to_be_sent_ids))
+        data = [len(blocks_data).to_bytes(Protocol.BLOCK_LIST_LEN_FSZ, "big")]
+        data.extend(blocks_data)
+        self.s.send_payload(Protocol.REQ_BLOCKS, b"".join(data))
+
+    async def process_req_block_ids(self):
+        """Process a REQ_BLOCK_IDS message."""
+        locator, stop_id = await self.s.recv_locator()
+
+        # send the IDs
+        block_ids = await self.get_block_range(locator, stop_id,
+                                               Protocol.MAX_BLOCK_IDS)
+        self.s.send_payload(
+            Protocol.REQ_BLOCK_IDS,
+            len(block_ids).to_bytes(Protocol.BLOCK_ID_LIST_LEN_FSZ, "big") +
+            b"".join(block_ids)
+        )
 
-    def process_req_addr_list(self):
+    async def process_req_block_range(self):
+        """Process a REQ_BLOCK_RANGE message."""
+        locator, stop_id = await self.s.recv_locator()
+
+        # collect the block IDs
+        to_be_sent_ids = await self.get_block_range(locator, stop_id,
+                                                    Protocol.MAX_BLOCKS)
+
+        # send the blocks
+        blocks_data = Server.fit_in_frame(
+            await self.load_blocks_data(to_be_sent_ids))
+        data = [len(blocks_data).to_bytes(Protocol.BLOCK_LIST_LEN_FSZ, "big")]
+        data.extend(blocks_data)
+        self.s.send_payload(Protocol.REQ_BLOCK_RANGE, b"".join(data))
+
+    async def get_block_range(self, locator: List[bytes],
+                              stop_id: Optional[bytes],
+                              max_count: int) -> List[bytes]:
+        """Find the blocks to send after a locator in the default executor,
+        so that waiting for the block tree's lock doesn't block the event
+        loop."""
+        def get_range() -> List[bytes]:
+            with self.node.block_tree_lock:
+                return self.node.block_tree.get_range(locator, stop_id,
+                                                      max_count)
+
+        return await asyncio.get_event_loop().run_in_executor(None, get_range)
+
+    async def load_blocks_data(self, block_ids: List[bytes]) -> List[bytes]:
+        """Load some blocks' data in the default executor, so that reading
+        the block files doesn't hold up the other connections."""
+        return await asyncio.get_event_loop().run_in_executor(
+            None, lambda: [self.node.load_block_data(block_id)
+                           for block_id in block_ids])
+
+    @staticmethod
+    def fit_in_frame(blocks_data: List[bytes]) -> List[bytes]:
+        """Return the first blocks of a list of serialized blocks which fit
+        in a frame, after the block count. The requesting node asks again
+        for the rest."""
+        size = Protocol.BLOCK_LIST_LEN_FSZ
+        for i, block_data in enumerate(blocks_data):
+            size += len(block_data)
+            if size > Protocol.MAX_FRAME_LENGTH:
+                return blocks_data[:i]
+        return blocks_data
+
+    async def process_req_addr_list(self):
         """Process a REQ_ADDR_LIST message."""
 
         # get current addresses
         lst = list(self.node.unconnected_addrs | self.node.connected_addrs)
 
-        # send the number of addresses to be sent
-        self.s.send_int(
-            min(len(lst), Protocol.MAX_ADDRS),
-            Protocol.ADDR_LIST_LEN_FSZ
-        )
-
-        # send the addresses
+        # send the number of addresses to be sent, then the addresses
+        data = [min(len(lst), Protocol.MAX_ADDRS).to_bytes(
+            Protocol.ADDR_LIST_LEN_FSZ, "big")]
         for addr in lst[:Protocol.MAX_ADDRS]:
-            self.s.send_address(addr)
+            data.append(AsyncKMASocket.address_to_bytes(addr))
+        self.s.send_payload(Protocol.REQ_ADDR_LIST, b"".join(data))
@@ -0,0 +1,53 @@
+from kmacoin.objects.state import TransactionError
+from kmacoin.atnode.node import Node
+from kmacoin.atnode.structures.mempool import MempoolError
+from kmacoin.atnode.workers.server import XObject
+
+from threading import Thread
+
+
+class TransactionProcessor(Thread):
+    """This class represents a transaction processor."""
+    def __init__(self, node: Node):
+        super().__init__()
+        self.node = node
+
+    def run(self):
+        while True:
+            # get the transaction
+            xtx: XObject = self.node.tx_queue.get()
+
+            # process it, then the orphans it releases (if any)
+            to_be_processed = [xtx]
+            while to_be_processed:
+                self.process(to_be_processed.pop(0), to_be_processed)
+
+    def process(self, xtx: XObject, released: list) -> None:
+        """
+        Process a transaction.
+
+        Args:
+            xtx: the transaction to be processed.
+            released: a list where orphans released by the transaction are
+                appended to.
+
+        """
+        # validate the transaction and add it to the mempool
+        try:
+            self.node.mempool.add(xtx.obj)
+
+        except TransactionError as err:
+            # keep the transaction until its missing coins are found
+            if err.code == TransactionError.COIN_NOT_FOUND:
+                self.node.orphan_tx_pool.add(xtx, xtx.server_thread)
+            return
+
+        except MempoolError:
+            return
+
+        # wake up the miner, relay the transaction
+        self.node.notify_change()
+        self.node.valid_obj_queue.put(xtx)
+
+        # release the orphans waiting for the transaction
+        released.extend(self.node.orphan_tx_pool.pop_children(xtx.obj))
@@ -0,0 +1,386 @@
+from kmacoin.objects.transaction import Transaction
+from kmacoin.objects.block import Block
+from kmacoin.objects.compactblock import CompactBlock
+from kmacoin.network.aiovlp import AsyncVLPSocket
+from kmacoin.network.protocol import Protocol
+from kmacoin.globaldef.hash import HASH_OF_NULL
+
+from typing import Tuple, Optional, List, Callable, Awaitable
+
+import asyncio
+import io
+import os
+import zlib
+
+
+class AsyncKMASocket(AsyncVLPSocket):
+    """
+    An asyncio counterpart of `KMASocket`, adding KMA-Coin objects
+    send/recv functions to an async VLP socket.
+
+    Notes: a socket speaks the legacy protocol until a framed one is
+    negotiated. Messages are sent and received with `send_message`,
+    `send_payload`, `recv_message_type` and `recv_payload`, which work the
+    same in both protocols. In the framed protocol, the other recv functions
+    read from the payload of the latest received frame, and the other send
+    functions must not be used.
+
+    Attributes:
+        version: the protocol version in use.
+        framed: True if the framed protocol is in use.
+        checksum: True if frames carry checksums.
+        frame: the payload of the latest received frame.
+
+    """
+    # blocks bigger than this many bytes are parsed in a worker thread
+    PARSE_IN_EXECUTOR_SIZE = 65536
+
+    frame: Optional[io.BytesIO]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = Protocol.VERSION_LEGACY
+        self.framed = False
+        self.checksum = False
+        self.frame = None
+
+    async def negotiate(self, checksum: bool) -> bool:
+        """
+        Ask the remote server to switch to the latest protocol version.
+
+        Notes: this must be the first message sent through the socket.
+
+        Args:
+            checksum: True to ask for checksums.
+
+        Returns:
+            True if a version is agreed on. False if the server closed the
+            connection, as a legacy server does.
+
+        """
+        flags = Protocol.FLAG_CHECKSUM if checksum else 0
+        self.sendall(
+            Protocol.REQ_VERSION +
+            Protocol.VERSION.to_bytes(Protocol.VERSION_FSZ, "big") +
+            flags.to_bytes(Protocol.FLAGS_FSZ, "big")
+        )
+        try:
+            response = await self.recv_exact(Protocol.TYPE_CODE_FSZ)
+        except (OSError, AssertionError):
+            return False  # the connection is closed
+
+        assert response == Protocol.REP_PROCEED
+        self.version = await self.recv_int(Protocol.VERSION_FSZ)
+        flags = await self.recv_int(Protocol.FLAGS_FSZ)
+        if self.version >= Protocol.VERSION_FRAMED:
+            self.start_framing(flags)
+
+        return True
+
+    async def accept_negotiation(self) -> None:
+        """Reply to a REQ_VERSION message, whose type code has been
+        received."""
+        self.version = min(await self.recv_int(Protocol.VERSION_FSZ),
+                           Protocol.VERSION)
+        flags = await self.recv_int(Protocol.FLAGS_FSZ) & \
+            Protocol.FLAG_CHECKSUM
+        self.sendall(
+            Protocol.REP_PROCEED +
+            self.version.to_bytes(Protocol.VERSION_FSZ, "big") +
+            flags.to_bytes(Protocol.FLAGS_FSZ, "big")
+        )
+        if self.version >= Protocol.VERSION_FRAMED:
+            self.start_framing(flags)
+
+    def start_framing(self, flags: int) -> None:
+        """Switch to the framed protocol."""
+        self.framed = True
+        self.checksum = bool(flags & Protocol.FLAG_CHECKSUM)
+
+    def send_message(self, type_code: bytes, payload: bytes = b"") -> None:
+        """Send a message or a reply, `type_code` being part of it in both
+        protocols."""
+        if self.framed:
+            self._send_frame(type_code, payload)
+        else:
+            self.sendall(type_code + payload)
+
+    def send_payload(self, type_code: bytes, payload: bytes) -> None:
+        """Send a reply or the rest of a message, `type_code` being part of
+        it in the framed protocol only."""
+        if self.framed:
+            self._send_frame(type_code, payload)
+        else:
+            self.sendall(payload)
+
+    async def recv_message_type(self) -> bytes:
+        """Receive a message or a reply, returning its type code. Its fields
+        are then received with the other recv functions."""
+        if self.framed:
+            return await self._recv_frame()
+        return await self.recv_exact(Protocol.TYPE_CODE_FSZ)
+
+    async def recv_payload(self, type_code: bytes) -> None:
+        """Receive a reply or the rest of a message, sent by `send_payload`.
+        Its fields are then received with the other recv functions."""
+        if self.framed:
+            assert await self._recv_frame() == type_code
+
+    async def recv_exact(self, n: int) -> bytes:
+        """Keep waiting until `n` bytes have been received."""
+        if not self.framed:
+            return await super().recv_exact(n)
+
+        data = self.frame.read(n)
+        assert len(data) == n  # the frame is too short
+        return data
+
+    def send_int(self, n: int, size: int) -> None:
+        """
+        Send a positive integer.
+
+        Args:
+            n: the integer to be sent.
+            size: number of bytes which are used to represent the integer.
+
+        """
+        self.sendall(n.to_bytes(size, "big"))
+
+    async def recv_int(self, size: int) -> int:
+        """
+        Receive a positive integer.
+
+        Args:
+            size: number of bytes which are used to represent the integer.
+
+        """
+        return int.from_bytes(await self.recv_exact(size), "big")
+
+    def send_address(self, addr: Tuple[str, int]) -> None:
+        """Send an address."""
+        self.sendall(AsyncKMASocket.address_to_bytes(addr))
+
+    @staticmethod
+    def address_to_bytes(addr: Optional[Tuple[str, int]]) -> bytes:
+        """Convert an address to bytes."""
+
+        # None is allowed.
+        if addr is None:
+            return (0).to_bytes(Protocol.HOSTNAME_LEN_FSZ, "big")
+
+        hostname, port = addr
+        assert len(hostname) <= Protocol.MAX_HOSTNAME_LEN
+
+        return (
+            len(hostname).to_bytes(Protocol.HOSTNAME_LEN_FSZ, "big") +
+            hostname.encode() +
+            port.to_bytes(2, "big")
+        )
+
+    async def recv_address(self) -> Optional[Tuple[str, int]]:
+        """Receive an address."""
+
+        # receive hostname's length
+        hostname_len = await self.recv_int(Protocol.HOSTNAME_LEN_FSZ)
+
+        # "hostname's length equals 0" means "no address".
+        if hostname_len == 0:
+            return None
+
+        # receive hostname
+        hostname = (await self.recv_exact(hostname_len)).decode()
+
+        # receive port and return
+        port = await self.recv_int(2)
+        return hostname, port
+
+    @staticmethod
+    def locator_to_bytes(locator: List[bytes],
+                         stop_id: Optional[bytes]) -> bytes:
+        """Convert a block locator, then the ID of a stop block (None for the
+        top block), to bytes."""
+        assert len(locator) <= Protocol.MAX_LOCATOR_LEN
+        return (
+            len(locator).to_bytes(Protocol.LOCATOR_LEN_FSZ, "big") +
+            b"".join(locator) +
+            (stop_id if stop_id else HASH_OF_NULL)
+        )
+
+    async def recv_locator(self) -> Tuple[List[bytes], Optional[bytes]]:
+        """Receive a block locator, then the ID of a stop block (None for the
+        top block)."""
+        locator = [
+            await self.recv_exact(Block.ID_FSZ)
+            for _ in range(await self.recv_int(Protocol.LOCATOR_LEN_FSZ))
+        ]
+        stop_id = await self.recv_exact(Block.ID_FSZ)
+        return locator, None if stop_id == HASH_OF_NULL else stop_id
+
+    def send_transaction(self, tx: Transaction) -> None:
+        """Send a transaction."""
+        self.sendall(tx.to_bytes())
+
+    async def recv_transaction(self) -> Transaction:
+        """Receive a transaction."""
+        return Transaction.read_from(
+            io.BytesIO(await self._recv_transaction_data()))
+
+    def send_block(self, block: Block) -> None:
+        """Send a block."""
+        self.sendall(block.to_bytes())
+
+    async def recv_block(self) -> Block:
+        """Receive a block."""
+        header = await self.recv_exact(Block.HEADER_SIZE)
+        data: List[bytes] = [header]
+        for _ in range(Block.get_tx_count(header)):
+            data.append(await self._recv_transaction_data())
+
+        # parse big blocks in a worker thread, so that the event loop keeps
+        # serving other connections
+        block_data = b"".join(data)
+        if len(block_data) <= AsyncKMASocket.PARSE_IN_EXECUTOR_SIZE:
+            return Block.read_from(io.BytesIO(block_data))
+        return await asyncio.get_event_loop().run_in_executor(
+            None, Block.read_from, io.BytesIO(block_data))
+
+    async def recv_compact_block(self) -> CompactBlock:
+        """Receive a compact block."""
+        header = await self.recv_exact(Block.HEADER_SIZE)
+        tx_count = Block.get_tx_count(header)
+        assert tx_count > 0  # the reward transaction is required
+
+        data = (
+            header +
+            await self.recv_exact(CompactBlock.SALT_FSZ) +
+            await self._recv_transaction_data() +
+            await self.recv_exact((tx_count - 1) * CompactBlock.SHORT_ID_FSZ)
+        )
+        return CompactBlock.read_from(io.BytesIO(data))
+
+    async def inform_block(
+            self, block: Block, data: bytes,
+            before_reply: Callable[[], Awaitable[None]] = None) -> None:
+        """
+        Inform the remote server of a block, as a compact block if the
+        protocol version allows.
+
+        Args:
+            block: the block.
+            data: the serialized block.
+            before_reply: if given, awaited once the block is announced,
+                before its reply is received (to receive the replies to
+                earlier messages).
+
+        """
+        if self.version < Protocol.VERSION_COMPACT_BLOCKS or not block.txs:
+            await self.inform(Protocol.INF_BLOCK + block.get_id(), data,
+                              before_reply)
+            return
+
+        # send the compact block
+        self.send_message(Protocol.INF_COMPACT_BLOCK, block.get_id())
+        if before_reply:
+            await before_reply()
+        response = await self.recv_message_type()
+        if response == Protocol.REP_STOP:
+            return
+        assert response == Protocol.REP_PROCEED
+        self.send_payload(
+            Protocol.INF_COMPACT_BLOCK,
+            CompactBlock.from_block(
+                block, os.urandom(CompactBlock.SALT_FSZ)).to_bytes()
+        )
+
+        # send the transactions asked for, until the server stops
+        while True:
+            response = await self.recv_message_type()
+            if response == Protocol.REP_STOP:
+                return
+            assert response == Protocol.REP_REQ_TXS
+
+            indexes = [
+                await self.recv_int(Block.TX_COUNT_FSZ)
+                for _ in range(await self.recv_int(Block.TX_COUNT_FSZ))
+            ]
+            assert all(index < len(block.txs) for index in indexes)
+            self.send_payload(
+                Protocol.INF_COMPACT_BLOCK,
+                b"".join(block.txs[index].to_bytes() for index in indexes)
+            )
+
+    def send_inv(self, tx_ids: List[bytes]) -> None:
+        """Announce some transactions with an INF_INV message."""
+        assert len(tx_ids) <= Protocol.MAX_INV
+        self.send_message(
+            Protocol.INF_INV,
+            len(tx_ids).to_bytes(Protocol.INV_COUNT_FSZ, "big") +
+            b"".join(tx_ids)
+        )
+
+    async def recv_inv_reply(self) -> List[int]:
+        """Receive the reply to an INF_INV message, returning the indexes of
+        the wanted transactions."""
+        await self.recv_payload(Protocol.INF_INV)
+        return [
+            await self.recv_int(Protocol.INV_COUNT_FSZ)
+            for _ in range(await self.recv_int(Protocol.INV_COUNT_FSZ))
+        ]
+
+    async def inform(self, data1, data2,
+                     before_reply: Callable[[], Awaitable[None]] = None) \
+            -> None:
+        """Send `data1`, optionally followed by `data2`. `before_reply` is
+        awaited (if given) before the reply to `data1` is received."""
+        type_code = data1[:Protocol.TYPE_CODE_FSZ]
+        self.send_message(type_code, data1[Protocol.TYPE_CODE_FSZ:])
+        if before_reply:
+            await before_reply()
+        response = await self.recv_message_type()
+        if response == Protocol.REP_PROCEED:
+            self.send_payload(type_code, data2)
+        else:
+            assert response == Protocol.REP_STOP
+
+    def _send_frame(self, type_code: bytes, payload: bytes) -> None:
+        """Send a frame."""
+        assert len(payload) <= Protocol.MAX_FRAME_LENGTH
+        header = type_code + len(payload).to_bytes(
+            Protocol.FRAME_LENGTH_FSZ, "big")
+        if self.checksum:
+            header += zlib.crc32(payload).to_bytes(Protocol.CHECKSUM_FSZ,
+                                                   "big")
+        self.sendall(header + payload)
+
+    async def _recv_frame(self) -> bytes:
+        """Receive a frame, returning its type code."""
+
+        # the previous frame must have been read entirely
+        assert self.frame is None or \
+            self.frame.tell() == len(self.frame.getbuffer())
+
+        # receive the header with one call
+        header_size = Protocol.TYPE_CODE_FSZ + Protocol.FRAME_LENGTH_FSZ
+        if self.checksum:
+            header_size += Protocol.CHECKSUM_FSZ
+        header = await super().recv_exact(header_size)
+        type_code = header[:Protocol.TYPE_CODE_FSZ]
+        length = int.from_bytes(
+            header[Protocol.TYPE_CODE_FSZ:
+                   Protocol.TYPE_CODE_FSZ + Protocol.FRAME_LENGTH_FSZ], "big")
+        assert length <= Protocol.MAX_FRAME_LENGTH  # too long -> abort
+
+        # then the payload
+        payload = await super().recv_exact(length)
+        if self.checksum:
+            assert zlib.crc32(payload) == int.from_bytes(
+                header[-Protocol.CHECKSUM_FSZ:], "big")
+
+        self.frame = io.BytesIO(payload)
+        return type_code
+
+    async def _recv_transaction_data(self) -> bytes:
+        """Receive a serialized transaction."""
+        header = await self.recv_exact(Transaction.HEADER_SIZE)
+        return header + await self.recv_exact(
+            Transaction.get_size(header) - Transaction.HEADER_SIZE)
@@ -0,0 +1,240 @@
+from kmacoin.network import vlp
+from kmacoin.network.vlp import VLPSocket, Location, Address
+from kmacoin.network.visualizing import Event
+
+from collections import deque
+from typing import Callable, Awaitable, Deque, Tuple, Optional
+
+import asyncio
+import socket
+import struct
+
+
+class AsyncVLPSocket(object):
+    """
+    An asyncio counterpart of `VLPSocket`, implementing the VLP protocol over
+    asyncio streams.
+
+    Notes: the socket must only be used by coroutines running on one event
+    loop.
+
+    Attributes:
+        virt_loc: the virtual location.
+        reader: the stream reader of the connection.
+        writer: the stream writer of the connection.
+        virt_latency: the virtual latency.
+        peer_virt_loc: the virtual location of remote peer.
+        name: the socket's name, shown by the network visualizer.
+        timeout: timeout value for receiving (None for no timeout).
+        pending: (due time, data) of the data waiting to be sent, the
+            earliest first. This keeps the messages sent by the socket in
+            order.
+        pending_size: the number of bytes of the pending data.
+        flush_handle: the timer which sends the earliest pending data.
+        drainer: the task waiting for the connection's send buffer to be
+            drained, shared by the coroutines calling `drain`.
+
+    """
+    reader: Optional[asyncio.StreamReader]
+    writer: Optional[asyncio.StreamWriter]
+    pending: Deque[Tuple[float, bytes]]
+    flush_handle: Optional[asyncio.TimerHandle]
+    drainer: Optional[asyncio.Future]
+
+    # `drain` waits while more pending bytes than this are held back by the
+    # virtual latency:
+    MAX_PENDING_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, virt_loc: Location,
+                 reader: asyncio.StreamReader = None,
+                 writer: asyncio.StreamWriter = None,
+                 virt_latency: float = None, peer_virt_loc: Location = None,
+                 name: str = ""):
+        self.virt_loc = virt_loc
+        self.reader = reader
+        self.writer = writer
+        self.virt_latency = virt_latency
+        self.peer_virt_loc = peer_virt_loc
+        self.name = name
+        self.timeout = None
+        self.pending = deque()
+        self.pending_size = 0
+        self.flush_handle = None
+        self.drainer = None
+
+        # `virt_latency` and `peer_virt_loc` must be given if streams given
+        if writer:
+            assert peer_virt_loc is not None
+            assert virt_latency is not None
+            self._register()
+
+    @classmethod
+    async def start_server(
+            cls, virt_loc: Location, address: Address,
+            client_connected_cb: Callable[['AsyncVLPSocket', Address],
+                                          Awaitable[None]],
+            name: str = "") -> asyncio.AbstractServer:
+        """
+        Start listening for connections.
+
+        Args:
+            virt_loc: the virtual location.
+            address: the listening address.
+            client_connected_cb: a coroutine function, called with a socket
+                and the client's address whenever a connection is accepted.
+            name: name of the sockets.
+
+        Returns:
+            The asyncio server.
+
+        """
+        async def on_connected(reader: asyncio.StreamReader,
+                               writer: asyncio.StreamWriter) -> None:
+            # exchange virtual location info
+            writer.write(struct.pack("ff", *virt_loc))
+            try:
+                client_virt_loc = struct.unpack(
+                    "ff", await reader.readexactly(8))
+            except (OSError, asyncio.IncompleteReadError):
+                writer.close()
+                return
+
+            # get connection latency
+            virt_latency = VLPSocket.get_latency(virt_loc, client_virt_loc)
+
+            # wrap the streams
+            vlps = cls(virt_loc, reader, writer, virt_latency,
+                       client_virt_loc, name)
+            await client_connected_cb(vlps, writer.get_extra_info("peername"))
+
+        server = await asyncio.start_server(on_connected, *address)
+
+        # generate events for the listening socket
+        if vlp.vlpstate.add_socket(server.sockets[0], virt_loc, None, name):
+            if vlp.event_q:
+                vlp.event_q.put((Event.CREATE_SOCKET, virt_loc, name))
+
+        return server
+
+    async def connect(self, address: Address) -> None:
+        """Connect to an address."""
+        self.reader, self.writer = await self._wait(
+            asyncio.open_connection(*address))
+
+        # exchange virtual location info
+        self.writer.write(struct.pack("ff", *self.virt_loc))
+        server_virt_loc = struct.unpack("ff", await self.recv_exact(8))
+
+        # update the virtual latency and remote peer's virtual location
+        self.virt_latency = VLPSocket.get_latency(self.virt_loc,
+                                                  server_virt_loc)
+        self.peer_virt_loc = server_virt_loc
+
+        self._register()
+
+    def sendall(self, data: bytes) -> None:
+        """Lazily send out some data."""
+        if self.writer is None or self.writer.is_closing():
+            raise ConnectionResetError("The socket is closed!")
+
+        # schedule the data, after the data already pending
+        loop = asyncio.get_event_loop()
+        self.pending.append((loop.time() + self.virt_latency, data))
+        self.pending_size += len(data)
+        if self.flush_handle is None:
+            self.flush_handle = loop.call_at(self.pending[0][0], self._flush)
+
+        # generate an event
+        if vlp.event_q:
+            vlp.event_q.put((Event.TRANSMIT, self.virt_loc,
+                             self.peer_virt_loc, len(data)))
+
+    async def drain(self) -> None:
+        """
+        Wait until the connection's send buffer is drained enough.
+
+        Notes: `sendall` never blocks, so a coroutine sending a lot calls
+        this method between messages, to stop sending while the remote peer
+        is too slow to receive.
+        """
+        # wait for the data held back by the virtual latency to be sent out
+        loop = asyncio.get_event_loop()
+        while self.pending_size > AsyncVLPSocket.MAX_PENDING_SIZE:
+            await self._wait(asyncio.sleep(self.pending[0][0] - loop.time()))
+
+        if self.writer is None or self.writer.is_closing():
+            raise ConnectionResetError("The socket is closed!")
+
+        transport = self.writer.transport
+        if transport.get_write_buffer_size() <= \
+                transport.get_write_buffer_limits()[1]:
+            return
+
+        if self.drainer is None or self.drainer.done():
+            self.drainer = asyncio.ensure_future(self.writer.drain())
+        await self._wait(asyncio.shield(self.drainer))
+
+    async def recv(self, bufsize: int) -> bytes:
+        """Receive some data."""
+        return await self._wait(self.reader.read(bufsize))
+
+    async def recv_exact(self, n: int) -> bytes:
+        """Keep waiting until `n` bytes have been received."""
+        try:
+            return await self._wait(self.reader.readexactly(n))
+        except asyncio.IncompleteReadError:
+            assert False  # the connection is closed
+
+    def settimeout(self, value: Optional[float]) -> None:
+        """Set this socket timeout value."""
+        self.timeout = value
+
+    def close(self) -> None:
+        """Close this socket."""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        self.pending.clear()
+        self.pending_size = 0
+
+        if self.writer is None:
+            return
+        s = self.writer.get_extra_info("socket")
+        self.writer.close()
+        if vlp.vlpstate.remove_socket(s):
+            if vlp.event_q:
+                vlp.event_q.put((Event.CLOSE_SOCKET, self.virt_loc,
+                                 self.peer_virt_loc))
+
+    def _flush(self) -> None:
+        """Send out the pending data which is due."""
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        while self.pending and self.pending[0][0] <= now:
+            _, data = self.pending.popleft()
+            self.pending_size -= len(data)
+            if not self.writer.is_closing():
+                self.writer.write(data)
+
+        self.flush_handle = loop.call_at(self.pending[0][0], self._flush) \
+            if self.pending else None
+
+    async def _wait(self, aw: Awaitable):
+        """Wait for an awaitable, at most `timeout` seconds."""
+        if self.timeout is None:
+            return await aw
+        try:
+            return await asyncio.wait_for(aw, self.timeout)
+        except asyncio.TimeoutError:
+            raise socket.timeout("timed out")
+
+    def _register(self) -> None:
+        """Add the socket to the VLP state, and generate events."""
+        s = self.writer.get_extra_info("socket")
+        if vlp.vlpstate.add_socket(s, self.virt_loc, self.peer_virt_loc,
+                                   self.name):
+            if vlp.event_q:
+                vlp.event_q.put((Event.CREATE_SOCKET, self.virt_loc,
+                                 self.name))
+                vlp.event_q.put((Event.CONNECT, self.virt_loc,
+                                 self.peer_virt_loc))
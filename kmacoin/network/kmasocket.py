@@ -2,8 +2,11 @@ from kmacoin.objects.transaction import Transaction
 from kmacoin.objects.block import Block
 from kmacoin.network.vlp import VLPSocket
 from kmacoin.network.protocol import Protocol
+from kmacoin.globaldef.hash import HASH_OF_NULL
 
-from typing import Tuple, Optional
+from typing import Tuple, Optional, List
+
+import io
 
 
 class KMASocket(VLPSocket):
@@ -11,9 +14,13 @@ class KMASocket(VLPSocket):
     @staticmethod
     def from_vlpsocket(vlpsocket: VLPSocket) -> 'KMASocket':
         """Cast a VLP socket to a KMA socket."""
-        return KMASocket(vlpsocket.virt_loc, vlpsocket.s,
-                         vlpsocket.virt_latency, vlpsocket.peer_virt_loc,
-                         vlpsocket.name)
+        kmasocket = KMASocket(vlpsocket.virt_loc, vlpsocket.s,
+                              vlpsocket.virt_latency, vlpsocket.peer_virt_loc,
+                              vlpsocket.name)
+
+        # keep the data which has been received already
+        kmasocket.rbuf = vlpsocket.rbuf
+        return kmasocket
 
     def send_int(self, n: int, size: int) -> None:
         """
@@ -71,14 +78,25 @@ class KMASocket(VLPSocket):
         port = self.recv_int(2)
         return hostname, port
 
+    def send_locator(self, locator: List[bytes],
+                     stop_id: Optional[bytes]) -> None:
+        """Send a block locator, then the ID of a stop block (None for the
+        top block)."""
+        assert len(locator) <= Protocol.MAX_LOCATOR_LEN
+        self.sendall(
+            len(locator).to_bytes(Protocol.LOCATOR_LEN_FSZ, "big") +
+            b"".join(locator) +
+            (stop_id if stop_id else HASH_OF_NULL)
+        )
+
     def send_transaction(self, tx: Transaction) -> None:
         """Send a transaction."""
         self.sendall(tx.to_bytes())
 
     def recv_transaction(self) -> Transaction:
         """Receive a transaction."""
-        with self.s.makefile("rb", buffering=0) as f:
-            return Transaction.read_from(f)
+        size = self._get_transaction_size(0)
+        return Transaction.read_from(io.BytesIO(self.recv_exact(size)))
 
     def send_block(self, block: Block) -> None:
         """Send a block."""
@@ -86,8 +104,15 @@ class KMASocket(VLPSocket):
 
     def recv_block(self) -> Block:
         """Receive a block."""
-        with self.s.makefile("rb", buffering=0) as f:
-            return Block.read_from(f)
+
+        # find the block's size in the receive buffer, then take the whole
+        # block at once
+        self.fill(Block.HEADER_SIZE)
+        size = Block.HEADER_SIZE
+        for _ in range(Block.get_tx_count(self.rbuf[:Block.HEADER_SIZE])):
+            size += self._get_transaction_size(size)
+
+        return Block.read_from(io.BytesIO(self.recv_exact(size)))
 
     def inform(self, data1, data2) -> None:
         """Send `data1`, optionally followed by `data2`."""
@@ -97,3 +122,10 @@ class KMASocket(VLPSocket):
             self.sendall(data2)
         else:
             assert response == Protocol.REP_STOP
+
+    def _get_transaction_size(self, offset: int) -> int:
+        """Return the size of the transaction starting at `offset` in the
+        receive buffer, waiting until its header has been received."""
+        self.fill(offset + Transaction.HEADER_SIZE)
+        return Transaction.get_size(
+            self.rbuf[offset:offset + Transaction.HEADER_SIZE])
@@ -0,0 +1,220 @@
+from kmacoin.network.aiokmasocket import AsyncKMASocket
+from kmacoin.network.protocol import Protocol
+
+from typing import Deque, Optional, Tuple
+
+import asyncio
+import collections
+import io
+import zlib
+
+
+class PeerSession(object):
+    """
+    A peer session, multiplexing the messages of both nodes' clients over one
+    connection, so that each node serves the other's requests.
+
+    Notes: a message is sent as a session frame, made of its type code, a
+    request ID, its payload length, an optional checksum, then its payload.
+    The node which dialed starts requests with odd IDs, the other one with
+    even IDs, and a reply takes its request's ID. Frames are read by one
+    coroutine, and routed by their IDs to `server_channel` (requests from the
+    remote node) or `client_channel` (replies to the local node). A remote
+    node sending frames faster than a channel consumes them, beyond its
+    inbox limits, or replies matching none of the local node's outstanding
+    requests, is disconnected.
+
+    Attributes:
+        s: the socket holding the connection, once the session is agreed on.
+        dialed: True if the local node dialed the connection.
+        server_channel: the socket of the local server.
+        client_channel: the socket of the local client.
+        reader_task: the task reading and routing the frames.
+
+    """
+    reader_task: Optional[asyncio.Task]
+
+    def __init__(self, s: AsyncKMASocket, dialed: bool):
+        self.s = s
+        self.dialed = dialed
+        self.server_channel = SessionChannel(self, initiator=False)
+        self.client_channel = SessionChannel(self, initiator=True)
+        self.reader_task = None
+
+        # from now on, frames are built and parsed by the session
+        self.s.framed = False
+        self.s.settimeout(None)
+
+    def start(self) -> None:
+        """Start reading frames, on the running event loop."""
+        self.reader_task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        try:
+            while True:
+                type_code, request_id, payload = await self.recv_frame()
+                if request_id % 2 == int(self.dialed):
+                    channel = self.client_channel
+                    channel.check_reply(request_id)
+                else:
+                    channel = self.server_channel
+                channel.put_frame(type_code, request_id, payload)
+
+        except (OSError, AssertionError):
+            self.close()
+
+    def send_frame(self, type_code: bytes, request_id: int,
+                   payload: bytes) -> None:
+        """Send a session frame."""
+        assert len(payload) <= Protocol.MAX_FRAME_LENGTH
+        header = (
+            type_code +
+            request_id.to_bytes(Protocol.REQUEST_ID_FSZ, "big") +
+            len(payload).to_bytes(Protocol.FRAME_LENGTH_FSZ, "big")
+        )
+        if self.s.checksum:
+            header += zlib.crc32(payload).to_bytes(Protocol.CHECKSUM_FSZ,
+                                                   "big")
+        self.s.sendall(header + payload)
+
+    async def recv_frame(self) -> Tuple[bytes, int, bytes]:
+        """Receive a session frame, returning (type code, request ID,
+        payload)."""
+
+        # receive the header with one call
+        header_size = Protocol.TYPE_CODE_FSZ + Protocol.REQUEST_ID_FSZ + \
+            Protocol.FRAME_LENGTH_FSZ
+        if self.s.checksum:
+            header_size += Protocol.CHECKSUM_FSZ
+        header = io.BytesIO(await self.s.recv_exact(header_size))
+        type_code = header.read(Protocol.TYPE_CODE_FSZ)
+        request_id = int.from_bytes(header.read(Protocol.REQUEST_ID_FSZ),
+                                    "big")
+        length = int.from_bytes(header.read(Protocol.FRAME_LENGTH_FSZ), "big")
+        assert length <= Protocol.MAX_FRAME_LENGTH  # too long -> abort
+
+        # then the payload
+        payload = await self.s.recv_exact(length)
+        if self.s.checksum:
+            assert zlib.crc32(payload) == int.from_bytes(header.read(), "big")
+
+        return type_code, request_id, payload
+
+    def close(self) -> None:
+        """Close the connection, waking up both channels."""
+        self.s.close()
+        self.server_channel.inbox.put_nowait(None)
+        self.client_channel.inbox.put_nowait(None)
+
+
+class SessionChannel(AsyncKMASocket):
+    """
+    One side of a peer session, used like a framed socket by a local server
+    or client.
+
+    Notes: closing a channel closes the whole session. The remote server
+    handles requests in order, so a reply to a request means that the older
+    ones are done with.
+
+    Attributes:
+        session: the peer session.
+        initiator: True if the channel starts requests (the client's one).
+        inbox: (type code, request ID, payload) of the frames routed to the
+            channel, or None once the session is closed.
+        inbox_size: the size of the frames in the inbox, each counting its
+            payload length plus `FRAME_COST`.
+        request_id: the ID of the latest sent request or received frame,
+            which replies and the rest of messages are sent with.
+        next_id: the ID of the next request started by the channel.
+        outstanding: the IDs of the requests started by the channel which
+            may still be replied to, oldest first.
+
+    """
+    inbox: 'asyncio.Queue[Optional[Tuple[bytes, int, bytes]]]'
+    outstanding: Deque[int]
+
+    # request IDs wrap around:
+    REQUEST_ID_MODULUS = 2 ** (8*Protocol.REQUEST_ID_FSZ)
+
+    # The maximum size of the frames waiting in an inbox, a frame counting
+    # `FRAME_COST` bytes besides its payload, so that empty frames count too:
+    MAX_INBOX_SIZE = 2 * Protocol.MAX_FRAME_LENGTH
+    FRAME_COST = 256
+
+    # the requests which the remote server does not reply to:
+    NO_REPLY_TYPE_CODES = (Protocol.INF_ADDR, Protocol.TRANSACTION)
+
+    def __init__(self, session: PeerSession, initiator: bool):
+        super().__init__(session.s.virt_loc, name=session.s.name)
+        self.session = session
+        self.initiator = initiator
+        self.inbox = asyncio.Queue()
+        self.inbox_size = 0
+        self.request_id = 0
+        self.next_id = int(session.dialed)
+        self.outstanding = collections.deque()
+
+        self.version = session.s.version
+        self.framed = True
+        self.checksum = session.s.checksum
+        self.virt_latency = session.s.virt_latency
+        self.peer_virt_loc = session.s.peer_virt_loc
+
+    def send_message(self, type_code: bytes, payload: bytes = b"") -> None:
+        """Send a message, starting a request from the client's channel, or
+        a reply from the server's one."""
+        if self.initiator:
+            self.request_id = self.next_id
+            self.next_id = (self.next_id + 2) % \
+                SessionChannel.REQUEST_ID_MODULUS
+            if type_code not in SessionChannel.NO_REPLY_TYPE_CODES:
+                self.outstanding.append(self.request_id)
+        self.session.send_frame(type_code, self.request_id, payload)
+
+    def send_payload(self, type_code: bytes, payload: bytes) -> None:
+        """Send a reply or the rest of a message, with the current request
+        ID."""
+        self.session.send_frame(type_code, self.request_id, payload)
+
+    def sendall(self, data: bytes) -> None:
+        """Raw data cannot be sent through a channel."""
+        raise ConnectionResetError("Not a stream socket!")
+
+    def put_frame(self, type_code: bytes, request_id: int,
+                  payload: bytes) -> None:
+        """Put a frame routed to the channel into its inbox."""
+        self.inbox_size += len(payload) + SessionChannel.FRAME_COST
+        assert self.inbox_size <= SessionChannel.MAX_INBOX_SIZE  # flood
+        self.inbox.put_nowait((type_code, request_id, payload))
+
+    def check_reply(self, request_id: int) -> None:
+        """Check that a frame routed to the channel replies to one of its
+        outstanding requests, dropping the older ones."""
+        while self.outstanding and self.outstanding[0] != request_id:
+            self.outstanding.popleft()
+        assert self.outstanding  # unsolicited reply
+
+    async def drain(self) -> None:
+        """Wait until the session's send buffer is drained enough."""
+        await self.session.s.drain()
+
+    def close(self) -> None:
+        """Close the session."""
+        self.session.close()
+
+    async def _recv_frame(self) -> bytes:
+        """Receive a frame routed to the channel, returning its type code."""
+
+        # the previous frame must have been read entirely
+        assert self.frame is None or \
+            self.frame.tell() == len(self.frame.getbuffer())
+
+        item = await self._wait(self.inbox.get())
+        if item is None:
+            self.inbox.put_nowait(None)  # for later receives
+            assert False  # the session is closed
+
+        type_code, self.request_id, payload = item
+        self.inbox_size -= len(payload) + SessionChannel.FRAME_COST
+        self.frame = io.BytesIO(payload)
+        return type_code
@@ -17,23 +17,87 @@ class Protocol(object):
     REQ_BLOCKS = b"\x07"
     REQ_ADDR_LIST = b"\x08"
 
+    # Sent before any other message, to negotiate the protocol version:
+    REQ_VERSION = b"\x09"
+
+    # Replaces INF_BLOCK from VERSION_COMPACT_BLOCKS:
+    INF_COMPACT_BLOCK = b"\x0a"
+
+    # Replace INF_TRANSACTION from VERSION_BATCHED_INV. The server replies
+    # to an INF_INV with the indexes of the wanted transactions, then the
+    # client sends each of them with a TRANSACTION message:
+    INF_INV = b"\x0b"
+    TRANSACTION = b"\x0c"
+
+    # Carry a block locator then a stop block ID (HASH_OF_NULL for the top
+    # block), and ask for the IDs, or the blocks, following the fork point
+    # of the locator's branch on the way to the stop block:
+    REQ_BLOCK_IDS = b"\x0d"
+    REQ_BLOCK_RANGE = b"\x0e"
+
+    # Carries the client's public address, and turns the connection into a
+    # peer session (like REQ_SWAP_ROLES, without a second connection):
+    REQ_SESSION = b"\x0f"
+
     # All server reply type codes...
     # ...when receive a PING:
     PONG = b"\x00"
 
-    # ...when receive a REQ_SWAP_ROLES/INF_TRANSACTION/INF_BLOCK:
+    # ...when receive a REQ_SWAP_ROLES/REQ_SESSION/INF_TRANSACTION/
+    # INF_BLOCK/INF_COMPACT_BLOCK:
     REP_PROCEED = b"\x00"
     REP_STOP = b"\x01"
 
+    # ...when receive a compact block, to ask for some of its transactions:
+    REP_REQ_TXS = b"\x02"
+
+    # Protocol versions:
+    # - VERSION_LEGACY: a message is its type code followed by its fields.
+    # - VERSION_FRAMED: a message is sent as a frame, made of its type code,
+    #   its payload length, an optional checksum, then its payload. The
+    #   payload is what follows the type code in the legacy format. A reply
+    #   without a type code in the legacy format takes the request's one.
+    # - VERSION_COMPACT_BLOCKS: framed, blocks are relayed as compact blocks.
+    # - VERSION_BATCHED_INV: also, transactions are announced in batches.
+    # - VERSION_LOCATORS: also, REQ_BLOCK_RANGE is understood.
+    # - VERSION_SESSIONS: also, REQ_SESSION is understood. A session frame
+    #   carries a request ID after its type code.
+    VERSION_LEGACY = 0
+    VERSION_FRAMED = 1
+    VERSION_COMPACT_BLOCKS = 2
+    VERSION_BATCHED_INV = 3
+    VERSION_LOCATORS = 4
+    VERSION_SESSIONS = 5
+    VERSION = VERSION_SESSIONS  # the latest version
+
+    # Flags negotiated with the version:
+    FLAG_CHECKSUM = 0x01  # frames carry the CRC-32 of their payloads
+
     # More field sizes:
     TOKEN_FSZ = 4
     HOSTNAME_LEN_FSZ = 1
     BLOCK_HEIGHT_FSZ = 4
     BLOCK_LIST_LEN_FSZ = 1
     ADDR_LIST_LEN_FSZ = 1
+    VERSION_FSZ = 1
+    FLAGS_FSZ = 1
+    FRAME_LENGTH_FSZ = 4
+    CHECKSUM_FSZ = 4
+    INV_COUNT_FSZ = 2
+    BLOCK_ID_LIST_LEN_FSZ = 2
+    LOCATOR_LEN_FSZ = 1
+    REQUEST_ID_FSZ = 4
 
     # Deduced limits:
     MAX_HOSTNAME_LEN = 2 ** (8*HOSTNAME_LEN_FSZ) - 1
     MAX_BLOCK_HEIGHT = 2 ** (8*BLOCK_HEIGHT_FSZ) - 1
     MAX_BLOCKS = 2 ** (8*BLOCK_LIST_LEN_FSZ) - 1
     MAX_ADDRS = 2 ** (8*ADDR_LIST_LEN_FSZ) - 1
+    MAX_INV = 2 ** (8*INV_COUNT_FSZ) - 1
+    MAX_BLOCK_IDS = 2 ** (8*BLOCK_ID_LIST_LEN_FSZ) - 1
+    MAX_LOCATOR_LEN = 2 ** (8*LOCATOR_LEN_FSZ) - 1
+
+    # The maximum payload length of a frame, far above the size of a block
+    # filled from a full default mempool. A peer announcing a longer payload
+    # is disconnected, rather than making the node allocate it:
+    MAX_FRAME_LENGTH = 32 * 1024 * 1024
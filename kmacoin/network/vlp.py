@@ -1,9 +1,11 @@
 from kmacoin.network.visualizing import visualize, Event, PROPAGATION_SPEED
 
-from socket import socket
+from socket import socket, socketpair
 from threading import Thread, Lock
 from multiprocessing import Queue, Process
 
+import heapq
+import selectors
 import time
 import struct
 import math
@@ -90,40 +92,137 @@ class NetworkVisualizer(Thread):
         event_q = None
 
 
-class LazyTransmitter(Thread):
+class DelayScheduler(Thread):
     """
-    A lazy transmitter delays transmitting some data for a specific amount of
-    time.
+    A delay scheduler transmits the data sent by all VLP sockets of the
+    process, each piece at its due time.
+
+    Notes: the data sent by a socket is transmitted in the order it was
+    scheduled. Due data which cannot be transmitted right away waits in its
+    socket's backlog, so a slow peer never holds up other connections. The
+    data is transmitted through a non-blocking duplicate of the socket, the
+    socket itself being used by its owner.
 
     Attributes:
-        data: the data to be sent.
-        s: the socket which is used to send the data.
-        sleep_time: the delay time.
-        prev_lt: a previous lazy transmitter, must finish its task before
-            current transmitter actually transmit the data.
+        heap: (due time, sequence number, socket, data) of the data waiting
+            for its due time, the earliest first.
+        seq: number of the data ever scheduled, used to keep the data with
+            the same due time in order.
+        backlogs: socket -> the due data which has not been transmitted yet.
+        senders: socket -> the non-blocking duplicate which the socket's data
+            is transmitted through, until the socket is closed.
+        selector: the selector waiting for the wake-up socket, and for the
+            senders of the sockets with backlogs.
+        lock: a lock which is used to synchronize accesses to the heap.
+        running: True if the scheduler has been started.
+        wake_r: the socket which the scheduler waits on, to be woken up.
+        wake_w: the socket which wakes the scheduler up.
 
     """
-    def __init__(self, data: bytes, s: socket, sleep_time: float,
-                 prev_lt: 'LazyTransmitter'):
-        super().__init__()
-        self.s = s
-        self.sleep_time = sleep_time
-        self.data = data
-        self.prev_lt = prev_lt
-
-    def run(self):
-        # sleep
-        time.sleep(self.sleep_time)
+    heap: List[Tuple[float, int, socket, bytes]]
+    backlogs: Dict[socket, bytearray]
+    senders: Dict[socket, socket]
 
-        # wait for previous transmitter
-        if self.prev_lt is not None:
-            self.prev_lt.join()
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.heap = []
+        self.seq = 0
+        self.backlogs = {}
+        self.senders = {}
+        self.selector = selectors.DefaultSelector()
+        self.lock = Lock()
+        self.running = False
+        self.wake_r, self.wake_w = socketpair()
+        self.wake_w.setblocking(False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ)
+
+    def schedule(self, s: socket, data: bytes, delay: float) -> None:
+        """Transmit some data through a socket after `delay` seconds."""
+        with self.lock:
+            if not self.running:
+                self.running = True
+                self.start()
+
+            entry = (time.monotonic() + delay, self.seq, s, data)
+            self.seq += 1
+            heapq.heappush(self.heap, entry)
+
+            # the scheduler is waiting for a later due time -> wake it up
+            if self.heap[0] is entry:
+                self.wake()
+
+    def wake(self) -> None:
+        """Wake the scheduler up, e.g. when a socket has been closed."""
+        try:
+            self.wake_w.send(b"\0")
+        except OSError:
+            pass  # already being woken up
 
-        # send the data
+    def run(self):
+        while True:
+            # move the due data to the backlogs
+            with self.lock:
+                now = time.monotonic()
+                while self.heap and self.heap[0][0] <= now:
+                    _, _, s, data = heapq.heappop(self.heap)
+                    if s.fileno() >= 0:
+                        self._add_backlog(s, data)
+
+                timeout = self.heap[0][0] - now if self.heap else None
+
+            # drop the closed sockets, with their backlogs
+            for s in [s for s in self.senders if s.fileno() < 0]:
+                self._remove(s)
+
+            # wait for the next due time, a wake-up or a writable socket
+            for key, _ in self.selector.select(timeout):
+                if key.fileobj is self.wake_r:
+                    self.wake_r.recv(4096)
+                else:
+                    self._transmit(key.data)
+
+    def _add_backlog(self, s: socket, data: bytes) -> None:
+        """Add some due data to a socket's backlog."""
+        if s not in self.senders:
+            try:
+                sender = s.dup()
+            except OSError:
+                return  # closed in the meantime, drop the data
+            sender.setblocking(False)
+            self.senders[s] = sender
+
+        if s not in self.backlogs:
+            self.backlogs[s] = bytearray()
+            self.selector.register(self.senders[s], selectors.EVENT_WRITE,
+                                   data=s)
+        self.backlogs[s].extend(data)
+
+    def _transmit(self, s: socket) -> None:
+        """Transmit as much of a writable socket's backlog as possible."""
+        backlog = self.backlogs[s]
         try:
-            self.s.sendall(self.data)
+            sent = self.senders[s].send(backlog)
+        except BlockingIOError:
+            return
         except OSError:
-            pass  # exception on the sending thread won't be caught
+            self._remove(s)  # the connection is broken, drop the data
+            return
+
+        del backlog[:sent]
+        if not backlog:
+            del self.backlogs[s]
+            self.selector.unregister(self.senders[s])
+
+    def _remove(self, s: socket) -> None:
+        """Forget a socket, dropping its backlog and closing its sender."""
+        sender = self.senders.pop(s)
+        if self.backlogs.pop(s, None) is not None:
+            self.selector.unregister(sender)
+        sender.close()
+
+
+# the only delay scheduler of the program's current instance:
+delay_scheduler = DelayScheduler()
 
 
 class VLPSocket(object):
@@ -138,10 +237,21 @@ class VLPSocket(object):
         s: the wrapped socket.
         virt_latency: the virtual latency.
         peer_virt_loc: the virtual location of remote peer.
-        latest_lt: the latest lazy transmitter ever created. This keeps the
-            messages sent by the socket in order.
+        rbuf: the received data which has not been consumed yet.
+
+    Notes: the wrapped socket always has a timeout, which keeps it
+    non-blocking for the delay scheduler. Without timeout, it waits for
+    `NO_TIMEOUT` seconds.
 
     """
+    # at most this many bytes are received from the wrapped socket at once
+    RECV_CHUNK_SIZE = 65536
+
+    # the timeout standing for no timeout (a year)
+    NO_TIMEOUT = 365 * 24 * 3600.0
+
+    rbuf: bytearray
+
     def __init__(self, virt_loc: Location, s: socket = None,
                  virt_latency: float = None, peer_virt_loc: Location = None,
                  name: str = ""):
@@ -159,7 +269,8 @@ class VLPSocket(object):
         self.virt_latency = virt_latency
         self.peer_virt_loc = peer_virt_loc
         self.name = name
-        self.latest_lt = None
+        self.rbuf = bytearray()
+        self.settimeout(self.s.gettimeout())
 
         # generate events if successfully add the socket to VLP state
         if vlpstate.add_socket(self.s, self.virt_loc, self.peer_virt_loc):
@@ -217,9 +328,7 @@ class VLPSocket(object):
     def sendall(self, data: bytes) -> None:
         """Lazily send out some data."""
         self.s.sendall(b"")  # check for errors
-        self.latest_lt = LazyTransmitter(data, self.s, self.virt_latency,
-                                         self.latest_lt)
-        self.latest_lt.start()
+        delay_scheduler.schedule(self.s, data, self.virt_latency)
 
         # generate an event
         if event_q:
@@ -228,27 +337,39 @@ class VLPSocket(object):
 
     def recv(self, bufsize: int) -> bytes:
         """Receive some data."""
-        return self.s.recv(bufsize)
+        if not self.rbuf:
+            data = self.s.recv(max(bufsize, VLPSocket.RECV_CHUNK_SIZE))
+            if len(data) <= bufsize:
+                return data
+            self.rbuf += data
+
+        result = bytes(self.rbuf[:bufsize])
+        del self.rbuf[:bufsize]
+        return result
 
     def recv_exact(self, n: int) -> bytes:
         """Keep waiting until `n` bytes have been received."""
-        to_recv = n
-        result = []
-        while to_recv > 0:
-            tmp = self.recv(to_recv)
+        self.fill(n)
+        result = bytes(self.rbuf[:n])
+        del self.rbuf[:n]
+        return result
+
+    def fill(self, n: int) -> None:
+        """Keep waiting until at least `n` bytes are in the receive buffer."""
+        while len(self.rbuf) < n:
+            tmp = self.s.recv(max(n - len(self.rbuf),
+                                  VLPSocket.RECV_CHUNK_SIZE))
             assert tmp
-            to_recv -= len(tmp)
-            result.append(tmp)
-
-        return b"".join(result)
+            self.rbuf += tmp
 
-    def settimeout(self, value: int) -> None:
-        """Set this socket timeout value."""
-        self.s.settimeout(value)
+    def settimeout(self, value: Optional[float]) -> None:
+        """Set this socket timeout value (None for no timeout)."""
+        self.s.settimeout(VLPSocket.NO_TIMEOUT if value is None else value)
 
     def close(self) -> None:
         """Close this socket."""
         self.s.close()
+        delay_scheduler.wake()  # to close the socket's sender
         if vlpstate.remove_socket(self.s):
             if event_q:
                 event_q.put((Event.CLOSE_SOCKET, self.virt_loc,
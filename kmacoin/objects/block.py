@@ -29,6 +29,9 @@ class Block(object):
     TX_COUNT_FSZ = 2
     ID_FSZ = PREV_ID_FSZ
 
+    # Size of the fields before the transactions of a serialized block:
+    HEADER_SIZE = TIMESTAMP_FSZ + NONCE_FSZ + PREV_ID_FSZ + TX_COUNT_FSZ
+
     # Deduced limits:
     MAX_TXS = 2 ** (8*TX_COUNT_FSZ) - 1
 
@@ -95,6 +98,15 @@ class Block(object):
         """Write this block to a bytestream."""
         w.write(self.to_bytes())
 
+    @staticmethod
+    def get_tx_count(header: bytes) -> int:
+        """Return the number of transactions of a serialized block, given its
+        first `HEADER_SIZE` bytes."""
+        return int.from_bytes(
+            header[Block.HEADER_SIZE - Block.TX_COUNT_FSZ:Block.HEADER_SIZE],
+            "big"
+        )
+
     @staticmethod
     def read_from(r: BinaryIO) -> 'Block':
         """Read a block from a bytestream."""
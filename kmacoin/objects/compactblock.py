@@ -0,0 +1,122 @@
+from kmacoin.objects.transaction import Transaction
+from kmacoin.objects.block import Block
+
+from typing import List, Dict, Optional, BinaryIO
+
+import hashlib
+
+
+class CompactBlock(object):
+    """
+    This class represents a compact block: a block whose transactions, except
+    the first (reward) one, are replaced with short IDs.
+
+    A short ID is a salted hash of a transaction ID. A receiver rebuilds the
+    block from the transactions it already has, then asks for the missing
+    ones.
+
+    Attributes:
+        timestamp: the block's timestamp.
+        nonce: the block's nonce.
+        prev_id: the previous block's ID.
+        salt: the salt of the short IDs.
+        reward_tx: the block's first transaction.
+        short_ids: short IDs of the block's other transactions.
+
+    """
+    short_ids: List[bytes]
+
+    # All field sizes (the others are the same as a block's):
+    SALT_FSZ = 8
+    SHORT_ID_FSZ = 6
+
+    def __init__(self, timestamp: int, nonce: bytes, prev_id: bytes,
+                 salt: bytes, reward_tx: Transaction, short_ids: List[bytes]):
+        self.timestamp = timestamp
+        self.nonce = nonce
+        self.prev_id = prev_id
+        self.salt = salt
+        self.reward_tx = reward_tx
+        self.short_ids = short_ids
+
+    @staticmethod
+    def from_block(block: Block, salt: bytes) -> 'CompactBlock':
+        """Make a compact block from a block, whose first transaction is
+        kept."""
+        return CompactBlock(
+            block.timestamp, block.nonce, block.prev_id, salt, block.txs[0],
+            [CompactBlock.get_short_id(salt, tx.get_id())
+             for tx in block.txs[1:]]
+        )
+
+    @staticmethod
+    def get_short_id(salt: bytes, tx_id: bytes) -> bytes:
+        """Return the short ID of a transaction."""
+        return hashlib.blake2b(tx_id, digest_size=CompactBlock.SHORT_ID_FSZ,
+                               key=salt).digest()
+
+    def get_tx_count(self) -> int:
+        """Return the number of the block's transactions."""
+        return len(self.short_ids) + 1
+
+    def match(self, txs: Dict[bytes, Transaction]) \
+            -> List[Optional[Transaction]]:
+        """
+        Find the block's transactions.
+
+        Args:
+            txs: transaction ID -> transaction, of the known transactions.
+
+        Returns:
+            The block's transactions, None for the ones not found. A short ID
+            matching several transactions is not found.
+
+        """
+        # short ID -> transaction, None if ambiguous
+        candidates: Dict[bytes, Optional[Transaction]] = {}
+        for tx_id, tx in txs.items():
+            short_id = CompactBlock.get_short_id(self.salt, tx_id)
+            candidates[short_id] = None if short_id in candidates else tx
+
+        return [self.reward_tx] + [candidates.get(short_id)
+                                   for short_id in self.short_ids]
+
+    def to_block(self, txs: List[Transaction]) -> Block:
+        """Rebuild the block, given all its transactions."""
+        assert len(txs) == self.get_tx_count()
+        block = Block(self.prev_id)
+        block.timestamp = self.timestamp
+        block.nonce = self.nonce
+        block.txs = txs
+        return block
+
+    def to_bytes(self) -> bytes:
+        """Serialize this compact block."""
+        return (
+            self.timestamp.to_bytes(Block.TIMESTAMP_FSZ, "big") +
+            self.nonce +
+            self.prev_id +
+            self.get_tx_count().to_bytes(Block.TX_COUNT_FSZ, "big") +
+            self.salt +
+            self.reward_tx.to_bytes() +
+            b"".join(self.short_ids)
+        )
+
+    @staticmethod
+    def read_from(r: BinaryIO) -> 'CompactBlock':
+        """Read a compact block from a bytestream."""
+
+        # get block's metadata
+        timestamp = int.from_bytes(r.read(Block.TIMESTAMP_FSZ), "big")
+        nonce = r.read(Block.NONCE_FSZ)
+        prev_id = r.read(Block.PREV_ID_FSZ)
+        tx_count = int.from_bytes(r.read(Block.TX_COUNT_FSZ), "big")
+        salt = r.read(CompactBlock.SALT_FSZ)
+
+        # get the reward transaction and the others' short IDs
+        reward_tx = Transaction.read_from(r)
+        short_ids = [r.read(CompactBlock.SHORT_ID_FSZ)
+                     for _ in range(tx_count - 1)]
+
+        return CompactBlock(timestamp, nonce, prev_id, salt, reward_tx,
+                            short_ids)
@@ -26,6 +26,9 @@ class Transaction(object):
     COIN_FSZ = Coin.SIZE
     SIG_FSZ = SIGNATURE_SIZE
 
+    # Size of the counts at the beginning of a serialized transaction:
+    HEADER_SIZE = INPUT_COUNT_FSZ + OUTPUT_COUNT_FSZ + SIG_COUNT_FSZ
+
     # Deduced limits:
     MAX_INPUTS = 2 ** (8*INPUT_COUNT_FSZ) - 1
     MAX_OUTPUTS = 2 ** (8*OUTPUT_COUNT_FSZ) - 1
@@ -83,6 +86,20 @@ class Transaction(object):
         """Write this transaction to a bytestream."""
         w.write(self.to_bytes())
 
+    @staticmethod
+    def get_size(header: bytes) -> int:
+        """Return the size of a serialized transaction, given its first
+        `HEADER_SIZE` bytes."""
+        ic = header[0]
+        oc = header[Transaction.INPUT_COUNT_FSZ]
+        sc = header[Transaction.INPUT_COUNT_FSZ + Transaction.OUTPUT_COUNT_FSZ]
+        return (
+            Transaction.HEADER_SIZE +
+            ic * (Transaction.TX_ID_FSZ + Transaction.SEQ_FSZ) +
+            oc * Transaction.COIN_FSZ +
+            sc * Transaction.SIG_FSZ
+        )
+
     @staticmethod
     def read_from(r: BinaryIO) -> 'Transaction':
         """Read a transaction from a bytestream."""
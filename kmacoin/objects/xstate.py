@@ -59,12 +59,15 @@ class ExtendedState(State):
         self.latest_timestamp = 0
         self.last_threshold_update = None
 
-    def process_block(self, block: Block) -> None:
+    def process_block(self, block: Block, backup: bool = True) -> None:
         """
         Process a block and let this state transit.
 
         Args:
             block: the block to be processed.
+            backup: if False, the coins are not backed up before the block's
+                transactions are processed. This is faster, but the state
+                must be dropped when the block is invalid.
 
         Raises:
             BlockError: when the block is invalid
@@ -97,7 +100,7 @@ class ExtendedState(State):
             )
 
         # backup current coins
-        coins_bk = copy.deepcopy(self.coins)
+        coins_bk = copy.deepcopy(self.coins) if backup else None
 
         # check each transaction
         total_fee = 0
@@ -109,7 +112,8 @@ class ExtendedState(State):
                     check_balance=(False if i == 0 else True)
                 )
             except TransactionError as err:
-                self.coins = coins_bk
+                if backup:
+                    self.coins = coins_bk
                 raise BlockError(
                     "Invalid transaction!",
                     BlockError.INVALID_TX,
@@ -120,7 +124,8 @@ class ExtendedState(State):
 
         # check balance
         if total_fee + self.reward != 0:
-            self.coins = coins_bk
+            if backup:
+                self.coins = coins_bk
             raise BlockError(
                 "Block is unbalanced!",
                 BlockError.UNBALANCE,
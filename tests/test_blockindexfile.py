@@ -0,0 +1,124 @@
+from kmacoin.globaldef.hash import HASH_OF_NULL
+from kmacoin.objects.coin import Coin
+from kmacoin.objects.xstate import ExtendedState
+from kmacoin.atnode.node import Node
+from kmacoin.atnode.structures.blockindexfile import BlockIndexFile
+from kmacoin.atnode.structures.blocktree import BlockTree
+from kmacoin.atnode.structures.statefile import StateFile
+
+from types import SimpleNamespace
+
+import os
+import tempfile
+import unittest
+
+
+class FileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.dir = tmp_dir.name
+
+
+class BlockIndexFileTest(FileTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.file = BlockIndexFile(os.path.join(self.dir, "index.data"))
+        block_ids = [HASH_OF_NULL] + [os.urandom(32) for _ in range(5)]
+        self.records = [
+            (block_ids[i + 1], block_ids[i], i + 1, BlockIndexFile.VALID)
+            for i in range(5)
+        ]
+        self.records.append((block_ids[2], HASH_OF_NULL, 0,
+                             BlockIndexFile.PRUNED))
+
+    def test_round_trip(self):
+        self.assertFalse(self.file.exists())
+        self.file.append(self.records[:3])
+        self.file.append(self.records[3:])
+        self.assertTrue(self.file.exists())
+        self.assertEqual(list(self.file.read()), self.records)
+
+    def test_truncated_record_ignored(self):
+        self.file.append(self.records)
+        with open(self.file.path, "ab") as f:
+            f.write(os.urandom(BlockIndexFile.RECORD_SIZE - 1))
+        self.assertEqual(list(self.file.read()), self.records)
+
+
+class StateFileTest(FileTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.file = StateFile(os.path.join(self.dir, "state.data"))
+
+        self.state = ExtendedState()
+        self.state.latest_id = os.urandom(32)
+        self.state.age = 1234
+        self.state.reward = 5000
+        self.state.threshold = os.urandom(32)
+        self.state.latest_timestamp = 1600000000
+        for i in range(10):
+            self.state.coins[(os.urandom(32), i)] = Coin(
+                os.urandom(Coin.OWNER_FSZ), (i + 1) * 100)
+        self.state.coins[(os.urandom(32), 0)] = Coin(
+            os.urandom(Coin.OWNER_FSZ), Coin.MAX_VALUE - 1)
+
+    def assertStateEqual(self, state: ExtendedState,
+                         expected: ExtendedState) -> None:
+        for attr in ("latest_id", "age", "reward", "threshold",
+                     "latest_timestamp", "last_threshold_update"):
+            self.assertEqual(getattr(state, attr), getattr(expected, attr))
+        self.assertEqual(
+            {coin_id: coin.to_bytes() for coin_id, coin in
+             state.coins.items()},
+            {coin_id: coin.to_bytes() for coin_id, coin in
+             expected.coins.items()})
+
+    def test_round_trip(self):
+        self.assertFalse(self.file.exists())
+        for last_update in (None, 1599999000):
+            self.state.last_threshold_update = last_update
+            self.file.write(self.state)
+            self.assertStateEqual(self.file.read(), self.state)
+
+    def test_empty_state(self):
+        self.file.write(ExtendedState())
+        self.assertStateEqual(self.file.read(), ExtendedState())
+
+    def test_truncated_file(self):
+        self.file.write(self.state)
+        with open(self.file.path, "rb+") as f:
+            f.truncate(os.path.getsize(self.file.path) - 1)
+        with self.assertRaises(AssertionError):
+            self.file.read()
+
+    def test_read_top_state(self):
+        tree = BlockTree()
+        prev_id = HASH_OF_NULL
+        for _ in range(3):
+            block_id = os.urandom(32)
+            tree.add(block_id, prev_id)
+            prev_id = block_id
+
+        node = SimpleNamespace(block_tree=tree, top_state_file=self.file)
+        self.assertIsNone(Node.read_top_state(node))
+
+        self.state.latest_id, self.state.age = prev_id, 3
+        self.file.write(self.state)
+        self.assertStateEqual(Node.read_top_state(node), self.state)
+
+        # a state not matching the block index is not used
+        self.state.age = 2
+        self.file.write(self.state)
+        self.assertIsNone(Node.read_top_state(node))
+
+        self.state.latest_id, self.state.age = os.urandom(32), 3
+        self.file.write(self.state)
+        self.assertIsNone(Node.read_top_state(node))
+
+
+if __name__ == "__main__":
+    unittest.main()
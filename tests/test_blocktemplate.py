@@ -0,0 +1,84 @@
+from kmacoin.globaldef.signature import generate_key, \
+    public_key_to_bytes, sign
+from kmacoin.objects.coin import Coin
+from kmacoin.objects.transaction import Transaction
+from kmacoin.objects.xstate import ExtendedState
+from kmacoin.atnode.structures.mempool import Mempool
+
+from typing import List, Tuple
+
+import unittest
+
+
+class TemplateBuilderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.private_key, public_key = generate_key()
+        self.owner = public_key_to_bytes(public_key)
+
+        # 5 funded coins of 1000
+        state = ExtendedState()
+        for i in range(5):
+            state.coins[(bytes([i]) * 32, 0)] = Coin(self.owner, 1000)
+        self.mempool = Mempool(1000000, state)
+
+    def make_transaction(self, input_ids: List[Tuple[bytes, int]],
+                         values: List[int]) -> Transaction:
+        """Return a signed transaction of the owner's coins."""
+        tx = Transaction(input_ids,
+                         [Coin(self.owner, value) for value in values])
+        tx.add_signature(sign(self.private_key, tx.get_signed_data()))
+        return tx
+
+    def funded(self, i: int, fee: int) -> Transaction:
+        """Return a transaction spending the i-th funded coin."""
+        return self.make_transaction([(bytes([i]) * 32, 0)], [1000 - fee])
+
+    def get_template_txs(self) -> List[Transaction]:
+        return self.mempool.get_template().txs
+
+    def test_package_pulls_in_parent(self):
+        parent = self.funded(0, 0)
+        child = self.make_transaction([(parent.get_id(), 0)], [900])
+        other = self.funded(1, 10)
+        for tx in (other, parent, child):
+            self.mempool.add(tx)
+
+        # the package (parent, child) pays more per byte than `other`
+        self.assertEqual(self.get_template_txs(), [parent, child, other])
+        self.assertEqual(self.mempool.get_template().fee, 110)
+
+    def test_new_transaction_replaces_worst_leaf(self):
+        self.mempool.template_builder.max_count = 2
+        low, high = self.funded(0, 10), self.funded(1, 100)
+        self.mempool.add(low)
+        self.mempool.add(high)
+        self.get_template_txs()
+
+        better = self.funded(2, 50)
+        self.mempool.add(better)
+        self.assertEqual(set(self.get_template_txs()), {high, better})
+
+        # a worse transaction is left out
+        self.mempool.add(self.funded(3, 20))
+        self.assertEqual(set(self.get_template_txs()), {high, better})
+
+    def test_parent_of_new_transaction_is_not_replaced(self):
+        self.mempool.template_builder.max_count = 2
+        a, b = self.funded(0, 10), self.funded(1, 100)
+        self.mempool.add(a)
+        self.mempool.add(b)
+        self.get_template_txs()
+
+        # `a` is the worst leaf, but `c` can't be mined without it
+        c = self.make_transaction([(a.get_id(), 0)], [790])
+        self.mempool.add(c)
+        self.assertEqual(self.get_template_txs(), [a, c])
+
+        # as a rebuilt template
+        self.mempool.template_builder.invalidate()
+        self.assertEqual(self.get_template_txs(), [a, c])
+
+
+if __name__ == "__main__":
+    unittest.main()
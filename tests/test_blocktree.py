@@ -0,0 +1,157 @@
+from kmacoin.globaldef.hash import HASH_OF_NULL
+from kmacoin.atnode.structures.blocktree import BlockTree, get_skip_height
+
+from typing import List
+
+import os
+import random
+import unittest
+
+
+class BlockTreeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = BlockTree()
+
+    def add_chain(self, prev_id: bytes, count: int) -> List[bytes]:
+        """Add a chain of blocks after a block, and return their IDs."""
+        block_ids = []
+        for _ in range(count):
+            block_id = os.urandom(32)
+            self.tree.add(block_id, prev_id)
+            block_ids.append(block_id)
+            prev_id = block_id
+        return block_ids
+
+
+class BlockTreeAddTest(BlockTreeTestCase):
+
+    def test_linear_chain(self):
+        chain = self.add_chain(HASH_OF_NULL, 100)
+        self.assertEqual(self.tree.main_chain, [HASH_OF_NULL] + chain)
+        self.assertEqual(self.tree.get_height(), 100)
+        self.assertEqual(self.tree.get_top_block(), chain[-1])
+        self.assertEqual(self.tree.get_block_height(chain[41]), 42)
+        self.assertEqual(self.tree.leaves, {chain[-1]})
+        self.assertEqual(list(self.tree.traverse()), [HASH_OF_NULL] + chain)
+
+    def test_side_branch_takes_over(self):
+        main = self.add_chain(HASH_OF_NULL, 10)
+        side = self.add_chain(main[4], 5)
+
+        # as long, the first branch stays the main one
+        self.assertEqual(self.tree.get_top_block(), main[-1])
+        self.assertFalse(self.tree.is_on_main_chain(side[0]))
+        self.assertEqual(self.tree.leaves, {main[-1], side[-1]})
+
+        side += self.add_chain(side[-1], 1)
+        self.assertEqual(self.tree.main_chain,
+                         [HASH_OF_NULL] + main[:5] + side)
+        self.assertTrue(self.tree.is_on_main_chain(main[4]))
+        self.assertFalse(self.tree.is_on_main_chain(main[5]))
+
+    def test_block_after_side_branch(self):
+        main = self.add_chain(HASH_OF_NULL, 3)
+        side = self.add_chain(main[0], 2)
+        self.assertEqual(self.tree.entries[main[0]].child_count, 2)
+        self.assertEqual(list(self.tree.get_path(side[-1])),
+                         [HASH_OF_NULL, main[0]] + side)
+
+
+class BlockTreeAncestorTest(BlockTreeTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        # a random tree of 2000 blocks, forking every now and then
+        self.random = random.Random(0)
+        block_ids = [HASH_OF_NULL]
+        for _ in range(2000):
+            if self.random.random() < 0.05:
+                prev_id = self.random.choice(block_ids)
+            else:
+                prev_id = block_ids[-1]
+            block_ids += self.add_chain(prev_id, 1)
+        self.block_ids = block_ids
+
+    def get_path(self, block_id: bytes) -> List[bytes]:
+        """Return the IDs from the root block to a block, by parents."""
+        path = []
+        entry = self.tree.entries[block_id]
+        while entry is not None:
+            path.append(entry.block_id)
+            entry = entry.parent
+        path.reverse()
+        return path
+
+    def test_skip_heights(self):
+        for height in range(1, 5000):
+            self.assertLess(get_skip_height(height), height)
+        for block_id in self.block_ids[1:]:
+            entry = self.tree.entries[block_id]
+            self.assertEqual(entry.skip.height, get_skip_height(entry.height))
+
+    def test_get_ancestor(self):
+        for block_id in self.random.sample(self.block_ids, 100):
+            path = self.get_path(block_id)
+            for height in self.random.sample(range(len(path)),
+                                        min(len(path), 20)):
+                self.assertEqual(self.tree.get_ancestor(block_id, height),
+                                 path[height])
+            self.assertIsNone(self.tree.get_ancestor(block_id, len(path)))
+
+    def test_find_fork(self):
+        for _ in range(300):
+            block_id1, block_id2 = self.random.sample(self.block_ids, 2)
+            path1, path2 = self.get_path(block_id1), self.get_path(block_id2)
+            common = [a for a, b in zip(path1, path2) if a == b]
+            self.assertEqual(self.tree.find_fork(block_id1, block_id2),
+                             common[-1])
+            self.assertEqual(self.tree.find_fork(block_id2, block_id1),
+                             common[-1])
+
+        self.assertEqual(self.tree.find_fork(self.block_ids[5],
+                                             self.block_ids[5]),
+                         self.block_ids[5])
+
+    def test_get_path_between(self):
+        block_id1, block_id2 = self.block_ids[700], self.block_ids[-1]
+        fork = self.tree.find_fork(block_id1, block_id2)
+        to_disconnect, to_connect = self.tree.get_path_between(block_id1,
+                                                               block_id2)
+        path1, path2 = self.get_path(block_id1), self.get_path(block_id2)
+        self.assertEqual(to_disconnect,
+                         path1[path1.index(fork) + 1:][::-1])
+        self.assertEqual(to_connect, path2[path2.index(fork) + 1:])
+
+
+class BlockTreePruneTest(BlockTreeTestCase):
+
+    def test_prune(self):
+        main = self.add_chain(HASH_OF_NULL, 20)
+        old = self.add_chain(main[2], 3)  # forked at height 3
+        shared = self.add_chain(main[5], 2)  # forked at height 6
+        shared_leaf = self.add_chain(shared[0], 1)
+        recent = self.add_chain(main[15], 2)  # forked at height 16
+        size = len(self.tree.entries)
+
+        removed = self.tree.prune(10)  # the top block is at height 20
+        self.assertEqual(set(removed), set(old + shared + shared_leaf))
+        self.assertEqual(len(self.tree.entries), size - len(removed))
+        self.assertEqual(self.tree.leaves, {main[-1], recent[-1]})
+        self.assertEqual(self.tree.entries[main[2]].child_count, 1)
+        self.assertEqual(self.tree.entries[main[5]].child_count, 1)
+        self.assertEqual(self.tree.main_chain, [HASH_OF_NULL] + main)
+
+        # a block of a pruned branch can't be added anymore
+        with self.assertRaises(KeyError):
+            self.tree.add(os.urandom(32), old[-1])
+
+    def test_prune_keeps_main_chain(self):
+        main = self.add_chain(HASH_OF_NULL, 20)
+        self.assertEqual(self.tree.prune(0), [])
+        self.assertEqual(self.tree.main_chain, [HASH_OF_NULL] + main)
+
+
+if __name__ == "__main__":
+    unittest.main()
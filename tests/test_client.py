@@ -0,0 +1,54 @@
+from kmacoin.atnode.workers.client import Client
+
+from queue import Queue
+from types import SimpleNamespace
+
+import asyncio
+import threading
+import unittest
+
+
+class FailingSocket(object):
+    """A socket whose connection is lost."""
+
+    async def drain(self) -> None:
+        raise ConnectionResetError()
+
+    def close(self) -> None:
+        pass
+
+
+class ClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.node = SimpleNamespace(
+            loop=self.loop,
+            peer_queue_size=100,
+            max_peer_lag=60,
+            min_peers=0,
+            client_cmd_queues_cv=threading.Condition(),
+            client_cmd_queues=set(),
+            peers_smp=threading.Semaphore(2),
+            remove_connected_address=lambda addr: None,
+            verbose=False
+        )
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_queued_request_released_when_disconnected_first(self):
+        async def run():
+            client = Client(self.node, FailingSocket(), None,
+                            SimpleNamespace())
+            client.cmd_queue.put([Client.CMD_REQ_BLOCK, b"", q])
+            await client.run()
+
+        q = Queue()
+        self.loop.run_until_complete(run())
+        self.assertIsNone(q.get_nowait())
+        self.assertEqual(self.node.client_cmd_queues, set())
+
+
+if __name__ == "__main__":
+    unittest.main()
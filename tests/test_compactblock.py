@@ -0,0 +1,50 @@
+from kmacoin.objects.block import Block
+from kmacoin.objects.compactblock import CompactBlock
+from kmacoin.objects.transaction import Transaction
+from kmacoin.objects.xstate import ExtendedState
+from kmacoin.atnode.structures.mempool import Mempool
+from kmacoin.atnode.structures.orphanpool import OrphanPool
+from kmacoin.atnode.workers.server import Server, XObject
+
+from types import SimpleNamespace
+
+import io
+import os
+import unittest
+
+
+def random_transaction() -> Transaction:
+    """Return a transaction with 1 random input, output and signature."""
+    return Transaction.read_from(io.BytesIO(
+        bytes([1, 1, 1]) +
+        os.urandom(Transaction.TX_ID_FSZ) + b"\x00" +
+        os.urandom(Transaction.COIN_FSZ + Transaction.SIG_FSZ)
+    ))
+
+
+class CompactBlockTest(unittest.TestCase):
+
+    def test_rebuild_from_orphaned_transaction(self):
+        block = Block(os.urandom(Block.PREV_ID_FSZ))
+        block.set_nonce(os.urandom(Block.NONCE_FSZ))
+        block.add_transaction(random_transaction())  # the reward
+        orphan = random_transaction()
+        block.add_transaction(orphan)
+
+        # the orphan is kept wrapped, as the transaction processor does
+        node = SimpleNamespace(
+            mempool=Mempool(1000000, ExtendedState()),
+            orphan_tx_pool=OrphanPool(10, 10, 600)
+        )
+        node.orphan_tx_pool.add(XObject(orphan), None)
+
+        cblock = CompactBlock.from_block(
+            block, os.urandom(CompactBlock.SALT_FSZ))
+        txs = Server(node, None, False, False).match_transactions(cblock)
+
+        self.assertIs(txs[1], orphan)
+        self.assertEqual(cblock.to_block(txs).to_bytes(), block.to_bytes())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,28 @@
+from kmacoin.atnode.workers.miners.doublespender import DoubleSpender
+from tests.test_mempool import MempoolTestCase
+
+import unittest
+
+
+class SelectTransactionsTest(MempoolTestCase):
+
+    def test_only_transactions_valid_on_the_branch(self):
+        on_branch = self.funded(0, 10)
+        child = self.make_transaction([(on_branch.get_id(), 0)], [980])
+        off_branch = self.funded(1, 10)
+        off_child = self.make_transaction([(off_branch.get_id(), 0)], [980])
+
+        # the private branch has not got the 2nd coin
+        branch_state = self.state
+        del branch_state.coins[(bytes([1]) * 32, 0)]
+        coins = dict(branch_state.coins)
+
+        txs, fee = DoubleSpender.select_transactions(
+            branch_state, [on_branch, off_branch, child, off_child])
+        self.assertEqual(txs, [on_branch, child])
+        self.assertEqual(fee, 20)
+        self.assertEqual(branch_state.coins, coins)
+
+
+if __name__ == "__main__":
+    unittest.main()
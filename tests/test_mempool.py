@@ -0,0 +1,219 @@
+from kmacoin.globaldef.signature import generate_key, \
+    public_key_to_bytes, sign
+from kmacoin.objects.block import Block
+from kmacoin.objects.coin import Coin
+from kmacoin.objects.state import TransactionError
+from kmacoin.objects.transaction import Transaction
+from kmacoin.objects.xstate import ExtendedState
+from kmacoin.atnode.node import Node
+from kmacoin.atnode.structures.mempool import Mempool, MempoolError
+
+from types import SimpleNamespace
+from typing import List, Tuple
+
+import copy
+import os
+import unittest
+
+
+class MempoolTestCase(unittest.TestCase):
+    """A mempool on a state with 5 funded coins of 1000."""
+
+    def setUp(self):
+        self.private_key, public_key = generate_key()
+        self.owner = public_key_to_bytes(public_key)
+
+        self.state = ExtendedState()
+        for i in range(5):
+            self.state.coins[(bytes([i]) * 32, 0)] = Coin(self.owner, 1000)
+        self.mempool = Mempool(1000000, self.state)
+
+    def make_transaction(self, input_ids: List[Tuple[bytes, int]],
+                         values: List[int]) -> Transaction:
+        """Return a signed transaction of the owner's coins."""
+        tx = Transaction(input_ids,
+                         [Coin(self.owner, value) for value in values])
+        tx.add_signature(sign(self.private_key, tx.get_signed_data()))
+        return tx
+
+    def funded(self, i: int, fee: int) -> Transaction:
+        """Return a transaction spending the i-th funded coin."""
+        return self.make_transaction([(bytes([i]) * 32, 0)], [1000 - fee])
+
+    def make_block(self, txs: List[Transaction]) -> Block:
+        """Return a block of some transactions on the mempool's tip."""
+        block = Block(self.mempool.get_tip())
+        block.set_nonce(os.urandom(Block.NONCE_FSZ))
+        block.add_transaction(Transaction([], [Coin(self.owner, 100)]))
+        for tx in txs:
+            block.add_transaction(tx)
+        return block
+
+
+class MempoolTest(MempoolTestCase):
+
+    def test_add(self):
+        parent = self.funded(0, 10)
+        child = self.make_transaction([(parent.get_id(), 0)], [980])
+        self.assertEqual(self.mempool.add(parent), 10)
+        self.assertEqual(self.mempool.add(child), 10)
+
+        self.assertEqual(len(self.mempool), 2)
+        self.assertEqual(self.mempool.entries[child.get_id()].parents,
+                         {parent.get_id()})
+        self.assertEqual(self.mempool.entries[parent.get_id()].children,
+                         {child.get_id()})
+        self.assertNotIn((parent.get_id(), 0), self.mempool.state.coins)
+        self.assertIn((child.get_id(), 0), self.mempool.state.coins)
+
+    def test_rejected_transactions(self):
+        tx = self.funded(0, 10)
+        self.mempool.add(tx)
+
+        with self.assertRaises(MempoolError) as cm:
+            self.mempool.add(tx)
+        self.assertEqual(cm.exception.code, MempoolError.ALREADY_IN_POOL)
+
+        with self.assertRaises(MempoolError) as cm:
+            self.mempool.add(self.funded(0, 20))
+        self.assertEqual(cm.exception.code, MempoolError.CONFLICT)
+
+        with self.assertRaises(TransactionError):
+            self.mempool.add(self.make_transaction(
+                [(bytes([9]) * 32, 0)], [1]))
+        self.assertEqual(len(self.mempool), 1)
+
+    def test_eviction_by_fee_rate(self):
+        txs = [self.funded(i, 10 * (i + 1)) for i in range(3)]
+        self.mempool.max_size = 2 * len(txs[0].to_bytes())  # 2 fit
+        self.mempool.add(txs[0])
+        self.mempool.add(txs[1])
+
+        # the worst transaction is evicted for a better one
+        self.mempool.add(txs[2])
+        self.assertFalse(self.mempool.has_transaction(txs[0].get_id()))
+        self.assertIn((bytes([0]) * 32, 0), self.mempool.state.coins)
+
+        # a worse one is rejected
+        with self.assertRaises(MempoolError) as cm:
+            self.mempool.add(self.funded(3, 5))
+        self.assertEqual(cm.exception.code, MempoolError.POOL_FULL)
+        self.assertEqual(len(self.mempool), 2)
+
+    def test_remove_with_descendants(self):
+        parent = self.funded(0, 10)
+        child = self.make_transaction([(parent.get_id(), 0)], [980])
+        grandchild = self.make_transaction([(child.get_id(), 0)], [970])
+        other = self.funded(1, 10)
+        for tx in (parent, child, grandchild, other):
+            self.mempool.add(tx)
+
+        self.mempool._remove(parent.get_id())
+        self.assertEqual(list(self.mempool.entries), [other.get_id()])
+        self.assertEqual(self.mempool.spenders,
+                         {(bytes([1]) * 32, 0): other.get_id()})
+        self.assertIn((bytes([0]) * 32, 0), self.mempool.state.coins)
+        self.assertNotIn((child.get_id(), 0), self.mempool.state.coins)
+
+
+class MempoolBlockTest(MempoolTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.initial_state = copy.deepcopy(self.state)
+        self.parent = self.funded(0, 10)
+        self.child = self.make_transaction([(self.parent.get_id(), 0)],
+                                           [980])
+        self.loser = self.funded(1, 10)
+        for tx in (self.parent, self.child, self.loser):
+            self.mempool.add(tx)
+
+        # confirms `parent`, and double-spends `loser`'s input
+        self.winner = self.funded(1, 20)
+        self.block = self.make_block([self.parent, self.winner])
+
+    def test_connect_block(self):
+        self.mempool.connect_block(self.block)
+
+        self.assertEqual(self.mempool.get_tip(), self.block.get_id())
+        self.assertEqual(list(self.mempool.entries), [self.child.get_id()])
+        self.assertEqual(self.mempool.entries[self.child.get_id()].parents,
+                         set())
+        coins = self.mempool.state.coins
+        self.assertIn((self.block.txs[0].get_id(), 0), coins)
+        self.assertIn((self.winner.get_id(), 0), coins)
+        self.assertNotIn((self.loser.get_id(), 0), coins)
+
+        # a block not on the tip is refused
+        with self.assertRaises(AssertionError):
+            self.mempool.connect_block(self.block)
+
+    def test_disconnect_block(self):
+        self.mempool.connect_block(self.block)
+        reward_spender = self.make_transaction(
+            [(self.block.txs[0].get_id(), 0)], [100])
+        self.mempool.add(reward_spender)
+
+        self.mempool.disconnect_block(self.block.get_id())
+
+        # the block's transactions are back, before the older ones
+        self.assertEqual(self.mempool.get_tip(), self.initial_state.latest_id)
+        self.assertEqual(set(self.mempool.entries), {
+            self.parent.get_id(), self.child.get_id(), self.winner.get_id()})
+        self.assertEqual(self.mempool.entries[self.child.get_id()].parents,
+                         {self.parent.get_id()})
+        self.assertLess(self.mempool.entries[self.winner.get_id()].seq,
+                        self.mempool.entries[self.child.get_id()].seq)
+
+        # the reward and its spender are gone
+        coins = self.mempool.state.coins
+        self.assertNotIn((self.block.txs[0].get_id(), 0), coins)
+        self.assertNotIn((reward_spender.get_id(), 0), coins)
+
+        # the coins are the initial ones, with the transactions applied
+        state = copy.deepcopy(self.initial_state)
+        for tx in (self.parent, self.winner, self.child):
+            state.process_transaction(tx)
+        self.assertEqual(set(coins), set(state.coins))
+
+    def test_disconnect_block_without_undo_record(self):
+        self.mempool.connect_block(self.block)
+        self.mempool.undo_records.clear()
+        with self.assertRaises(KeyError):
+            self.mempool.disconnect_block(self.block.get_id())
+
+    def test_update_mempool_without_block_file(self):
+        other = self.make_block([self.winner])
+        top = Block(other.get_id())
+        top.set_nonce(os.urandom(Block.NONCE_FSZ))
+        top.add_transaction(Transaction([], [Coin(self.owner, 200)]))
+
+        # the new branch's first block has no file
+        new_state = copy.deepcopy(self.initial_state)
+        for tx in other.txs + top.txs:
+            new_state.process_transaction(tx, check_balance=False)
+        new_state.latest_id = top.get_id()
+
+        def load_block(block_id: bytes) -> Block:
+            raise FileNotFoundError(block_id.hex())
+
+        node = SimpleNamespace(
+            mempool=self.mempool,
+            block_tree=SimpleNamespace(
+                get_path_between=lambda from_id, to_id: (
+                    [self.block.get_id()], [other.get_id(), top.get_id()])),
+            load_block=load_block,
+            get_state=lambda block_id: new_state
+        )
+        self.mempool.connect_block(self.block)
+        Node.update_mempool(node, top)
+
+        # the pool is rebased on the new top state, which confirms `winner`
+        self.assertIs(self.mempool.state, new_state)
+        self.assertEqual(self.mempool.get_tip(), top.get_id())
+        self.assertEqual(set(self.mempool.entries),
+                         {self.parent.get_id(), self.child.get_id()})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+from kmacoin.atnode.structures import orphanblockpool
+from kmacoin.atnode.structures.orphanblockpool import OrphanBlockPool
+
+from types import SimpleNamespace
+from typing import List
+from unittest import mock
+
+import os
+import unittest
+
+
+class StubBlock(object):
+    """A block with a random ID."""
+
+    def __init__(self, prev_id: bytes):
+        self.prev_id = prev_id
+        self.block_id = os.urandom(32)
+
+    def get_id(self) -> bytes:
+        return self.block_id
+
+
+def make_chain(prev_id: bytes, count: int) -> List[StubBlock]:
+    """Return a chain of blocks after a block."""
+    blocks = []
+    for _ in range(count):
+        blocks.append(StubBlock(prev_id))
+        prev_id = blocks[-1].get_id()
+    return blocks
+
+
+class OrphanBlockPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = OrphanBlockPool(max_size=5, expiry=600)
+        self.now = 1000.0
+        patcher = mock.patch.object(orphanblockpool, "time", SimpleNamespace(
+            time=lambda: self.now))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_missing_block_fetched_once_per_chain(self):
+        missing_id = os.urandom(32)
+        chain = make_chain(missing_id, 3)
+
+        # orphans arriving out of order all wait for the chain's root
+        self.assertEqual(self.pool.add(chain[2]), chain[1].get_id())
+        self.assertIsNone(self.pool.add(chain[2]))
+        self.assertEqual(self.pool.add(chain[0]), missing_id)
+        self.assertIsNone(self.pool.add(chain[1]))
+        self.assertEqual(self.pool.fetching, {chain[1].get_id(), missing_id})
+
+        self.pool.done_fetching(missing_id)
+        self.assertEqual(self.pool.fetching, {chain[1].get_id()})
+
+    def test_pop_branches(self):
+        root_id = os.urandom(32)
+        trunk = make_chain(root_id, 2)
+        branch1 = make_chain(trunk[-1].get_id(), 2)
+        branch2 = make_chain(trunk[-1].get_id(), 1)
+        for block in trunk + branch1 + branch2:
+            self.pool.add(block)
+
+        branches = self.pool.pop_branches(root_id)
+        self.assertEqual(
+            sorted([[block.get_id() for block in branch]
+                    for branch in branches], key=len),
+            [[block.get_id() for block in trunk + branch2],
+             [block.get_id() for block in trunk + branch1]])
+        self.assertEqual(len(self.pool), 0)
+        self.assertEqual(self.pool.waiting, {})
+
+    def test_oldest_dropped_when_full(self):
+        blocks = [make_chain(os.urandom(32), 1)[0] for _ in range(6)]
+        for block in blocks:
+            self.pool.add(block)
+        self.assertEqual(list(self.pool.orphans),
+                         [block.get_id() for block in blocks[1:]])
+        self.assertNotIn(blocks[0].prev_id, self.pool.waiting)
+
+    def test_expiry(self):
+        old, new = make_chain(os.urandom(32), 1) + \
+            make_chain(os.urandom(32), 1)
+        self.pool.add(old)
+        self.now += 300
+        self.pool.add(new)
+
+        self.now += 300
+        self.assertEqual(self.pool.pop_branches(old.prev_id), [])
+        self.assertEqual(list(self.pool.orphans), [new.get_id()])
+
+
+if __name__ == "__main__":
+    unittest.main()
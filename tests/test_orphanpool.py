@@ -0,0 +1,88 @@
+from kmacoin.objects.coin import Coin
+from kmacoin.objects.transaction import Transaction
+from kmacoin.atnode.structures import orphanpool
+from kmacoin.atnode.structures.orphanpool import OrphanPool
+from kmacoin.atnode.workers.server import XObject
+
+from types import SimpleNamespace
+from typing import List
+from unittest import mock
+
+import os
+import unittest
+
+
+def make_transaction(parents: List[Transaction] = ()) -> Transaction:
+    """Return an unsigned transaction spending the first coin of some
+    parents, or a random coin."""
+    input_ids = [(parent.get_id(), 0) for parent in parents] or \
+        [(os.urandom(Transaction.TX_ID_FSZ), 0)]
+    return Transaction(input_ids, [Coin(os.urandom(Coin.OWNER_FSZ), 1)])
+
+
+class OrphanPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = OrphanPool(max_size=3, max_per_peer=2, expiry=600)
+        self.now = 1000.0
+        patcher = mock.patch.object(orphanpool, "time", SimpleNamespace(
+            time=lambda: self.now))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pop_children(self):
+        parent, other = make_transaction(), make_transaction()
+        child1, child2 = make_transaction([parent]), make_transaction([parent])
+        unrelated = make_transaction([other])
+        for i, tx in enumerate((child1, unrelated, child2)):
+            self.assertTrue(self.pool.add(XObject(tx), i))
+            self.now += 1
+
+        released = self.pool.pop_children(parent)
+        self.assertEqual([xtx.obj for xtx in released], [child1, child2])
+        self.assertEqual(list(self.pool.get_transactions()),
+                         [unrelated.get_id()])
+        self.assertEqual(self.pool.pop_children(parent), [])
+        self.assertEqual(self.pool.waiting, {
+            (other.get_id(), 0): {unrelated.get_id()}})
+
+    def test_duplicates_and_peer_limit(self):
+        tx = make_transaction()
+        self.assertTrue(self.pool.add(XObject(tx), "a"))
+        self.assertFalse(self.pool.add(XObject(tx), "b"))
+
+        self.assertTrue(self.pool.add(XObject(make_transaction()), "a"))
+        self.assertFalse(self.pool.add(XObject(make_transaction()), "a"))
+        self.assertTrue(self.pool.add(XObject(make_transaction()), "b"))
+        self.assertEqual(self.pool.peer_counts, {"a": 2, "b": 1})
+
+        # released orphans don't count anymore
+        self.pool._remove(tx.get_id())
+        self.assertTrue(self.pool.add(XObject(make_transaction()), "a"))
+
+    def test_oldest_dropped_when_full(self):
+        txs = [make_transaction() for _ in range(4)]
+        for i, tx in enumerate(txs):
+            self.assertTrue(self.pool.add(XObject(tx), i))
+
+        self.assertEqual(list(self.pool.get_transactions()),
+                         [tx.get_id() for tx in txs[1:]])
+        self.assertNotIn(0, self.pool.peer_counts)
+        self.assertNotIn(txs[0].input_ids[0], self.pool.waiting)
+
+    def test_expiry(self):
+        parent = make_transaction()
+        old, new = make_transaction([parent]), make_transaction([parent])
+        self.pool.add(XObject(old), "a")
+        self.now += 300
+        self.pool.add(XObject(new), "a")
+
+        self.now += 300
+        self.assertEqual([xtx.obj for xtx in self.pool.pop_children(parent)],
+                         [new])
+        self.assertEqual(len(self.pool), 0)
+        self.assertEqual(self.pool.peer_counts, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+from kmacoin.network.aiokmasocket import AsyncKMASocket
+from kmacoin.network.peersession import PeerSession, SessionChannel
+from kmacoin.network.protocol import Protocol
+
+import asyncio
+import unittest
+
+
+class PipeSocket(AsyncKMASocket):
+    """One end of an in-memory connection."""
+
+    def __init__(self):
+        super().__init__((0, 0))
+        self.reader = asyncio.StreamReader()
+        self.version = Protocol.VERSION_SESSIONS
+        self.peer = None
+
+    def sendall(self, data: bytes) -> None:
+        self.peer.reader.feed_data(data)
+
+    async def drain(self) -> None:
+        pass
+
+    def close(self) -> None:
+        if not self.peer.reader.at_eof():
+            self.peer.reader.feed_eof()
+
+
+class PeerSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(asyncio.set_event_loop, None)
+
+        s1, s2 = PipeSocket(), PipeSocket()
+        s1.peer, s2.peer = s2, s1
+        self.dialer = PeerSession(s1, dialed=True)
+        self.listener = PeerSession(s2, dialed=False)
+
+    def run_sessions(self, coro):
+        """Run a coroutine while both sessions read their frames."""
+        async def run():
+            self.dialer.start()
+            self.listener.start()
+            try:
+                return await asyncio.wait_for(coro, 5)
+            finally:
+                self.dialer.close()
+                self.listener.close()
+                await asyncio.gather(self.dialer.reader_task,
+                                     self.listener.reader_task)
+
+        return self.loop.run_until_complete(run())
+
+    def test_requests_routed_both_ways(self):
+        async def exchange(client: SessionChannel, server: SessionChannel,
+                           data: bytes) -> bytes:
+            client.send_message(Protocol.REQ_BLOCK, data)
+            self.assertEqual(await server.recv_message_type(),
+                             Protocol.REQ_BLOCK)
+            request = await server.recv_exact(len(data))
+            server.send_payload(Protocol.REQ_BLOCK, request[::-1])
+            await client.recv_payload(Protocol.REQ_BLOCK)
+            return await client.recv_exact(len(data))
+
+        async def run():
+            # both nodes' requests interleave on the connection
+            replies = await asyncio.gather(
+                exchange(self.dialer.client_channel,
+                         self.listener.server_channel, b"dialer"),
+                exchange(self.listener.client_channel,
+                         self.dialer.server_channel, b"listener"))
+            return replies, self.listener.server_channel.request_id, \
+                self.dialer.server_channel.request_id
+
+        replies, dialer_id, listener_id = self.run_sessions(run())
+        self.assertEqual(replies, [b"dialer"[::-1], b"listener"[::-1]])
+        self.assertEqual(dialer_id % 2, 1)
+        self.assertEqual(listener_id % 2, 0)
+
+    def test_unsolicited_reply_closes_session(self):
+        async def run():
+            self.listener.server_channel.request_id = 1
+            self.listener.server_channel.send_payload(Protocol.REQ_BLOCK,
+                                                      b"")
+            with self.assertRaises(AssertionError):
+                await self.dialer.client_channel.recv_message_type()
+
+        self.run_sessions(run())
+
+    def test_inbox_bounded(self):
+        async def run():
+            channel = self.listener.client_channel
+            payload = bytes(Protocol.MAX_FRAME_LENGTH)
+            for _ in range(SessionChannel.MAX_INBOX_SIZE //
+                           Protocol.MAX_FRAME_LENGTH + 1):
+                self.dialer.server_channel.send_payload(Protocol.REQ_BLOCK,
+                                                        payload)
+                channel.outstanding.append(0)
+
+            # the frames are not consumed -> the session is closed once the
+            # inbox is full
+            await self.listener.reader_task
+            fitting = SessionChannel.MAX_INBOX_SIZE // (
+                len(payload) + SessionChannel.FRAME_COST)
+            for _ in range(fitting):
+                await channel.recv_message_type()
+                await channel.recv_exact(len(payload))
+            with self.assertRaises(AssertionError):
+                await channel.recv_message_type()
+
+        self.run_sessions(run())
+
+
+class SessionChannelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(asyncio.set_event_loop, None)
+
+        s = PipeSocket()
+        s.peer = PipeSocket()
+        self.channel = PeerSession(s, dialed=True).client_channel
+
+    def test_outstanding_requests(self):
+        for _ in range(3):
+            self.channel.send_message(Protocol.REQ_BLOCK)
+        self.channel.send_message(Protocol.INF_ADDR)
+        self.assertEqual(list(self.channel.outstanding), [1, 3, 5])
+        self.assertEqual(self.channel.next_id, 9)
+
+        # a reply means the older requests are done with
+        self.channel.check_reply(3)
+        self.channel.check_reply(3)
+        self.assertEqual(list(self.channel.outstanding), [3, 5])
+        with self.assertRaises(AssertionError):
+            self.channel.check_reply(7)
+        self.assertEqual(list(self.channel.outstanding), [])
+
+    def test_request_ids_wrap_around(self):
+        self.channel.next_id = SessionChannel.REQUEST_ID_MODULUS - 1
+        self.channel.send_message(Protocol.REQ_BLOCK)
+        self.assertEqual(self.channel.request_id,
+                         SessionChannel.REQUEST_ID_MODULUS - 1)
+        self.assertEqual(self.channel.next_id, 1)
+
+    def test_inbox_size(self):
+        payload = bytes(Protocol.MAX_FRAME_LENGTH)
+        self.channel.put_frame(Protocol.REQ_BLOCK, 1, payload)
+        self.assertEqual(self.channel.inbox_size,
+                         len(payload) + SessionChannel.FRAME_COST)
+
+        async def recv():
+            await self.channel.recv_message_type()
+
+        self.loop.run_until_complete(recv())
+        self.assertEqual(self.channel.inbox_size, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+from kmacoin.atnode.structures.rollingfilter import RollingBloomFilter
+
+from typing import List
+
+import os
+import unittest
+
+
+class RollingBloomFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.filter = RollingBloomFilter(capacity=1000, fp_rate=0.001)
+
+    def test_add(self):
+        obj = os.urandom(32)
+        self.assertNotIn(obj, self.filter)
+        self.assertTrue(self.filter.add(obj))
+        self.assertIn(obj, self.filter)
+        self.assertFalse(self.filter.add(obj))
+
+    def add_random(self, count: int) -> List[bytes]:
+        """Add random IDs until `count` of them are actually added (not
+        taken for false positives), and return these."""
+        added = []
+        while len(added) < count:
+            obj = os.urandom(32)
+            if self.filter.add(obj):
+                added.append(obj)
+        return added
+
+    def test_latest_ids_remembered(self):
+        ids = []
+        for _ in range(10):
+            ids += self.add_random(500)
+
+            # at least the `capacity` latest IDs are still in
+            self.assertTrue(all(obj in self.filter for obj in ids[-1000:]))
+
+    def test_oldest_generation_forgotten(self):
+        ids = self.add_random(1500)
+        self.assertEqual(self.filter.count, 500)
+
+        # the next ID clears the generation holding the first 500 IDs
+        self.add_random(1)
+        forgotten = sum(obj not in self.filter for obj in ids[:500])
+        self.assertGreater(forgotten, 490)
+        self.assertTrue(all(obj in self.filter for obj in ids[500:]))
+
+    def test_false_positive_rate(self):
+        for _ in range(1000):
+            self.filter.add(os.urandom(32))
+        false_positives = sum(os.urandom(32) in self.filter
+                              for _ in range(20000))
+        self.assertLess(false_positives, 20000 * 0.001 * 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
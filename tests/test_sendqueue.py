@@ -0,0 +1,120 @@
+from kmacoin.atnode.structures import sendqueue
+from kmacoin.atnode.structures.sendqueue import SendQueue
+from kmacoin.atnode.workers.client import Client
+
+from types import SimpleNamespace
+from unittest import mock
+
+import asyncio
+import unittest
+
+
+class SendQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.queue = SendQueue(self.loop, max_size=3)
+
+        self.now = 1000.0
+        patcher = mock.patch.object(sendqueue, "time", SimpleNamespace(
+            monotonic=lambda: self.now))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_fifo(self):
+        for i in range(3):
+            self.queue.put(i)
+        self.assertEqual(len(self.queue), 3)
+        self.assertEqual(self.queue.peek_nowait(), 0)
+        self.assertEqual([self.queue.get_nowait() for _ in range(3)],
+                         [0, 1, 2])
+        with self.assertRaises(IndexError):
+            self.queue.get_nowait()
+
+    def test_droppable_items_bounded(self):
+        for i in range(5):
+            self.queue.put(i, droppable=True)
+        self.assertEqual(len(self.queue), 3)
+        self.assertEqual(self.queue.dropped, 2)
+
+        # other items are never dropped
+        self.queue.put("block")
+        self.assertEqual(len(self.queue), 4)
+        self.assertEqual(self.queue.peak_depth, 4)
+
+    def test_lag_and_latency(self):
+        self.assertEqual(self.queue.get_lag(), 0.0)
+        self.queue.put(0)
+        self.now += 2
+        self.queue.put(1)
+        self.now += 1
+        self.assertEqual(self.queue.get_lag(), 3.0)
+
+        self.queue.get_nowait()
+        self.assertEqual(self.queue.get_lag(), 1.0)
+        self.assertEqual(self.queue.max_latency, 3.0)
+        self.assertAlmostEqual(self.queue.latency,
+                               3.0 * SendQueue.LATENCY_WEIGHT)
+
+        stats = self.queue.get_stats()
+        self.assertEqual(stats["depth"], 1)
+        self.assertEqual(stats["peak_depth"], 2)
+        self.assertEqual(stats["dropped"], 0)
+
+    def test_get_waits_for_item(self):
+        async def run():
+            task = asyncio.ensure_future(self.queue.get())
+            await asyncio.sleep(0)
+            self.assertFalse(task.done())
+            self.queue.put("item")
+            return await task
+
+        self.assertEqual(self.loop.run_until_complete(run()), "item")
+
+
+class SendQueueLaneTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.queue = SendQueue(self.loop, 2, Client.LANE_COUNT,
+                               Client.get_lane)
+
+    def test_higher_lanes_first(self):
+        txs = [[Client.CMD_INFORM_TRANSACTION, i] for i in range(2)]
+        addr = [Client.CMD_SEND, "addr"]
+        req = [Client.CMD_REQ_BLOCK, b"", None]
+        block = [Client.CMD_INFORM_BLOCK, b""]
+        for cmd in (addr, txs[0], req, txs[1], block):
+            self.queue.put(cmd)
+
+        self.assertEqual(self.queue.peek_nowait(), block)
+        self.assertEqual([self.queue.get_nowait() for _ in range(5)],
+                         [block, req] + txs + [addr])
+
+    def test_lanes_bounded_separately(self):
+        for i in range(3):
+            self.queue.put([Client.CMD_INFORM_TRANSACTION, i],
+                           droppable=True)
+            self.queue.put([Client.CMD_SEND, i], droppable=True)
+        self.assertEqual(self.queue.dropped, 2)
+        self.assertEqual(self.queue.get_stats()["lane_depths"],
+                         [0, 0, 2, 2])
+
+    def test_lag_of_oldest_lane_item(self):
+        now = [1000.0]
+        patcher = mock.patch.object(sendqueue, "time", SimpleNamespace(
+            monotonic=lambda: now[0]))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.queue.put([Client.CMD_INFORM_TRANSACTION])
+        now[0] += 5
+        self.queue.put([Client.CMD_INFORM_BLOCK])
+        self.queue.get_nowait()
+        self.assertEqual(self.queue.get_lag(), 5.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
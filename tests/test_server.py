@@ -0,0 +1,54 @@
+from kmacoin.globaldef.hash import HASH_OF_NULL
+from kmacoin.atnode.structures.blocktree import BlockTree
+from kmacoin.atnode.workers.server import Server
+
+from types import SimpleNamespace
+
+import asyncio
+import os
+import threading
+import unittest
+
+
+class ServerBlockRangeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.tree = BlockTree()
+        self.block_ids = []
+        prev_id = HASH_OF_NULL
+        for _ in range(10):
+            block_id = os.urandom(32)
+            self.tree.add(block_id, prev_id)
+            self.block_ids.append(block_id)
+            prev_id = block_id
+        self.server = SimpleNamespace(node=SimpleNamespace(
+            block_tree=self.tree, block_tree_lock=threading.Lock()))
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_get_block_range(self):
+        block_ids = self.loop.run_until_complete(Server.get_block_range(
+            self.server, [self.block_ids[3]], None, 4))
+        self.assertEqual(block_ids, self.block_ids[4:8])
+
+    def test_locked_tree_does_not_block_loop(self):
+        async def run():
+            task = asyncio.ensure_future(Server.get_block_range(
+                self.server, [self.block_ids[7]], None, 10))
+
+            # the loop keeps running while the tree is locked
+            await asyncio.sleep(0.05)
+            self.assertFalse(task.done())
+            lock.release()
+            return await task
+
+        lock = self.server.node.block_tree_lock
+        lock.acquire()
+        self.assertEqual(self.loop.run_until_complete(run()),
+                         self.block_ids[8:])
+
+
+if __name__ == "__main__":
+    unittest.main()